@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Buffered Bulk Alert Writer
+Collects alert documents and indexes them through the _bulk API,
+flushing by buffer size or elapsed time
+"""
+
+import time
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def retryable_status(status):
+    """Bulk item statuses worth retrying: back-pressure (429) and any server-side failure (5xx)"""
+    return status == 429 or status >= 500
+
+
+def bulk_operations(pending):
+    """_bulk body for (index, document) pairs, or (index, document, id) to index idempotently; id may be None"""
+    operations = []
+    for entry in pending:
+        action = {'_index': entry[0]}
+        if len(entry) > 2 and entry[2] is not None:
+            action['_id'] = entry[2]
+        operations.append({'index': action})
+        operations.append(entry[1])
+    return operations
+
+
+def request_failed(pending, error, final_attempt, stats):
+    """Whole request failed (connection error, timeout): everything is retryable"""
+    logger.error(f"Bulk request for {len(pending)} alerts failed: {str(error)}")
+    if final_attempt:
+        stats['failed'] += len(pending)
+    return [] if final_attempt else pending
+
+
+def bulk_retries(pending, response, final_attempt, stats):
+    """Account per-item results of a _bulk response; returns the documents to retry"""
+    if not response.get('errors'):
+        stats['indexed'] += len(pending)
+        return []
+
+    retry = []
+    for entry, item in zip(pending, response['items']):
+        result = item.get('index', {})
+        status = result.get('status', 0)
+        if status < 300:
+            stats['indexed'] += 1
+        elif retryable_status(status) and not final_attempt:
+            retry.append(entry)
+        else:
+            stats['failed'] += 1
+            logger.error(f"Failed to index alert into {entry[0]}: {status} {result.get('error')}")
+
+    return retry
+
+
+class BulkAlertWriter:
+    def __init__(self, es, max_docs=500, flush_interval=5.0, max_retries=3, retry_backoff=0.5):
+        self.es = es
+        self.max_docs = max_docs
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.stats = {'indexed': 0, 'failed': 0, 'retried': 0, 'flushes': 0}
+
+        # Time-based flushing runs off the scoring thread
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self.run_flusher, name='bulk-alert-flusher', daemon=True)
+        self.flusher.start()
+
+    def add(self, index, document, doc_id=None):
+        """Queue a document for indexing; flushes when the buffer is full"""
+        with self.lock:
+            self.buffer.append((index, document) if doc_id is None else (index, document, doc_id))
+            full = len(self.buffer) >= self.max_docs
+
+        if full:
+            self.flush()
+
+    def run_flusher(self):
+        """Flush periodically until close() is called"""
+        while not self.closed.wait(self.flush_interval / 2):
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Background alert flush failed: {str(e)}")
+
+    def flush(self):
+        """Send everything buffered so far; returns the number of failed documents"""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.buffer = self.buffer, []
+                self.last_flush = time.monotonic()
+
+            if not pending:
+                return 0
+
+            self.stats['flushes'] += 1
+            failed_before = self.stats['failed']
+            for attempt in range(self.max_retries + 1):
+                pending = self.send(pending, final_attempt=attempt == self.max_retries)
+                if not pending:
+                    break
+                self.stats['retried'] += len(pending)
+                logger.warning(f"Retrying {len(pending)} alert documents (attempt {attempt + 1}/{self.max_retries})")
+                time.sleep(self.retry_backoff * (2 ** attempt))
+
+            return self.stats['failed'] - failed_before
+
+    def send(self, pending, final_attempt=False):
+        """Issue one _bulk request and return the documents that should be retried"""
+        try:
+            response = self.es.bulk(operations=bulk_operations(pending))
+        except Exception as e:
+            return request_failed(pending, e, final_attempt, self.stats)
+
+        return bulk_retries(pending, response, final_attempt, self.stats)
+
+    def close(self):
+        """Stop the background flusher and flush whatever is left"""
+        self.closed.set()
+        self.flusher.join(timeout=self.flush_interval)
+        failed = self.flush()
+        logger.info(f"Alert writer closed: {self.stats}")
+        return failed
+
+
+class AsyncBulkAlertWriter:
+    """_bulk writer for the asyncio pipeline; the caller decides when to write"""
+
+    def __init__(self, es, max_docs=500, max_retries=3, retry_backoff=0.5):
+        self.es = es
+        self.max_docs = max_docs
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.stats = {'indexed': 0, 'failed': 0, 'retried': 0, 'flushes': 0}
+
+    async def write(self, documents):
+        """Index (index, document) pairs in max_docs chunks; returns the number that failed"""
+        failed = 0
+        for start in range(0, len(documents), self.max_docs):
+            failed += await self.write_chunk(documents[start:start + self.max_docs])
+        return failed
+
+    async def write_chunk(self, pending):
+        """One _bulk request with retries for transient per-item failures"""
+        self.stats['flushes'] += 1
+        failed_before = self.stats['failed']
+        for attempt in range(self.max_retries + 1):
+            final_attempt = attempt == self.max_retries
+            try:
+                response = await self.es.bulk(operations=bulk_operations(pending))
+                pending = bulk_retries(pending, response, final_attempt, self.stats)
+            except Exception as e:
+                pending = request_failed(pending, e, final_attempt, self.stats)
+            if not pending:
+                break
+            self.stats['retried'] += len(pending)
+            logger.warning(f"Retrying {len(pending)} alert documents (attempt {attempt + 1}/{self.max_retries})")
+            await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+
+        return self.stats['failed'] - failed_before
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Async Pipeline Benchmark
+Drains the same backlog with the sequential poll loop and with the
+pipelined asyncio loop, against in-memory Elasticsearch stand-ins that
+add a fixed round-trip latency to every request, then checks that a
+failed alert write with pages queued ahead leaves UEBA state and alerts
+exactly as a clean run does
+"""
+
+import os
+import sys
+import time
+import pickle
+import asyncio
+import logging
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from async_pipeline import AsyncDetectionPipeline
+from bench_suite import generate_pool, tile_events
+from inmemory_es import AsyncInMemoryElasticsearch, InMemoryElasticsearch
+from threat_detector import ThreatDetector
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def drain_sync(events, latency):
+    """poll_once() over the backlog; returns (seconds, events_processed)"""
+    with tempfile.TemporaryDirectory() as model_dir:
+        es = InMemoryElasticsearch(latency=latency)
+        es.load('security-events', events)
+        detector = ThreatDetector(model_dir=model_dir, es=es, retrain=False)
+        detector.analyze_behavioral_batch(events[:10])
+
+        started = time.perf_counter()
+        processed, _ = detector.poll_once()
+        detector.alert_writer.flush()
+        seconds = time.perf_counter() - started
+        detector.alert_writer.close()
+        return seconds, processed
+
+
+def drain_async(events, latency, queue_size):
+    """AsyncDetectionPipeline.drain() over the backlog; returns (seconds, events_processed, stats)"""
+    with tempfile.TemporaryDirectory() as model_dir:
+        backing = InMemoryElasticsearch()
+        backing.load('security-events', events)
+        detector = ThreatDetector(model_dir=model_dir, es=backing, retrain=False)
+        detector.analyze_behavioral_batch(events[:10])
+        pipeline = AsyncDetectionPipeline(detector, AsyncInMemoryElasticsearch(backing, latency=latency), queue_size)
+
+        started = time.perf_counter()
+        processed, _ = asyncio.run(pipeline.drain())
+        seconds = time.perf_counter() - started
+        pipeline.close()
+        detector.alert_writer.close()
+        return seconds, processed, pipeline.stats
+
+
+class FlakyAsyncElasticsearch(AsyncInMemoryElasticsearch):
+    """Answers 500 to every item of `failures` consecutive bulk requests, starting with request `fail_at`"""
+
+    def __init__(self, sync, fail_at, failures, latency=0.0):
+        super().__init__(sync, latency=latency)
+        self.fail_at = fail_at
+        self.failures = failures
+        self.bulk_requests = 0
+
+    async def bulk(self, **kwargs):
+        self.bulk_requests += 1
+        if self.fail_at <= self.bulk_requests < self.fail_at + self.failures:
+            await self.round_trip()
+            return {'errors': True, 'items': [{'index': {'status': 500, 'error': 'injected'}}
+                                              for _ in kwargs['operations'][::2]]}
+        return await super().bulk(**kwargs)
+
+
+def drain_with_failure(events, latency, queue_size, fail_at):
+    """Drain until caught up, with one page's alert write failing for good if fail_at is set
+
+    Returns (user state records sorted by key, alert count per index, events scored ahead of the failure)
+    """
+    with tempfile.TemporaryDirectory() as model_dir:
+        backing = InMemoryElasticsearch()
+        backing.load('security-events', events)
+        detector = ThreatDetector(model_dir=model_dir, es=backing, retrain=False)
+        writer_retries = 3
+        es = FlakyAsyncElasticsearch(backing, fail_at or 0, writer_retries + 1 if fail_at else 0, latency=latency)
+        pipeline = AsyncDetectionPipeline(detector, es, queue_size)
+        pipeline.writer.retry_backoff = 0.01
+
+        scored_ahead = 0
+        try:
+            asyncio.run(pipeline.drain())
+        except RuntimeError:
+            scored_ahead = len(detector.folded)
+            asyncio.run(pipeline.drain())
+        pipeline.close()
+        detector.alert_writer.close()
+
+        detector.user_state.flush()
+        records = np.sort(np.concatenate(list(detector.user_state.iter_records())), order='key')
+        alerts = {index: len(backing.data[index].documents) for index in ('threat-alerts', 'ueba-alerts')
+                  if index in backing.data}
+        return records, alerts, scored_ahead
+
+
+def failed_write_check(events, latency, queue_size):
+    """A write failing with pages scored ahead of it must not double-count UEBA state or duplicate alerts"""
+    clean_records, clean_alerts, _ = drain_with_failure(events, latency, queue_size, None)
+    records, alerts, scored_ahead = drain_with_failure(events, latency, queue_size, fail_at=2)
+    same_state = len(records) == len(clean_records) and all(
+        np.array_equal(records[field], clean_records[field]) for field in records.dtype.names)
+    logger.info(f"  failed write with {scored_ahead:,} events scored ahead: user state "
+                f"{'identical to' if same_state else 'DIFFERS from'} a clean run, alerts {alerts} vs clean {clean_alerts}")
+    if not same_state or alerts != clean_alerts:
+        raise AssertionError("Re-reading after a failed write changed UEBA state or duplicated alerts")
+
+
+def run(count, latency, queue_size, seed):
+    """Compare both loops on the same events"""
+    logging.getLogger('threat_detector').setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as work_dir:
+        pool_path = os.path.join(work_dir, 'events.pkl')
+        generate_pool(pool_path, min(count, 20000), 1000, seed)
+        with open(pool_path, 'rb') as f:
+            events = tile_events(pickle.load(f), count)
+
+    sync_seconds, sync_events = drain_sync(events, latency)
+    async_seconds, async_events, stats = drain_async(events, latency, queue_size)
+
+    logger.info(f"{count:,} events, {latency * 1000:.0f} ms per request")
+    logger.info(f"  sequential poll loop: {sync_events / sync_seconds:>10,.0f} ev/s ({sync_seconds:.2f}s)")
+    logger.info(f"  async pipeline:       {async_events / async_seconds:>10,.0f} ev/s ({async_seconds:.2f}s, "
+                f"{sync_seconds / async_seconds:.2f}x)")
+    logger.info(f"  async stage busy time: fetch {stats['fetch_seconds']:.2f}s, score {stats['score_seconds']:.2f}s, "
+                f"write {stats['write_seconds']:.2f}s")
+    failed_write_check(events[:min(count, 20000)], latency, queue_size)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Async pipeline benchmark')
+    parser.add_argument('--events', type=int, default=100000, help='Backlog size (default: 100000)')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Simulated seconds per Elasticsearch request (default: 0.02)')
+    parser.add_argument('--queue-size', type=int, default=2, help='Pages buffered between stages (default: 2)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    args = parser.parse_args()
+    run(args.events, args.latency, args.queue_size, args.seed)
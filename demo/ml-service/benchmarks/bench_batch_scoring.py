@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Batch Scoring Micro-Benchmark
+Compares per-event detect_anomaly() against the batched detect_anomalies() path
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from threat_detector import ThreatDetector
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def make_events(count, seed=42):
+    """Generate events shaped like the data generator output"""
+    rng = random.Random(seed)
+    events = []
+    for _ in range(count):
+        if rng.random() < 0.9:
+            events.append({
+                'failed_logins': 0,
+                'packet_count': rng.randint(100, 500),
+                'byte_count': rng.randint(10000, 100000),
+                'connection_duration': rng.randint(5, 300),
+                'port_scan_score': 0
+            })
+        else:
+            failed_attempts = rng.randint(6, 50)
+            events.append({
+                'failed_logins': failed_attempts,
+                'packet_count': failed_attempts * 10,
+                'byte_count': failed_attempts * 1000,
+                'connection_duration': 1,
+                'port_scan_score': rng.randint(0, 100)
+            })
+    return events
+
+
+def time_call(func, *args):
+    """Return wall-clock seconds for a single call"""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run(sizes, per_event_limit):
+    """Run the benchmark for each batch size and log events/sec"""
+    with tempfile.TemporaryDirectory() as model_dir:
+        detector = ThreatDetector(model_dir=model_dir)
+
+        for size in sizes:
+            events = make_events(size)
+
+            batch_seconds = time_call(detector.detect_anomalies, events)
+
+            # Per-event scoring is slow enough that large sizes are extrapolated
+            sample = events[:min(size, per_event_limit)]
+            loop_seconds = time_call(lambda: [detector.detect_anomaly(e) for e in sample])
+            loop_seconds *= size / len(sample)
+
+            logger.info(
+                f"{size:>8} events | per-event: {size / loop_seconds:>12,.0f} ev/s | "
+                f"batched: {size / batch_seconds:>12,.0f} ev/s | "
+                f"speedup: {loop_seconds / batch_seconds:>8.1f}x"
+            )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Batch scoring micro-benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000, 100000],
+                        help='Batch sizes to benchmark (default: 100 10000 100000)')
+    parser.add_argument('--per-event-limit', type=int, default=2000,
+                        help='Max events scored one by one before extrapolating (default: 2000)')
+
+    args = parser.parse_args()
+    run(args.sizes, args.per_event_limit)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Cold Start Benchmark
+Spawns fresh detector processes against an empty model volume (training
+the baseline, or adopting the baked seed) and a warm registry, reporting
+time-to-first-score from process spawn, in-process and through the
+scoring API's /ready and /score endpoints
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import tempfile
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+EVENT = {'failed_logins': 4, 'packet_count': 900, 'byte_count': 120000, 'connection_duration': 30, 'port_scan_score': 0}
+
+
+def child(model_dir, seed_registry, api_port):
+    """Detector process: score one event in-process (or serve the API) and report timings as JSON"""
+    started = time.time()
+    from threat_detector import ThreatDetector
+    from inmemory_es import InMemoryElasticsearch
+    imported = time.time()
+
+    logging.disable(logging.INFO)
+    detector = ThreatDetector(model_dir=model_dir, es=InMemoryElasticsearch(), retrain=False,
+                              seed_registry=seed_registry or None, api_port=api_port)
+    initialized = time.time()
+    if api_port:
+        detector.process_events()
+        return
+
+    detector.detect_anomalies([EVENT])
+    scored = time.time()
+    print(json.dumps({
+        'import_seconds': imported - started,
+        'init_seconds': initialized - imported,
+        'score_seconds': scored - initialized,
+        'sklearn_imported': 'sklearn' in sys.modules,
+        'elasticsearch_imported': 'elasticsearch' in sys.modules
+    }))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn(model_dir, seed_registry, api_port=None):
+    command = [sys.executable, os.path.abspath(__file__), '--child', model_dir, '--seed', seed_registry or '']
+    if api_port:
+        command += ['--port', str(api_port)]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(BENCH_DIR, '..'), BENCH_DIR]))
+    return subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+
+def in_process(model_dir, seed_registry):
+    """Spawn-to-first-score seconds plus the child's own phase timings"""
+    started = time.perf_counter()
+    process = spawn(model_dir, seed_registry)
+    output, _ = process.communicate()
+    total = time.perf_counter() - started
+    return total, json.loads(output)
+
+
+def through_api(model_dir, seed_registry):
+    """Seconds from spawn until /ready answers 200, and until the first /score response"""
+    port = free_port()
+    started = time.perf_counter()
+    process = spawn(model_dir, seed_registry, port)
+    ready = None
+    try:
+        while ready is None:
+            if process.poll() is not None:
+                raise RuntimeError('detector exited before becoming ready')
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=1) as response:
+                    if response.status == 200:
+                        ready = time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+
+        request = urllib.request.Request(f'http://127.0.0.1:{port}/score', data=json.dumps(EVENT).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            json.load(response)
+        return ready, time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run(repeats, api):
+    from model_registry import ModelRegistry
+    from threat_detector import train_synthetic_model
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        seed = os.path.join(work_dir, 'seed')
+        train_synthetic_model(ModelRegistry(seed))
+        warm = os.path.join(work_dir, 'warm')
+        subprocess.run([sys.executable, '-c', 'pass'])
+        in_process(warm, seed)
+
+        scenarios = [
+            ('empty volume, train', lambda i: (os.path.join(work_dir, f'train-{i}'), None)),
+            ('empty volume, seed', lambda i: (os.path.join(work_dir, f'seed-{i}'), seed)),
+            ('warm registry', lambda i: (warm, None))
+        ]
+        for name, setup in scenarios:
+            totals, phases = [], []
+            for i in range(repeats):
+                total, timings = in_process(*setup(i))
+                totals.append(total)
+                phases.append(timings)
+            logger.info(
+                f"{name:>20} | first score {statistics.median(totals):6.2f}s from spawn | "
+                f"import {statistics.median(p['import_seconds'] for p in phases):5.2f}s | "
+                f"init {statistics.median(p['init_seconds'] for p in phases):5.2f}s | "
+                f"score {statistics.median(p['score_seconds'] for p in phases) * 1000:5.1f} ms | "
+                f"sklearn imported: {phases[-1]['sklearn_imported']}"
+            )
+            if api:
+                ready, scored = zip(*(through_api(*setup(repeats + i)) for i in range(repeats)))
+                logger.info(f"{'':>20} | API /ready {statistics.median(ready):6.2f}s | "
+                            f"first /score {statistics.median(scored):6.2f}s from spawn")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Cold start / time-to-first-score benchmark')
+    parser.add_argument('--repeats', type=int, default=5, help='Processes per scenario (default: 5)')
+    parser.add_argument('--no-api', action='store_true', help='Skip the scoring API measurements')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--seed', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.seed, args.port)
+    else:
+        run(args.repeats, not args.no_api)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Compiled Forest Benchmark
+Checks CompiledForest against sklearn's IsolationForest.score_samples and
+compares per-call latency and batch throughput
+"""
+
+import os
+import sys
+import time
+import logging
+
+import numpy as np
+from sklearn.ensemble import IsolationForest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from compiled_forest import CompiledForest
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def best_of(func, X, repeats):
+    """Best wall-clock seconds over several calls"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(X)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(sizes, n_estimators):
+    """Fit a forest like ThreatDetector does and compare both scorers"""
+    rng = np.random.default_rng(42)
+    model = IsolationForest(contamination=0.1, random_state=42, n_estimators=n_estimators)
+    model.fit(rng.normal(size=(1000, 5)))
+    compiled = CompiledForest.from_isolation_forest(model)
+
+    for size in sizes:
+        X = rng.normal(size=(size, 5)) * 2
+        max_error = np.abs(model.score_samples(X) - compiled.score_samples(X)).max()
+        if max_error > 1e-9:
+            raise AssertionError(f"Compiled scores diverge from sklearn by {max_error}")
+
+        repeats = max(3, min(200, 20000 // size))
+        sklearn_seconds = best_of(model.score_samples, X, repeats)
+        compiled_seconds = best_of(compiled.score_samples, X, repeats)
+
+        logger.info(
+            f"{size:>8} events | sklearn: {sklearn_seconds * 1e6 / size:>9.2f} us/ev | "
+            f"compiled: {compiled_seconds * 1e6 / size:>9.2f} us/ev | "
+            f"speedup: {sklearn_seconds / compiled_seconds:>6.1f}x | max |diff|: {max_error:.1e}"
+        )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compiled IsolationForest benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 1000, 10000, 100000],
+                        help='Batch sizes to benchmark (default: 1 10 100 1000 10000 100000)')
+    parser.add_argument('--trees', type=int, default=100, help='Number of trees (default: 100)')
+
+    args = parser.parse_args()
+    run(args.sizes, args.trees)
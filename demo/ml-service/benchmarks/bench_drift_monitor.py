@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Drift Monitor Benchmark
+Feeds generator feature vectors through the per-feature KLL sketches,
+reporting sketch memory and throughput as volume grows, then replays a
+stable-then-shifted traffic timeline window by window to compare
+sketch drift with exact KS distance and count drift-gated retrains
+against a fixed schedule
+"""
+
+import os
+import sys
+import time
+import pickle
+import logging
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_suite import generate_pool
+from drift_monitor import DriftMonitor, feature_sketches
+from inmemory_es import InMemoryElasticsearch
+from threat_detector import FEATURE_NAMES, ThreatDetector
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def exact_ks(a, b):
+    """Exact two-sample KS distance, column by column"""
+    distances = []
+    for column in range(a.shape[1]):
+        x, y = np.sort(a[:, column]), np.sort(b[:, column])
+        points = np.concatenate([x, y])
+        distances.append(np.max(np.abs(np.searchsorted(x, points, side='right') / len(x)
+                                       - np.searchsorted(y, points, side='right') / len(y))))
+    return np.array(distances)
+
+
+def shifted(rows, rng):
+    """Traffic after a change: larger transfers and longer connections for half the events"""
+    rows = rows.copy()
+    moved = rng.random(len(rows)) < 0.5
+    rows[moved, FEATURE_NAMES.index('byte_count')] *= 3
+    rows[moved, FEATURE_NAMES.index('connection_duration')] += 120
+    return rows
+
+
+def volume(features, sizes, page_size, detector):
+    """Sketch bytes and update throughput as the event count grows"""
+    pages = [features[i:i + page_size] for i in range(0, len(features), page_size)]
+    started = time.perf_counter()
+    for page in pages:
+        detector.score_features(page)
+    scoring_rate = len(features) / (time.perf_counter() - started)
+
+    for size in sizes:
+        monitor = DriftMonitor(FEATURE_NAMES, window=size + 1, min_events=size + 1, seed=0)
+        started = time.perf_counter()
+        fed = 0
+        while fed < size:
+            page = pages[(fed // page_size) % len(pages)][:size - fed]
+            monitor.observe(page)
+            fed += len(page)
+        seconds = time.perf_counter() - started
+        retained = sum(sketch.retained() for sketch in monitor.live)
+        logger.info(f"{size:>11,} events | {retained:>5} items retained | {monitor.nbytes():>6,} bytes for "
+                    f"{len(FEATURE_NAMES)} sketches | {size / seconds:>11,.0f} ev/s "
+                    f"({scoring_rate / (size / seconds):.1%} of scoring time)")
+
+
+def timeline(features, windows, window, threshold, schedule_every, seed):
+    """Window-by-window drift with drift-gated retrains; returns (drift retrains, scheduled retrains)"""
+    rng = np.random.default_rng(seed)
+    reference_rows = features[rng.integers(0, len(features), size=window)]
+    monitor = DriftMonitor(FEATURE_NAMES, threshold=threshold, window=window, min_events=window, seed=seed)
+    monitor.set_reference('initial', feature_sketches(reference_rows))
+
+    retrains = 0
+    for number in range(windows):
+        rows = features[rng.integers(0, len(features), size=window)]
+        phase = 'shifted' if windows // 3 <= number else 'stable'
+        if phase == 'shifted':
+            rows = shifted(rows, rng)
+        monitor.observe(rows)
+
+        exact = exact_ks(rows, reference_rows)
+        fired = monitor.drifted()
+        logger.info(f"window {number:>3} {phase:>8} | sketch drift {monitor.max_drift():.3f} "
+                    f"({monitor.most_drifted()}) | exact {exact.max():.3f} | "
+                    f"{'RETRAIN' if fired else 'keep model'}")
+        if fired:
+            # Stand-in for a reservoir retrain: the new model's reference is recent traffic
+            retrains += 1
+            reference_rows = rows
+            monitor.set_reference(f'retrain-{retrains}', feature_sketches(rows))
+    return retrains, windows // schedule_every
+
+
+def run(pool_size, sizes, page_size, windows, window, threshold, schedule_every, seed):
+    with tempfile.TemporaryDirectory() as work_dir:
+        pool_path = os.path.join(work_dir, 'pool.pkl')
+        generate_pool(pool_path, pool_size, 500, seed)
+        with open(pool_path, 'rb') as f:
+            pool = pickle.load(f)
+
+        logging.disable(logging.INFO)
+        detector = ThreatDetector(model_dir=work_dir, es=InMemoryElasticsearch(), retrain=False)
+        logging.disable(logging.NOTSET)
+        features = detector.extract_features_batch(pool)
+
+        volume(features, sizes, page_size, detector)
+        drift_retrains, scheduled = timeline(features, windows, window, threshold, schedule_every, seed)
+        logger.info(f"{windows} windows of {window:,} events: {drift_retrains} drift-triggered retrain(s) "
+                    f"vs {scheduled} on a schedule of one per {schedule_every} windows")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Streaming drift monitor benchmark')
+    parser.add_argument('--pool-size', type=int, default=20000, help='Generator events to sample from (default: 20000)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000, 10000000],
+                        help='Event counts for the memory/throughput table')
+    parser.add_argument('--page-size', type=int, default=1000, help='Events per observed page (default: 1000)')
+    parser.add_argument('--windows', type=int, default=12, help='Drift windows in the timeline (default: 12)')
+    parser.add_argument('--window', type=int, default=50000, help='Events per drift window (default: 50000)')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Drift threshold (default: 0.2)')
+    parser.add_argument('--schedule-every', type=int, default=2,
+                        help='Windows between retrains on the fixed schedule being compared (default: 2)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    args = parser.parse_args()
+    run(args.pool_size, args.sizes, args.page_size, args.windows, args.window, args.threshold, args.schedule_every,
+        args.seed)
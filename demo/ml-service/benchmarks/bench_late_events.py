@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Late Event Benchmark
+Indexes generator events round by round with a share of them arriving
+late, polls after every round and reports, per allowed lateness, how many
+events were consumed once, twice or never, and the cost of re-scanning
+the lateness window; then the memory and per-page cost of the seen ids at
+a sustained event rate
+"""
+
+import os
+import sys
+import time
+import random
+import pickle
+import logging
+import tempfile
+from collections import Counter
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_suite import generate_pool
+import numpy as np
+
+from event_consumer import SEEN_DTYPE, EventConsumer, SeenIds
+from inmemory_es import InMemoryElasticsearch
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def arrivals(pool, rounds, per_round, interval, late_share, max_delay, seed):
+    """Events grouped by the round they are indexed in, stamped with their event time"""
+    rng = random.Random(seed)
+    start = time.time() - rounds * interval - max_delay
+    batches = [[] for _ in range(rounds)]
+    serial = 0
+    for round_number in range(rounds):
+        for _ in range(per_round):
+            delay = rng.uniform(0, max_delay) if rng.random() < late_share else rng.uniform(0, interval)
+            event_time = start + round_number * interval + rng.uniform(0, interval)
+            arrival = min(rounds - 1, round_number + int(delay // interval))
+            event = dict(rng.choice(pool), serial=serial)
+            event['@timestamp'] = datetime.fromtimestamp(event_time, timezone.utc).isoformat()
+            batches[arrival].append(event)
+            serial += 1
+    return batches, serial
+
+
+def consume(batches, lateness, page_size, work_dir):
+    """Poll after each round; returns (consumed count per serial, seconds polling, consumer)"""
+    es = InMemoryElasticsearch()
+    consumer = EventConsumer(es, checkpoint_path=os.path.join(work_dir, f'late-{lateness}.checkpoint.json'),
+                             page_size=page_size, start_from='1970-01-01T00:00:00', allowed_lateness=lateness)
+    consumed = Counter()
+    seconds = 0.0
+    for batch in batches:
+        es.load('security-events', batch)
+        started = time.perf_counter()
+        for hits in consumer.poll():
+            consumed.update(hit['_source']['serial'] for hit in hits)
+            consumer.commit()
+        seconds += time.perf_counter() - started
+    return consumed, seconds, consumer
+
+
+def seen_ids_at_rate(rate, lateness, page_size, seed):
+    """Commit pages at `rate` events/s for twice the lateness window, as the consumer does
+
+    Returns (ids held, bytes, ms per commit, ms per page membership check)
+    once the window is full.
+    """
+    rng = np.random.default_rng(seed)
+    seen = SeenIds()
+    page_ms = page_size / rate * 1000.0
+    pages = int(2 * lateness * rate / page_size)
+    commit_seconds, check_seconds, measured = 0.0, 0.0, 0
+    for page in range(pages):
+        entries = np.empty(page_size, dtype=SEEN_DTYPE)
+        entries['key'] = rng.integers(0, 2 ** 63, page_size, dtype=np.uint64)
+        entries['ts'] = page * page_ms + rng.uniform(0, page_ms, page_size)
+        probe = rng.integers(0, 2 ** 63, page_size, dtype=np.uint64)
+
+        started = time.perf_counter()
+        seen.add(entries)
+        seen.expire((page + 1) * page_ms - lateness * 1000.0)
+        checked = time.perf_counter()
+        seen.contains(probe)
+        if page >= pages // 2:
+            commit_seconds += checked - started
+            check_seconds += time.perf_counter() - checked
+            measured += 1
+    return len(seen), seen.nbytes(), commit_seconds / measured * 1000, check_seconds / measured * 1000
+
+
+def run(rounds, per_round, interval, late_share, max_delay, lateness_options, page_size, seed, rate):
+    with tempfile.TemporaryDirectory() as work_dir:
+        pool_path = os.path.join(work_dir, 'pool.pkl')
+        generate_pool(pool_path, 5000, 500, seed)
+        with open(pool_path, 'rb') as f:
+            pool = pickle.load(f)
+        batches, total = arrivals(pool, rounds, per_round, interval, late_share, max_delay, seed)
+        logger.info(f"{total:,} events over {rounds} rounds of {interval:.0f}s, "
+                    f"{late_share:.0%} delayed by up to {max_delay:.0f}s")
+
+        for lateness in lateness_options:
+            consumed, seconds, consumer = consume(batches, lateness, page_size, work_dir)
+            once = sum(1 for count in consumed.values() if count == 1)
+            repeated = sum(1 for count in consumed.values() if count > 1)
+            missed = total - len(consumed)
+            logger.info(
+                f"lateness {lateness:>5.0f}s | once {once / total:7.2%} | more than once {repeated:>5} | "
+                f"missed {missed / total:6.2%} | late consumed {consumer.stats['late_events']:>6,} | "
+                f"rescanned {consumer.stats['rescanned_hits'] / total:5.2f} hits/event | "
+                f"{total / seconds:>9,.0f} ev/s polling | seen ids {len(consumer.seen):>6,}"
+            )
+
+    for lateness in lateness_options:
+        if lateness <= 0:
+            continue
+        held, nbytes, commit_ms, check_ms = seen_ids_at_rate(rate, lateness, page_size, seed)
+        logger.info(
+            f"{rate:,.0f} ev/s x {lateness:>4.0f}s lateness | seen ids {held:>10,} | {nbytes / 2 ** 20:7.1f} MB | "
+            f"commit {commit_ms:6.2f} ms/page | membership {check_ms:5.2f} ms/page"
+        )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Late and out-of-order event benchmark')
+    parser.add_argument('--rounds', type=int, default=60, help='Poll rounds (default: 60)')
+    parser.add_argument('--per-round', type=int, default=2000, help='Events indexed per round (default: 2000)')
+    parser.add_argument('--interval', type=float, default=60, help='Event-time seconds per round (default: 60)')
+    parser.add_argument('--late-share', type=float, default=0.1,
+                        help='Share of events delayed beyond one round (default: 0.1)')
+    parser.add_argument('--max-delay', type=float, default=600, help='Longest delivery delay in seconds (default: 600)')
+    parser.add_argument('--lateness', type=float, nargs='+', default=[0, 60, 300, 900],
+                        help='Allowed lateness settings to compare, in seconds (default: 0 60 300 900)')
+    parser.add_argument('--page-size', type=int, default=1000, help='Events per page (default: 1000)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    parser.add_argument('--rate', type=float, default=10000,
+                        help='Sustained events/s for the seen-id memory measurement (default: 10000)')
+
+    args = parser.parse_args()
+    run(args.rounds, args.per_round, args.interval, args.late_share, args.max_delay, args.lateness, args.page_size,
+        args.seed, args.rate)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Offline Training Benchmark
+Trains on a large synthetic export built from generator feature rows,
+reporting per-phase time and peak RSS against the export's size on disk,
+then measures export throughput from the in-memory Elasticsearch stand-in
+"""
+
+import os
+import sys
+import time
+import pickle
+import logging
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_suite import generate_pool, tile_events
+from inmemory_es import InMemoryElasticsearch
+from model_registry import ModelRegistry
+from offline_trainer import FeatureExport, OfflineTrainer, export_from_es, peak_rss_mb
+from threat_detector import FEATURE_NAMES, ThreatDetector
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def build_export(path, pool, rows, chunk_rows, seed):
+    """Export of `rows` pool feature rows with multiplicative jitter, written chunk by chunk"""
+    rng = np.random.default_rng(seed)
+    features = ThreatDetector.extract_features_batch(pool)
+    strata = [str(event.get('event_type', 'unknown')) for event in pool]
+    export = FeatureExport.create(path, FEATURE_NAMES, 'event_type', source={'synthetic': rows})
+    for start in range(0, rows, chunk_rows):
+        picks = rng.integers(0, len(pool), size=min(chunk_rows, rows - start))
+        jitter = rng.uniform(0.9, 1.1, size=(len(picks), len(FEATURE_NAMES)))
+        export.append_rows(np.round(features[picks] * jitter), [strata[i] for i in picks])
+    export.close()
+    return export
+
+
+def run(export_events, rows, sample_size, n_jobs_options, pool_size, seed):
+    logging.getLogger('offline_trainer').setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as work_dir:
+        pool_path = os.path.join(work_dir, 'pool.pkl')
+        generate_pool(pool_path, pool_size, 1000, seed)
+        with open(pool_path, 'rb') as f:
+            pool = pickle.load(f)
+
+        started = time.perf_counter()
+        export = build_export(os.path.join(work_dir, 'export'), pool, rows, 1000000, seed)
+        export_mb = export.rows * len(FEATURE_NAMES) * 8 / 1024 ** 2
+        logger.info(f"Synthetic export: {rows:,} rows, {export_mb:,.0f} MB on disk, "
+                    f"built in {time.perf_counter() - started:.1f}s")
+
+        rss_before = peak_rss_mb()
+        for n_jobs in n_jobs_options:
+            trainer = OfflineTrainer(ModelRegistry(os.path.join(work_dir, 'registry')), sample_size=sample_size,
+                                     n_jobs=n_jobs)
+            version, stats = trainer.train(FeatureExport.open(export.path))
+            phases = stats['phase_seconds']
+            logger.info(
+                f"n_jobs {n_jobs:>3} | scaler {phases['scaler_seconds']:6.1f}s | sample {phases['sample_seconds']:6.1f}s | "
+                f"fit {phases['fit_seconds']:6.1f}s | total {stats['training_seconds']:6.1f}s | "
+                f"sample rows {stats['sample_rows']:,} | peak RSS {stats['peak_rss_mb']:,.0f} MB "
+                f"(before training {rss_before:,.0f} MB)"
+            )
+        logger.info(f"Sample per stratum: {stats['strata_sample_rows']} of {stats['strata_rows']}")
+
+        # Last, so the stand-in's memory does not inflate the training peak above
+        es = InMemoryElasticsearch()
+        es.load('security-events', tile_events(pool, export_events))
+        started = time.perf_counter()
+        export_from_es(es, os.path.join(work_dir, 'es-export'), '1970-01-01T00:00:00', '9999-12-31T00:00:00')
+        seconds = time.perf_counter() - started
+        logger.info(f"ES export: {export_events:,} events in {seconds:.2f}s ({export_events / seconds:,.0f} ev/s)")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Offline training benchmark')
+    parser.add_argument('--export-events', type=int, default=200000,
+                        help='Events exported from the Elasticsearch stand-in (default: 200000)')
+    parser.add_argument('--rows', type=int, default=20000000, help='Rows in the training export (default: 20000000)')
+    parser.add_argument('--sample-size', type=int, default=1000000,
+                        help='Stratified subsample rows (default: 1000000)')
+    parser.add_argument('--n-jobs', type=int, nargs='+', default=[1, -1],
+                        help='Forest fit parallelism settings to compare (default: 1 -1)')
+    parser.add_argument('--pool-size', type=int, default=20000, help='Distinct generator events (default: 20000)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    args = parser.parse_args()
+    run(args.export_events, args.rows, args.sample_size, args.n_jobs, args.pool_size, args.seed)
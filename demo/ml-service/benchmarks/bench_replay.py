@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Replay Benchmark
+Backfills generator events from NDJSON.gz dumps and from a sliced scroll
+over the in-memory Elasticsearch stand-in, reporting throughput per worker
+count (including pool start-up) and peak worker RSS, which should not
+grow with the size of the range
+"""
+
+import os
+import sys
+import json
+import gzip
+import pickle
+import logging
+import tempfile
+import functools
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_suite import generate_pool, tile_events
+from inmemory_es import InMemoryElasticsearch
+from replay import ReplayJob
+from threat_detector import ThreatDetector
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+RANGE_SECONDS = 30 * 86400
+
+
+class DiscardingElasticsearch(InMemoryElasticsearch):
+    """Acknowledges bulk writes without keeping them, so worker RSS reflects the replay alone"""
+
+    def bulk(self, operations=None, body=None, **kwargs):
+        self.requests['bulk'] += 1
+        self.round_trip()
+        operations = operations if operations is not None else body
+        items = [{'index': {'_index': action['index']['_index'], 'status': 201}} for action in operations[::2]]
+        return {'errors': False, 'items': items}
+
+
+def target_es(latency=0.0):
+    """Worker-side client for the dump runs"""
+    return DiscardingElasticsearch(latency=latency)
+
+
+def source_es(events_path, latency=0.0):
+    """Worker-side client holding the whole source index, for the sliced-scroll run"""
+    es = DiscardingElasticsearch(latency=latency)
+    with open(events_path, 'rb') as f:
+        es.load('security-events', pickle.load(f))
+    return es
+
+
+def write_dumps(events, work_dir, files):
+    """Split events across `files` gzip NDJSON dumps, formatted as ES hits"""
+    paths = [os.path.join(work_dir, f'security-events-{i:03d}.ndjson.gz') for i in range(files)]
+    per_file = -(-len(events) // files)
+    for i, path in enumerate(paths):
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            for offset, event in enumerate(events[i * per_file:(i + 1) * per_file]):
+                f.write(json.dumps({'_id': f'evt-{i}-{offset}', '_source': event}) + '\n')
+    return paths
+
+
+def replay(label, work_dir, start, end, **options):
+    progress_path = os.path.join(work_dir, f'progress-{label}.json')
+    job = ReplayJob(start, end, 'security-events-rescored', model_dir=work_dir, progress_path=progress_path,
+                    report_interval=60.0, **options)
+    report = job.run(restart=True)
+    logger.info(f"{label:>24} | {report['events']:>9,} events | {report['events_per_second']:>9,.0f} ev/s | "
+                f"{report['anomalies']:>9,} anomalies | peak worker RSS {report['worker_peak_rss_mb']:7.1f} MB")
+
+    # A rerun with the same progress file has nothing left to do
+    rerun = ReplayJob(start, end, 'security-events-rescored', model_dir=work_dir, progress_path=progress_path,
+                      report_interval=60.0, **options).run()
+    assert rerun['events'] == 0, f"resumed replay re-read {rerun['events']} events"
+    return report
+
+
+def run(sizes, worker_counts, files, pool_size, latency, scroll_events, seed):
+    logging.getLogger('threat_detector').setLevel(logging.ERROR)
+    logging.getLogger('replay').setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Bootstraps the registry the replay workers load from
+        ThreatDetector(model_dir=work_dir, es=InMemoryElasticsearch(), retrain=False).alert_writer.close()
+
+        pool_path = os.path.join(work_dir, 'pool.pkl')
+        generate_pool(pool_path, pool_size, 1000, seed)
+        with open(pool_path, 'rb') as f:
+            pool = pickle.load(f)
+
+        for size in sizes:
+            events = tile_events(pool, size, span_seconds=RANGE_SECONDS)
+            start, end = '1970-01-01T00:00:00', '9999-12-31T00:00:00'
+            dump_dir = os.path.join(work_dir, f'dumps-{size}')
+            os.makedirs(dump_dir)
+            paths = write_dumps(events, dump_dir, files)
+            del events
+
+            for workers in worker_counts:
+                replay(f'{size:,} from dumps x{workers}', work_dir, start, end, files=paths, workers=workers,
+                       es_factory=functools.partial(target_es, latency))
+
+        events = tile_events(pool, scroll_events, span_seconds=RANGE_SECONDS)
+        events_path = os.path.join(work_dir, 'scroll-events.pkl')
+        with open(events_path, 'wb') as f:
+            pickle.dump(events, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for workers in worker_counts:
+            replay(f'{scroll_events:,} sliced scroll x{workers}', work_dir, '1970-01-01T00:00:00',
+                   '9999-12-31T00:00:00', workers=workers, es_factory=functools.partial(source_es, events_path, latency))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay / backfill benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 400000],
+                        help='Events per dump-based replay (default: 100000 400000)')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}),
+                        help='Worker counts to compare (default: 1 and the CPU count)')
+    parser.add_argument('--files', type=int, default=8, help='Dump files per size (default: 8)')
+    parser.add_argument('--pool-size', type=int, default=20000, help='Distinct generator events (default: 20000)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Simulated seconds per Elasticsearch request (default: 0)')
+    parser.add_argument('--scroll-events', type=int, default=50000,
+                        help='Events in the sliced-scroll run (default: 50000)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    args = parser.parse_args()
+    run(args.sizes, args.workers, args.files, args.pool_size, args.latency, args.scroll_events, args.seed)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Score Cache Benchmark
+Scores generator events page by page with the score cache off, in exact
+mode and with quantization, reporting throughput, hit rate and how far
+quantized scores move from the uncached ones
+"""
+
+import os
+import sys
+import time
+import pickle
+import logging
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_suite import generate_pool
+from inmemory_es import InMemoryElasticsearch
+from score_cache import ScoreCache, parse_quantization
+from threat_detector import FEATURE_NAMES, ThreatDetector
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUANTIZATION = ['packet_count=100', 'byte_count=20000', 'connection_duration=60']
+
+
+def score_pages(detector, pages):
+    """Seconds to score every page, and the concatenated anomaly scores"""
+    scores = []
+    started = time.perf_counter()
+    for page in pages:
+        scores.extend(result['anomaly_score'] for result in detector.score_features(page))
+    return time.perf_counter() - started, np.array(scores)
+
+
+def run(count, page_size, capacity, quantization, seed):
+    """Compare cache settings on the same detector and events"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        pool_path = os.path.join(work_dir, 'events.pkl')
+        generate_pool(pool_path, count, 1000, seed)
+        with open(pool_path, 'rb') as f:
+            events = pickle.load(f)
+
+        detector = ThreatDetector(model_dir=work_dir, es=InMemoryElasticsearch(), retrain=False)
+        features = detector.extract_features_batch(events)
+        pages = [features[i:i + page_size] for i in range(0, len(features), page_size)]
+        threshold = -detector.active_model.compiled.offset_
+
+        settings = [('off', None), ('exact', {}), ('quantized', quantization)]
+        baseline_seconds, baseline = None, None
+        for name, steps in settings:
+            detector.score_cache = None if steps is None else ScoreCache(FEATURE_NAMES, capacity, steps)
+            seconds, scores = score_pages(detector, pages)
+            if baseline is None:
+                baseline_seconds, baseline = seconds, scores
+
+            cache = detector.score_cache
+            error = np.abs(scores - baseline)
+            flipped = np.count_nonzero((scores > threshold) != (baseline > threshold))
+            logger.info(
+                f"{name:>9} | {count / seconds:>10,.0f} ev/s ({baseline_seconds / seconds:.2f}x) | "
+                f"hit rate {cache.hit_rate() if cache else 0.0:6.1%} | "
+                f"entries {len(cache.entries) if cache else 0:>7} | "
+                f"score error mean {error.mean():.4f} max {error.max():.4f} | flipped verdicts {flipped}"
+            )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Score cache benchmark')
+    parser.add_argument('--events', type=int, default=50000, help='Generator events to score (default: 50000)')
+    parser.add_argument('--page-size', type=int, default=1000, help='Events per scoring call (default: 1000)')
+    parser.add_argument('--capacity', type=int, default=100000, help='Cache entries (default: 100000)')
+    parser.add_argument('--quantization', nargs='*', metavar='FEATURE=STEP', default=DEFAULT_QUANTIZATION,
+                        help=f'Steps for the quantized run (default: {" ".join(DEFAULT_QUANTIZATION)})')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    args = parser.parse_args()
+    run(args.events, args.page_size, args.capacity, parse_quantization(args.quantization), args.seed)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Scoring API Benchmark
+Fires concurrent single-event requests at the micro-batching scoring API
+and reports request throughput, latency percentiles and batch sizes
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+
+import aiohttp
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_batch_scoring import make_events
+from inmemory_es import InMemoryElasticsearch
+from scoring_api import ScoringServer
+from threat_detector import ThreatDetector
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+async def client(session, url, events, latencies):
+    """Send events one request at a time"""
+    for event in events:
+        started = time.perf_counter()
+        async with session.post(url, json=event) as response:
+            await response.json()
+        latencies.append(time.perf_counter() - started)
+
+
+async def load(port, events, concurrency):
+    """Split events across `concurrency` clients; returns (seconds, latencies)"""
+    url = f'http://127.0.0.1:{port}/score'
+    latencies = []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session, url, events[i::concurrency], latencies) for i in range(concurrency)))
+        return time.perf_counter() - started, latencies
+
+
+def run(requests, concurrency, max_delays, port):
+    """Benchmark each max_delay setting against the same detector"""
+    with tempfile.TemporaryDirectory() as model_dir:
+        detector = ThreatDetector(model_dir=model_dir, es=InMemoryElasticsearch(), retrain=False)
+        events = make_events(requests)
+
+        for max_delay in max_delays:
+            server = ScoringServer(detector, host='127.0.0.1', port=port, max_delay=max_delay)
+            server.start()
+            seconds, latencies = asyncio.run(load(port, events, concurrency))
+            server.stop()
+
+            latencies_ms = np.array(latencies) * 1000.0
+            batches = server.batcher.batch_sizes
+            logger.info(
+                f"max_delay {max_delay * 1000:4.1f} ms | {requests / seconds:>8,.0f} req/s | "
+                f"p50 {np.percentile(latencies_ms, 50):6.2f} ms | p99 {np.percentile(latencies_ms, 99):6.2f} ms | "
+                f"mean batch {batches.sum / max(batches.total, 1):6.1f}"
+            )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Scoring API benchmark')
+    parser.add_argument('--requests', type=int, default=20000, help='Total requests (default: 20000)')
+    parser.add_argument('--concurrency', type=int, default=64, help='Concurrent clients (default: 64)')
+    parser.add_argument('--max-delays', type=float, nargs='+', default=[0.0, 0.002],
+                        help='Batching delays in seconds to compare (default: 0 0.002)')
+    parser.add_argument('--port', type=int, default=18000, help='Local port (default: 18000)')
+
+    args = parser.parse_args()
+    run(args.requests, args.concurrency, args.max_delays, args.port)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Segment Models Benchmark
+Trains one model per synthetic segment and scores generator events with
+segment routing on, against the global model alone, reporting warm-cache
+throughput and model cache loads/evictions as the segment count outgrows
+the cache
+"""
+
+import os
+import sys
+import time
+import pickle
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_suite import generate_pool
+from inmemory_es import InMemoryElasticsearch
+from model_registry import ModelRegistry
+from offline_trainer import FeatureExport, OfflineTrainer
+from segment_models import SegmentModels
+from threat_detector import FEATURE_NAMES, ThreatDetector
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SEGMENT_FIELD = 'bench_segment'
+
+
+def score_pages(detector, events, page_size):
+    """Events per second scoring every page through detect_anomalies"""
+    started = time.perf_counter()
+    for i in range(0, len(events), page_size):
+        detector.detect_anomalies(events[i:i + page_size])
+    return len(events) / (time.perf_counter() - started)
+
+
+def run(count, page_size, segment_counts, capacities, sample_size, seed):
+    logging.getLogger('threat_detector').setLevel(logging.WARNING)
+    logging.getLogger('offline_trainer').setLevel(logging.WARNING)
+    logging.getLogger('segment_models').setLevel(logging.WARNING)
+    logging.getLogger('model_registry').setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as work_dir:
+        pool_path = os.path.join(work_dir, 'events.pkl')
+        generate_pool(pool_path, count, 1000, seed)
+        with open(pool_path, 'rb') as f:
+            events = pickle.load(f)
+
+        detector = ThreatDetector(model_dir=work_dir, es=InMemoryElasticsearch(), retrain=False)
+        global_rate = score_pages(detector, events, page_size)
+        logger.info(f"{'global':>12} | {global_rate:>10,.0f} ev/s")
+
+        for segments in segment_counts:
+            for i, event in enumerate(events):
+                event[SEGMENT_FIELD] = f'segment-{i % segments}'
+            export = FeatureExport.create(os.path.join(work_dir, f'export-{segments}'), FEATURE_NAMES,
+                                          SEGMENT_FIELD, source={'synthetic': count})
+            export.append_events(events)
+            export.close()
+
+            trainer = OfflineTrainer(ModelRegistry(detector.registry.root), sample_size=sample_size)
+            started = time.perf_counter()
+            trained = trainer.train_segments(FeatureExport.open(export.path), min_rows=1)
+            train_seconds = time.perf_counter() - started
+
+            for capacity in capacities:
+                detector.segment_models = SegmentModels(detector.registry.root, SEGMENT_FIELD, FEATURE_NAMES, capacity)
+                # One untimed pass loads the models and builds the stack
+                score_pages(detector, events, page_size)
+                rate = score_pages(detector, events, page_size)
+                stats = detector.segment_models.stats
+                logger.info(
+                    f"{segments:>3} segments | cache {capacity:>3} | {rate:>10,.0f} ev/s "
+                    f"({rate / global_rate:.2f}x global) | loads {stats['loads']:>5} | evictions {stats['evictions']:>5} | "
+                    f"stack builds {stats['stack_builds']:>4} | trained {len(trained)} in {train_seconds:.1f}s"
+                )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Per-segment model benchmark')
+    parser.add_argument('--events', type=int, default=50000, help='Generator events to score (default: 50000)')
+    parser.add_argument('--page-size', type=int, default=1000, help='Events per scoring call (default: 1000)')
+    parser.add_argument('--segments', type=int, nargs='+', default=[4, 16, 64],
+                        help='Segment counts to compare (default: 4 16 64)')
+    parser.add_argument('--capacities', type=int, nargs='+', default=[16, 64],
+                        help='Segment model cache sizes to compare (default: 16 64)')
+    parser.add_argument('--sample-size', type=int, default=20000,
+                        help='Training rows per segment (default: 20000)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    args = parser.parse_args()
+    run(args.events, args.page_size, args.segments, args.capacities, args.sample_size, args.seed)
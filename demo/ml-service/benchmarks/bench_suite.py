@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+ML Detection Benchmark Suite
+Runs the detector hot path offline against an in-memory Elasticsearch
+stand-in, using events from data-generator/generate_events.py, and writes
+events/sec, p50/p95/p99 per-event latency and peak RSS as JSON
+
+Each (case, batch size) runs in a fresh spawned process so peak RSS is
+per case. Per-event latency is the wall time of the call that handled
+the event: one call per event for the single-event cases, one call per
+batch (or per consumer page for process_events) otherwise.
+Requires faker (data-generator dependency) in addition to the ML service
+requirements.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import pickle
+import logging
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime, timedelta
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.join(BENCH_DIR, '..')
+GENERATOR_DIR = os.path.join(BENCH_DIR, '..', '..', 'data-generator')
+sys.path.insert(0, SERVICE_DIR)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = [1, 10, 100, 1000, 10000, 100000, 1000000]
+PER_EVENT_CASES = ['extract_features', 'detect_anomaly', 'analyze_behavioral_patterns']
+CASES = PER_EVENT_CASES + ['detect_anomalies', 'analyze_behavioral_batch', 'process_events']
+
+
+def generate_pool(path, pool_size, users, seed):
+    """Write a pool of generator events; cases tile it up to their batch size"""
+    sys.path.insert(0, GENERATOR_DIR)
+    import generate_events
+
+    random.seed(seed)
+    generate_events.fake.seed_instance(seed)
+    generator = generate_events.SecurityEventGenerator(es_host='localhost')
+    generator.users = []
+    while len(generator.users) < users:
+        generator.users.extend(generator.generate_users())
+    generator.users = generator.users[:users]
+
+    pool = [generator.generate_event() for _ in range(pool_size)]
+    with open(path, 'wb') as f:
+        pickle.dump(pool, f, protocol=pickle.HIGHEST_PROTOCOL)
+    logger.info(f"Generated {pool_size} events for {users} users into {path}")
+
+
+def tile_events(pool, size, span_seconds=240):
+    """`size` events cycled from the pool, with fresh timestamps inside the consumer's window"""
+    base = datetime.utcnow() - timedelta(seconds=span_seconds)
+    step = span_seconds / max(size, 1)
+    events = []
+    for i in range(size):
+        event = dict(pool[i % len(pool)])
+        event['@timestamp'] = (base + timedelta(seconds=i * step)).isoformat()
+        events.append(event)
+    return events
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is KiB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def timed_calls(func, chunks):
+    """Call func on each chunk; returns [(seconds, events_in_call)]"""
+    calls = []
+    for chunk, count in chunks:
+        start = time.perf_counter()
+        func(chunk)
+        calls.append((time.perf_counter() - start, count))
+    return calls
+
+
+def summarize(calls, total_seconds=None):
+    """Throughput and event-weighted latency percentiles for a list of calls"""
+    seconds = np.array([call[0] for call in calls])
+    counts = np.array([call[1] for call in calls])
+    latencies_ms = np.repeat(seconds, counts) * 1000.0
+    total_seconds = total_seconds if total_seconds is not None else float(seconds.sum())
+    return {
+        'events': int(counts.sum()),
+        'calls': len(calls),
+        'seconds': total_seconds,
+        'events_per_sec': float(counts.sum() / total_seconds) if total_seconds > 0 else None,
+        'latency_ms': {
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p95': float(np.percentile(latencies_ms, 95)),
+            'p99': float(np.percentile(latencies_ms, 99))
+        }
+    }
+
+
+def run_case(case, size, pool_path, repeats):
+    """Child-process entry point: build a detector, run one case and measure it"""
+    from threat_detector import ThreatDetector
+    from inmemory_es import InMemoryElasticsearch
+
+    # Per-alert warnings would dominate the measurement with terminal I/O
+    logging.getLogger('threat_detector').setLevel(logging.ERROR)
+
+    with open(pool_path, 'rb') as f:
+        pool = pickle.load(f)
+    events = tile_events(pool, size)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        es = InMemoryElasticsearch()
+        detector = ThreatDetector(model_dir=model_dir, es=es, retrain=False, poll_interval=0)
+        setup_rss = peak_rss_mb()
+
+        if case == 'extract_features':
+            detector.extract_features(events[0])
+            calls = timed_calls(detector.extract_features, [(event, 1) for event in events] * repeats)
+            result = summarize(calls)
+        elif case == 'detect_anomaly':
+            detector.detect_anomaly(events[0])
+            calls = timed_calls(detector.detect_anomaly, [(event, 1) for event in events] * repeats)
+            result = summarize(calls)
+        elif case == 'detect_anomalies':
+            detector.detect_anomalies(events[:100])
+            calls = timed_calls(detector.detect_anomalies, [(events, size)] * repeats)
+            result = summarize(calls)
+        elif case == 'analyze_behavioral_patterns':
+            user_events = {}
+            for event in events:
+                user_events.setdefault(event.get('username', 'unknown'), []).append(event)
+            groups = [(group, len(group)) for group in user_events.values()]
+            calls = timed_calls(detector.analyze_behavioral_patterns, groups * repeats)
+            result = summarize(calls)
+        elif case == 'analyze_behavioral_batch':
+            detector.analyze_behavioral_batch(events[:10])
+            calls = timed_calls(detector.analyze_behavioral_batch, [(events, size)] * repeats)
+            result = summarize(calls)
+        elif case == 'process_events':
+            es.load('security-events', events)
+            # Warm lazy imports (pandas) without touching UEBA state or alerts
+            detector.analyze_behavioral_batch(events[:10])
+
+            # One page is one call: time from the previous commit to this page's commit
+            commits = []
+            commit = detector.consumer.commit
+
+            def timed_commit():
+                commit()
+                commits.append(time.perf_counter())
+
+            detector.consumer.commit = timed_commit
+            start = time.perf_counter()
+            processed, threats = detector.poll_once()
+            total = time.perf_counter() - start
+            detector.alert_writer.close()
+
+            page_counts = [detector.consumer.page_size] * len(commits)
+            if commits:
+                page_counts[-1] = processed - detector.consumer.page_size * (len(commits) - 1)
+            page_seconds = np.diff([start] + commits)
+            result = summarize(list(zip(page_seconds, page_counts)), total_seconds=total)
+            result['threats_detected'] = threats
+            result['es_requests'] = dict(es.requests)
+        else:
+            raise ValueError(f"Unknown benchmark case: {case}")
+
+    result.update({
+        'case': case,
+        'batch_size': size,
+        'repeats': repeats,
+        'setup_peak_rss_mb': setup_rss,
+        'peak_rss_mb': peak_rss_mb()
+    })
+    return result
+
+
+def environment():
+    """Versions and host details recorded with every run"""
+    import sklearn
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    """Log throughput against a previous run; returns the regressed (case, size) pairs"""
+    with open(baseline_path) as f:
+        baseline = {(r['case'], r['batch_size']): r for r in json.load(f)['results']}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['case'], result['batch_size']))
+        if not previous or not previous.get('events_per_sec') or not result.get('events_per_sec'):
+            continue
+        ratio = result['events_per_sec'] / previous['events_per_sec']
+        marker = ''
+        if ratio < 1 - tolerance:
+            regressions.append((result['case'], result['batch_size']))
+            marker = '  <-- REGRESSION'
+        logger.info(f"{result['case']:>28} {result['batch_size']:>8}: {ratio:6.2f}x baseline{marker}")
+    return regressions
+
+
+def run(cases, sizes, output, per_event_limit, min_events, max_repeats, pool_size, users, seed,
+        baseline=None, tolerance=0.2):
+    """Run every (case, size) pair in its own process and write the JSON report"""
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        pool_path = os.path.join(work_dir, 'events.pkl')
+        generate_pool(pool_path, pool_size, users, seed)
+
+        for case in cases:
+            for size in sizes:
+                if case in PER_EVENT_CASES and size > per_event_limit:
+                    logger.info(f"Skipping {case} at {size} events (over --per-event-limit)")
+                    continue
+
+                # Small batches are repeated so percentiles have enough samples
+                repeats = max(1, min(max_repeats, min_events // size)) if case != 'process_events' else 1
+                with context.Pool(processes=1) as pool:
+                    result = pool.apply(run_case, (case, size, pool_path, repeats))
+                results.append(result)
+                logger.info(
+                    f"{case:>28} {size:>8}: {result['events_per_sec']:>12,.0f} ev/s | "
+                    f"p50 {result['latency_ms']['p50']:9.3f} ms | p95 {result['latency_ms']['p95']:9.3f} ms | "
+                    f"p99 {result['latency_ms']['p99']:9.3f} ms | peak RSS {result['peak_rss_mb']:7.1f} MB"
+                )
+
+    report = {
+        'created_at': datetime.utcnow().isoformat(),
+        'environment': environment(),
+        'parameters': {
+            'sizes': sizes,
+            'per_event_limit': per_event_limit,
+            'min_events': min_events,
+            'max_repeats': max_repeats,
+            'pool_size': pool_size,
+            'users': users,
+            'seed': seed
+        },
+        'results': results
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote {len(results)} results to {output}")
+
+    if baseline:
+        return compare(results, baseline, tolerance)
+    return []
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='ML detection benchmark suite')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES, help='Cases to run (default: all)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Batch sizes (default: 1 10 100 1000 10000 100000 1000000)')
+    parser.add_argument('--output', default='bench_results.json', help='JSON report path (default: bench_results.json)')
+    parser.add_argument('--per-event-limit', type=int, default=100000,
+                        help='Largest size for cases that make one call per event (default: 100000)')
+    parser.add_argument('--min-events', type=int, default=10000,
+                        help='Repeat small batches until this many events are measured (default: 10000)')
+    parser.add_argument('--max-repeats', type=int, default=1000, help='Cap on repeats per case (default: 1000)')
+    parser.add_argument('--pool-size', type=int, default=20000, help='Distinct generator events (default: 20000)')
+    parser.add_argument('--users', type=int, default=1000, help='Distinct generator users (default: 1000)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    parser.add_argument('--baseline', help='Previous JSON report to compare throughput against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed throughput drop vs baseline before failing (default: 0.2)')
+
+    args = parser.parse_args()
+    regressions = run(
+        args.cases, args.sizes, args.output, args.per_event_limit, args.min_events, args.max_repeats,
+        args.pool_size, args.users, args.seed, baseline=args.baseline, tolerance=args.tolerance
+    )
+    if regressions:
+        logger.error(f"Throughput regressions: {regressions}")
+        sys.exit(1)
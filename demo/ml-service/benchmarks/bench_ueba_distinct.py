@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+UEBA Distinct-Count Benchmark
+Compares the HyperLogLog source-IP counters in UserStateStore with exact
+per-user Python sets: estimate error by true distinct count, memory for a
+heavy-tailed population of users over a 30-day horizon, update throughput,
+and whether sketches merged across shards match a single store
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ueba_state import HLL_REGISTERS, IP_HORIZONS, USER_STATE_DTYPE, UserStateStore
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+
+
+def random_ip(rng):
+    return f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'
+
+
+def user_events(rng, user, distinct, events_per_ip, start, span):
+    """Events for one user spread over `span` seconds, touching `distinct` source IPs"""
+    ips = [random_ip(rng) for _ in range(distinct)]
+    return [{
+        'username': user,
+        'source_ip': ip,
+        '@timestamp': (start + rng.uniform(0, span)) * 1000,
+        'failed_logins': 0
+    } for ip in ips for _ in range(events_per_ip)]
+
+
+def accuracy(counts, users_per_count, work_dir, seed):
+    """Relative error of the 30d estimate by true distinct count"""
+    rng = random.Random(seed)
+    store = UserStateStore(os.path.join(work_dir, 'accuracy.dat'), capacity=1 << 14,
+                           hot_size=len(counts) * users_per_count)
+    start = time.time() - DAY
+    truth = {}
+    for distinct in counts:
+        events = []
+        for i in range(users_per_count):
+            user = f'user-{distinct}-{i}'
+            truth[user] = distinct
+            events += user_events(rng, user, distinct, 1, start, DAY / 2)
+        rng.shuffle(events)
+        for offset in range(0, len(events), 10000):
+            store.update_batch(events[offset:offset + 10000])
+
+    users = list(truth)
+    estimates = store.distinct_ips(store.hot_rows(users))[:, -1]
+    exact = np.array([truth[user] for user in users], dtype=np.float64)
+    for distinct in counts:
+        errors = (estimates[exact == distinct] - distinct) / distinct
+        logger.info(f"{distinct:>7,} distinct IPs | mean error {errors.mean():+7.2%} | RMSE {np.sqrt(np.mean(errors ** 2)):6.2%} | "
+                    f"p99 |error| {np.percentile(np.abs(errors), 99):6.2%} | "
+                    f"exact {np.mean(np.round(estimates[exact == distinct]) == distinct):6.1%} of users")
+
+
+def population(rng, users):
+    """Heavy-tailed distinct-IP counts: most users see a handful, a few see thousands"""
+    return np.minimum(np.ceil(rng.pareto(1.2, size=users) * 2).astype(int) + 1, 20000)
+
+
+def memory(users, work_dir, seed):
+    """Bytes for exact 30-day sets per user vs. the fixed-size sketches"""
+    rng = random.Random(seed)
+    distinct = population(np.random.default_rng(seed), users)
+    start = time.time() - 30 * DAY
+    store = UserStateStore(os.path.join(work_dir, f'memory-{users}.dat'), capacity=1 << 16, hot_size=10000)
+
+    exact = {}
+    update_seconds = 0.0
+    total_events = 0
+    for offset in range(0, users, 1000):
+        events = []
+        for user in range(offset, min(offset + 1000, users)):
+            events += user_events(rng, f'user-{user}', int(distinct[user]), 2, start, 30 * DAY)
+        for event in events:
+            exact.setdefault(event['username'], set()).add(event['source_ip'])
+        started = time.perf_counter()
+        store.update_batch(events)
+        update_seconds += time.perf_counter() - started
+        total_events += len(events)
+
+    # Measure a copy of the finished sets on their own (strings included), without the event lists
+    tracemalloc.start()
+    copied = {user: {ip.encode().decode() for ip in ips} for user, ips in exact.items()}
+    exact_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del copied
+
+    sketch_bytes = users * USER_STATE_DTYPE['ip_hll'].itemsize
+    record_bytes = users * USER_STATE_DTYPE.itemsize
+    logger.info(
+        f"{users:>9,} users, {int(distinct.sum()):>11,} user-IP pairs (max {int(distinct.max()):,}) | "
+        f"exact sets (30d only) {exact_bytes / 2 ** 20:8.1f} MB | HLL, {len(IP_HORIZONS)} horizons "
+        f"{sketch_bytes / 2 ** 20:6.1f} MB | whole state records {record_bytes / 2 ** 20:6.1f} MB | "
+        f"update_batch {total_events / update_seconds:>9,.0f} ev/s"
+    )
+
+
+def shard_merge(shards, work_dir, seed):
+    """Largest estimate difference between one store and the merge of per-shard stores"""
+    rng = random.Random(seed)
+    start = time.time() - 3 * DAY
+    events = []
+    for user in range(200):
+        events += user_events(rng, f'user-{user}', rng.randint(1, 500), 3, start, 3 * DAY)
+    rng.shuffle(events)
+
+    single = UserStateStore(os.path.join(work_dir, 'single.dat'))
+    single.update_batch(events)
+    merged = UserStateStore(os.path.join(work_dir, 'merged.dat'))
+    for shard in range(shards):
+        part = UserStateStore(os.path.join(work_dir, f'part-{shard}.dat'))
+        # Arbitrary assignment, so every user is spread over every shard
+        part.update_batch(events[shard::shards])
+        part.flush()
+        for records in part.iter_records():
+            merged.insert_records(records)
+    merged.table.flush()
+
+    users = [f'user-{user}' for user in range(200)]
+    difference = np.abs(single.distinct_ips(single.hot_rows(users)) - merged.distinct_ips(merged.hot_rows(users)))
+    logger.info(f"{shards} shards merged vs. one store: max estimate difference {difference.max():.6f} "
+                f"across {len(users)} users and {len(IP_HORIZONS)} horizons")
+
+
+def run(counts, users_per_count, populations, shards, seed):
+    logger.info(f"HyperLogLog: {HLL_REGISTERS} one-byte registers, {len(IP_HORIZONS)} horizons "
+                f"({', '.join(name for name, _ in IP_HORIZONS)}) x 2 generations = "
+                f"{USER_STATE_DTYPE['ip_hll'].itemsize} bytes per user")
+    with tempfile.TemporaryDirectory() as work_dir:
+        accuracy(counts, users_per_count, work_dir, seed)
+        for users in populations:
+            memory(users, work_dir, seed)
+        shard_merge(shards, work_dir, seed)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='UEBA distinct source-IP counter benchmark')
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 2, 5, 10, 50, 100, 1000, 10000],
+                        help='True distinct IP counts for the accuracy table')
+    parser.add_argument('--users-per-count', type=int, default=200,
+                        help='Users per distinct count in the accuracy table (default: 200)')
+    parser.add_argument('--populations', type=int, nargs='+', default=[10000, 100000],
+                        help='User counts for the memory comparison (default: 10000 100000)')
+    parser.add_argument('--shards', type=int, default=4, help='Shards in the merge check (default: 4)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    args = parser.parse_args()
+    run(args.counts, args.users_per_count, args.populations, args.shards, args.seed)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+UEBA Group-By Benchmark
+Compares dict-of-lists grouping + analyze_behavioral_patterns against the
+columnar aggregate_user_metrics path and the UserStateStore batch update
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from threat_detector import ThreatDetector
+from ueba_batch import aggregate_user_metrics
+from ueba_state import UserStateStore
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def make_events(count, users, seed=42):
+    """Events spread across `users` usernames with a few noisy ones"""
+    rng = random.Random(seed)
+    base = 1.76e9
+    events = []
+    for i in range(count):
+        events.append({
+            '@timestamp': base + i * 0.01,
+            'username': f'user{rng.randrange(users)}',
+            'source_ip': f'10.{rng.randrange(4)}.{rng.randrange(256)}.{rng.randrange(256)}',
+            'failed_logins': rng.choice([0, 0, 0, 0, 1, 8, 30]),
+            'hour': rng.randrange(24)
+        })
+    return events
+
+
+def group_and_analyze(detector, events, min_events=3):
+    """The original per-user Python grouping"""
+    user_events = {}
+    for event in events:
+        username = event.get('username', 'unknown')
+        if username not in user_events:
+            user_events[username] = []
+        user_events[username].append(event)
+
+    return {
+        username: (detector.analyze_behavioral_patterns(user_list), len(user_list))
+        for username, user_list in user_events.items()
+        if len(user_list) >= min_events
+    }
+
+
+def timed(func, *args):
+    """Return (result, seconds)"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(count, users):
+    """Benchmark both aggregation paths and check they agree"""
+    with tempfile.TemporaryDirectory() as model_dir:
+        detector = ThreatDetector(model_dir=model_dir)
+        events = make_events(count, users)
+
+        expected, loop_seconds = timed(group_and_analyze, detector, events)
+        actual, columnar_seconds = timed(aggregate_user_metrics, events)
+        if expected != actual:
+            raise AssertionError("Columnar UEBA output differs from analyze_behavioral_patterns")
+
+        store = UserStateStore(os.path.join(model_dir, 'ueba_users.dat'), capacity=1 << 17, hot_size=users)
+        _, store_seconds = timed(store.update_batch, events)
+
+        logger.info(f"{count:,} events across {users:,} users ({len(actual):,} analyzed)")
+        logger.info(f"  dict-of-lists + analyze_behavioral_patterns: {count / loop_seconds:>12,.0f} ev/s")
+        logger.info(f"  aggregate_user_metrics (columnar):           {count / columnar_seconds:>12,.0f} ev/s "
+                    f"({loop_seconds / columnar_seconds:.1f}x)")
+        logger.info(f"  UserStateStore.update_batch:                 {count / store_seconds:>12,.0f} ev/s")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='UEBA group-by benchmark')
+    parser.add_argument('--events', type=int, default=1000000, help='Number of events (default: 1000000)')
+    parser.add_argument('--users', type=int, default=50000, help='Number of distinct users (default: 50000)')
+
+    args = parser.parse_args()
+    run(args.events, args.users)
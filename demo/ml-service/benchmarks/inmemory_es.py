@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+In-Memory Elasticsearch Stand-In
+Implements the slice of the Elasticsearch client API the ML service uses
+(index existence, point-in-time search_after paging, sliced scroll,
+_bulk and document updates) so the detection pipeline and the SOAR engine
+can be benchmarked offline
+"""
+
+import os
+import re
+import sys
+import time
+import zlib
+import uuid
+import bisect
+import asyncio
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sharding import ROUTE_FIELD, ROUTE_PIPELINE, route_hash
+from ueba_batch import event_time
+from ueba_state import java_string_hash
+
+RELATIVE_TIME = re.compile(r'^now(?:-(\d+)([smhd]))?$')
+UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Longest string a dynamically mapped .keyword sub-field keeps a doc value for
+IGNORE_ABOVE = 256
+
+BOOL_OCCURS = ('filter', 'must', 'must_not', 'should')
+
+
+def document_millis(source):
+    """A document's @timestamp as whole epoch millis, the resolution ES stores dates at"""
+    return int(epoch_millis(source.get('@timestamp', 0)) // 1)
+
+
+def epoch_millis(value, fmt=None):
+    """Range bound in epoch millis from a number or a now-N[smhd] expression"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = RELATIVE_TIME.match(str(value))
+    if match:
+        amount, unit = match.groups()
+        offset = int(amount) * UNIT_SECONDS[unit] if amount else 0
+        return (time.time() - offset) * 1000.0
+    if fmt == 'epoch_millis':
+        return float(value)
+    return event_time({'@timestamp': value}) * 1000.0
+
+
+def as_list(clauses):
+    """Query clauses as a list; ES accepts a single clause or a list"""
+    if clauses is None:
+        return []
+    return clauses if isinstance(clauses, list) else [clauses]
+
+
+def compile_query(query):
+    """Copy of a query with ids values as sets and @timestamp bounds in epoch millis, resolved once per request"""
+    if not query:
+        return query
+    if 'ids' in query:
+        return {'ids': {'values': frozenset(query['ids']['values'])}}
+    if 'bool' in query:
+        return {'bool': {occur: [compile_query(clause) for clause in as_list(clauses)] if occur in BOOL_OCCURS else clauses
+                         for occur, clauses in query['bool'].items()}}
+    if '@timestamp' in query.get('range', {}):
+        bounds = query['range']['@timestamp']
+        resolved = {op: epoch_millis(bounds[op], bounds.get('format')) for op in ('gte', 'gt', 'lte', 'lt') if op in bounds}
+        return {'range': {'@timestamp': dict(resolved, format='epoch_millis')}}
+    return query
+
+
+def keyword_value(source, field):
+    """doc['<field>.keyword'].value as a script sees it, or None without a doc value"""
+    value = source.get(field)
+    if value is None or len(str(value)) > IGNORE_ABOVE:
+        return None
+    return str(value)
+
+
+def ids_clause(query):
+    """Document ids a query is restricted to, or None"""
+    if 'ids' in query:
+        return query['ids']['values']
+    for clause in as_list(query.get('bool', {}).get('filter')):
+        if 'ids' in clause:
+            return clause['ids']['values']
+    return None
+
+
+class InMemoryIndex:
+    """Documents of one index kept sorted by (@timestamp, insertion order)"""
+
+    def __init__(self):
+        self.keys = []
+        self.documents = {}
+        self.key_of = {}
+
+    def add(self, doc_id, source, sequence):
+        """Insert a document at its sort position"""
+        key = (document_millis(source), sequence, doc_id)
+        bisect.insort(self.keys, key)
+        self.documents[doc_id] = source
+        self.key_of[doc_id] = key
+
+    def extend_sorted(self, entries):
+        """Bulk-append (timestamp_ms, sequence, doc_id, source) entries, then re-sort once"""
+        for timestamp, sequence, doc_id, source in entries:
+            self.keys.append((timestamp, sequence, doc_id))
+            self.documents[doc_id] = source
+            self.key_of[doc_id] = (timestamp, sequence, doc_id)
+        self.keys.sort()
+
+
+class InMemoryIndices:
+    def __init__(self, client):
+        self.client = client
+
+    def exists(self, index):
+        self.client.round_trip()
+        return index in self.client.data
+
+    def create(self, index, settings=None, **kwargs):
+        self.client.data.setdefault(index, InMemoryIndex())
+        if settings:
+            self.put_settings(index=index, settings=settings)
+        return {'acknowledged': True, 'index': index}
+
+    def put_settings(self, index, settings=None, body=None, **kwargs):
+        settings = settings if settings is not None else body
+        self.client.settings.setdefault(index, {}).update(settings.get('index', settings))
+        return {'acknowledged': True}
+
+
+class InMemoryIngest:
+    def __init__(self, client):
+        self.client = client
+
+    def put_pipeline(self, id, **kwargs):
+        self.client.pipelines[id] = kwargs
+        return {'acknowledged': True}
+
+
+class InMemoryElasticsearch:
+    """Drop-in for the Elasticsearch client calls made by the ML service
+
+    Queries support range, exists, bool clauses, match_all, term, ids and the
+    sharding legacy route script. Painless is not run: an index's default
+    pipeline (only sharding's route pipeline is known) and the route script
+    are evaluated with sharding.route_hash. Scroll slices split documents by a CRC32 of their id. Request counts per API are kept in `requests`, and
+    `latency` seconds are slept per request to model network round trips.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.data = {}
+        self.indices = InMemoryIndices(self)
+        self.ingest = InMemoryIngest(self)
+        self.settings = {}
+        self.pipelines = {}
+        self.pits = {}
+        self.scrolls = {}
+        self.sequence = 0
+        self.requests = Counter()
+
+    def round_trip(self):
+        """Simulated network + cluster time for one request"""
+        if self.latency:
+            time.sleep(self.latency)
+
+    def next_sequence(self):
+        self.sequence += 1
+        return self.sequence
+
+    def run_pipeline(self, index, source):
+        """Apply the index's default ingest pipeline to a document being indexed"""
+        pipeline = self.settings.get(index, {}).get('default_pipeline')
+        if pipeline is None:
+            return source
+        if pipeline != ROUTE_PIPELINE or pipeline not in self.pipelines:
+            raise NotImplementedError(f"Unsupported ingest pipeline: {pipeline}")
+        return dict(source, **{ROUTE_FIELD: route_hash(source)})
+
+    def load(self, index, documents):
+        """Index many documents in one step (faster than bulk for setup)"""
+        target = self.data.setdefault(index, InMemoryIndex())
+        entries = []
+        for source in documents:
+            source = self.run_pipeline(index, source)
+            sequence = self.next_sequence()
+            entries.append((document_millis(source), sequence, f'doc-{sequence}', source))
+        target.extend_sorted(entries)
+
+    def index(self, index, document=None, body=None, id=None, **kwargs):
+        self.requests['index'] += 1
+        self.round_trip()
+        sequence = self.next_sequence()
+        doc_id = id or f'doc-{sequence}'
+        source = self.run_pipeline(index, document if document is not None else body)
+        self.data.setdefault(index, InMemoryIndex()).add(doc_id, source, sequence)
+        return {'_index': index, '_id': doc_id, 'result': 'created'}
+
+    def update(self, index, id, body=None, doc=None, **kwargs):
+        self.requests['update'] += 1
+        self.round_trip()
+        documents = self.data.get(index, InMemoryIndex()).documents
+        if id not in documents:
+            raise KeyError(f"document_missing_exception: [{id}] in {index}")
+        documents[id].update(doc if doc is not None else body.get('doc', {}))
+        return {'_index': index, '_id': id, 'result': 'updated'}
+
+    def update_by_query(self, index, query=None, script=None, body=None, **kwargs):
+        """Applies the script's params['doc'] to matching documents instead of running painless"""
+        self.requests['update_by_query'] += 1
+        self.round_trip()
+        query = query if query is not None else (body or {}).get('query')
+        script = script if script is not None else body['script']
+        target = self.data.get(index, InMemoryIndex())
+        updated = 0
+        for key in target.keys:
+            source = target.documents.get(key[2])
+            if source is not None and self.matches(query, source, key[2]):
+                source.update(script['params']['doc'])
+                updated += 1
+        return {'updated': updated, 'version_conflicts': 0, 'failures': []}
+
+    def bulk(self, operations=None, body=None, **kwargs):
+        self.requests['bulk'] += 1
+        self.round_trip()
+        operations = operations if operations is not None else body
+        items = []
+        position = 0
+        while position < len(operations):
+            action = operations[position]
+            (op_type, meta), = action.items()
+            index = meta.get('_index')
+            if op_type == 'delete':
+                self.data.get(index, InMemoryIndex()).documents.pop(meta.get('_id'), None)
+                items.append({op_type: {'_index': index, '_id': meta.get('_id'), 'status': 200}})
+                position += 1
+                continue
+
+            payload = operations[position + 1]
+            position += 2
+            if op_type == 'update':
+                documents = self.data.get(index, InMemoryIndex()).documents
+                if meta.get('_id') not in documents:
+                    items.append({op_type: {'_index': index, '_id': meta.get('_id'), 'status': 404,
+                                            'error': {'type': 'document_missing_exception'}}})
+                    continue
+                documents[meta['_id']].update(payload.get('doc', {}))
+                items.append({op_type: {'_index': index, '_id': meta['_id'], 'status': 200}})
+            else:
+                sequence = self.next_sequence()
+                doc_id = meta.get('_id') or f'doc-{sequence}'
+                self.data.setdefault(index, InMemoryIndex()).add(doc_id, self.run_pipeline(index, payload), sequence)
+                items.append({op_type: {'_index': index, '_id': doc_id, 'status': 201}})
+        return {'errors': any(list(item.values())[0]['status'] >= 300 for item in items), 'items': items}
+
+    def open_point_in_time(self, index, keep_alive=None, **kwargs):
+        self.requests['open_point_in_time'] += 1
+        self.round_trip()
+        target = self.data.get(index, InMemoryIndex())
+        pit_id = uuid.uuid4().hex
+        # Snapshot of the sort keys; documents are immutable in the hot path
+        self.pits[pit_id] = (index, list(target.keys))
+        return {'id': pit_id}
+
+    def close_point_in_time(self, id=None, **kwargs):
+        self.requests['close_point_in_time'] += 1
+        self.round_trip()
+        self.pits.pop(id, None)
+        return {'succeeded': True}
+
+    def matches(self, query, source, doc_id=None, timestamp=None):
+        """Evaluate the supported query clauses against one document"""
+        if not query or 'match_all' in query:
+            return True
+        if 'bool' in query:
+            clauses = as_list(query['bool'].get('filter')) + as_list(query['bool'].get('must'))
+            must_not = as_list(query['bool'].get('must_not'))
+            should = as_list(query['bool'].get('should'))
+            # Filter context: should clauses are optional unless minimum_should_match says otherwise
+            minimum = int(query['bool'].get('minimum_should_match', 0 if clauses or must_not else 1)) if should else 0
+            return all(self.matches(clause, source, doc_id, timestamp) for clause in clauses) and \
+                not any(self.matches(clause, source, doc_id, timestamp) for clause in must_not) and \
+                sum(1 for clause in should if self.matches(clause, source, doc_id, timestamp)) >= minimum
+        if 'ids' in query:
+            return doc_id in query['ids']['values']
+        if 'range' in query:
+            (field, bounds), = query['range'].items()
+            if field == '@timestamp':
+                value = document_millis(source) if timestamp is None else timestamp
+            else:
+                value = source.get(field)
+            fmt = bounds.get('format')
+            if value is None:
+                return False
+            if 'gte' in bounds and value < epoch_millis(bounds['gte'], fmt):
+                return False
+            if 'gt' in bounds and value <= epoch_millis(bounds['gt'], fmt):
+                return False
+            if 'lte' in bounds and value > epoch_millis(bounds['lte'], fmt):
+                return False
+            if 'lt' in bounds and value >= epoch_millis(bounds['lt'], fmt):
+                return False
+            return True
+        if 'term' in query:
+            (field, value), = query['term'].items()
+            if isinstance(value, dict):
+                value = value.get('value')
+            return source.get(field.replace('.keyword', '')) == value
+        if 'exists' in query:
+            return source.get(query['exists']['field']) is not None
+        if 'script' in query:
+            # sharding.LEGACY_ROUTE_SCRIPT, over keyword doc values
+            params = query['script']['script']['params']
+            keys = (keyword_value(source, field) for field in params['fields'])
+            route = java_string_hash(next((key for key in keys if key), ''))
+            return params['gte'] <= route < params['lt']
+        raise NotImplementedError(f"Unsupported query clause: {list(query)}")
+
+    def search(self, body=None, index=None, **kwargs):
+        self.requests['search'] += 1
+        self.round_trip()
+        body = dict(body or {}, **kwargs)
+        pit = body.get('pit')
+        if pit:
+            index, keys = self.pits[pit['id']]
+        else:
+            keys = self.data.get(index, InMemoryIndex()).keys
+
+        query = compile_query(body.get('query') or {})
+        size = body.get('size', 10)
+        with_source = body.get('_source', True) is not False
+
+        # Seek straight to the time range / search_after position instead of scanning
+        start = 0
+        time_bound = self.time_lower_bound(query)
+        if time_bound is not None:
+            start = bisect.bisect_left(keys, (time_bound,))
+        if body.get('search_after') is not None:
+            timestamp, sequence = body['search_after']
+            start = max(start, bisect.bisect_left(keys, (timestamp, sequence + 1)))
+
+        # An ids lookup touches only those documents (still limited to the point-in-time snapshot)
+        ids = ids_clause(query)
+        if ids is not None and not body.get('scroll'):
+            key_of = self.data.get(index, InMemoryIndex()).key_of
+            snapshot, keys = keys, []
+            for key in sorted(key_of[doc_id] for doc_id in ids if doc_id in key_of):
+                position = bisect.bisect_left(snapshot, key)
+                if start <= position < len(snapshot) and snapshot[position] == key:
+                    keys.append(key)
+            start = 0
+
+        if body.get('scroll'):
+            # Scrolls read a snapshot, in @timestamp order, like a point-in-time
+            scroll_id = uuid.uuid4().hex
+            self.scrolls[scroll_id] = {'index': index, 'keys': list(keys), 'position': start, 'query': query,
+                                       'size': size, 'slice': body.get('slice'), 'with_source': with_source}
+            return self.scroll_page(scroll_id)
+
+        hits, _ = self.collect(index, keys, start, query, size, with_source=with_source)
+        response = {'hits': {'hits': hits}}
+        if pit:
+            response['pit_id'] = pit['id']
+        return response
+
+    def collect(self, index, keys, start, query, size, slice_spec=None, with_source=True):
+        """Up to `size` matching hits from keys[start:]; returns (hits, next position)"""
+        documents = self.data.get(index, InMemoryIndex()).documents
+        hits = []
+        position = start
+        while position < len(keys) and len(hits) < size:
+            timestamp, sequence, doc_id = keys[position]
+            position += 1
+            if slice_spec and zlib.crc32(doc_id.encode()) % slice_spec['max'] != slice_spec['id']:
+                continue
+            source = documents.get(doc_id)
+            if source is None or not self.matches(query, source, doc_id, timestamp):
+                continue
+            hit = {'_index': index, '_id': doc_id, 'sort': [timestamp, sequence]}
+            if with_source:
+                hit['_source'] = source
+            hits.append(hit)
+        return hits, position
+
+    def scroll_page(self, scroll_id):
+        state = self.scrolls[scroll_id]
+        hits, state['position'] = self.collect(state['index'], state['keys'], state['position'], state['query'],
+                                               state['size'], state['slice'], state['with_source'])
+        return {'_scroll_id': scroll_id, 'hits': {'hits': hits}}
+
+    def scroll(self, scroll_id=None, scroll=None, **kwargs):
+        self.requests['scroll'] += 1
+        self.round_trip()
+        return self.scroll_page(scroll_id)
+
+    def clear_scroll(self, scroll_id=None, **kwargs):
+        self.requests['clear_scroll'] += 1
+        self.round_trip()
+        self.scrolls.pop(scroll_id, None)
+        return {'succeeded': True}
+
+    def time_lower_bound(self, query):
+        """Lower @timestamp bound of a range clause at the top level or in a bool filter"""
+        clauses = [query]
+        if 'bool' in query:
+            clauses = as_list(query['bool'].get('filter'))
+        for clause in clauses:
+            bounds = clause.get('range', {}).get('@timestamp')
+            if bounds and 'gte' in bounds:
+                return epoch_millis(bounds['gte'], bounds.get('format'))
+        return None
+
+    def count(self, index=None, body=None, **kwargs):
+        self.requests['count'] += 1
+        self.round_trip()
+        query = compile_query((body or {}).get('query') or kwargs.get('query') or {})
+        documents = self.data.get(index, InMemoryIndex()).documents.items()
+        return {'count': sum(1 for doc_id, source in documents if self.matches(query, source, doc_id))}
+
+
+class AsyncInMemoryIndices:
+    def __init__(self, client):
+        self.client = client
+
+    async def exists(self, index):
+        await self.client.round_trip()
+        return self.client.sync.indices.exists(index=index)
+
+
+class AsyncInMemoryElasticsearch:
+    """AsyncElasticsearch stand-in sharing data with a sync InMemoryElasticsearch
+
+    Latency is awaited rather than slept, so other coroutines run meanwhile
+    as they would during a real round trip.
+    """
+
+    def __init__(self, sync=None, latency=0.0):
+        self.sync = sync if sync is not None else InMemoryElasticsearch()
+        self.latency = latency
+        self.indices = AsyncInMemoryIndices(self)
+
+    async def round_trip(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def bulk(self, **kwargs):
+        await self.round_trip()
+        return self.sync.bulk(**kwargs)
+
+    async def index(self, **kwargs):
+        await self.round_trip()
+        return self.sync.index(**kwargs)
+
+    async def open_point_in_time(self, **kwargs):
+        await self.round_trip()
+        return self.sync.open_point_in_time(**kwargs)
+
+    async def close_point_in_time(self, **kwargs):
+        await self.round_trip()
+        return self.sync.close_point_in_time(**kwargs)
+
+    async def search(self, **kwargs):
+        await self.round_trip()
+        return self.sync.search(**kwargs)
+
+    async def count(self, **kwargs):
+        await self.round_trip()
+        return self.sync.count(**kwargs)
+
+    async def close(self):
+        pass
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Compiled Isolation Forest Inference Engine
+Exports a fitted sklearn IsolationForest (and its StandardScaler) into
+contiguous NumPy arrays and scores with a vectorized, level-synchronous
+traversal, without importing sklearn
+"""
+
+import os
+import json
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EULER_GAMMA = 0.5772156649015329
+
+# Rows scored per traversal pass; bounds the scratch arrays for very large batches
+CHUNK_ROWS = 65536
+
+# Batches up to this size traverse all trees at once instead of tree by tree
+SMALL_BATCH_ROWS = 1024
+
+ARRAY_NAMES = ['feature', 'threshold', 'leaf_value']
+
+# Exported StandardScaler parameters, next to the forest arrays
+SCALER_FILE = 'scaler.json'
+
+
+def average_path_length(n_samples):
+    """Expected path length of an unsuccessful BST search, c(n) in the iForest paper"""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros_like(n_samples)
+    result[n_samples == 2] = 1.0
+    large = n_samples > 2
+    n = n_samples[large]
+    result[large] = 2.0 * (np.log(n - 1.0) + EULER_GAMMA) - 2.0 * (n - 1.0) / n
+    return result
+
+
+class CompiledForest:
+    """Isolation forest laid out as complete binary trees in flat arrays
+
+    Every tree is padded to the forest's maximum depth and stored as a
+    1-based heap: node i has children 2i (left) and 2i+1 (right), so the
+    child layout is implicit and traversal needs no pointer lookups. Leaves
+    above the bottom level route left and carry their value down to every
+    bottom-level descendant. leaf_value[t, j] is the depth of bottom slot j
+    in tree t plus its path-length correction c(n_node_samples).
+    """
+
+    def __init__(self, feature, threshold, leaf_value, depth, denominator, offset, n_features):
+        self.feature = feature          # (n_trees, 2 ** depth) int32, column in X; slot 0 unused
+        self.threshold = threshold      # (n_trees, 2 ** depth) float64; slot 0 unused
+        self.leaf_value = leaf_value    # (n_trees, 2 ** depth) float64
+        self.depth = int(depth)
+        self.denominator = float(denominator)
+        self.offset_ = float(offset)
+        self.n_features = int(n_features)
+        self.n_trees = feature.shape[0]
+        self.width = feature.shape[1]
+
+        # float32 inputs compared against float32 thresholds rounded down route
+        # exactly like the float64 comparison sklearn performs on float32 input
+        threshold32 = np.asarray(threshold, dtype=np.float32)
+        rounded_up = threshold32.astype(np.float64) > threshold
+        threshold32[rounded_up] = np.nextafter(threshold32[rounded_up], np.float32(-np.inf))
+        self.threshold32 = threshold32
+        self.feature_index = np.asarray(feature, dtype=np.intp)
+
+        # Global (tree-offset) index of each tree's slot 0, for all-trees-at-once traversal
+        self.tree_base = np.arange(self.n_trees, dtype=np.intp) * self.width
+
+    @classmethod
+    def from_isolation_forest(cls, model):
+        """Compile a fitted sklearn IsolationForest"""
+        n_features = model.n_features_in_
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        depth = max(int(tree.max_depth) for tree in trees)
+        width = 2 ** depth
+
+        feature = np.zeros((len(trees), width), dtype=np.int32)
+        threshold = np.zeros((len(trees), width), dtype=np.float64)
+        leaf_value = np.zeros((len(trees), width), dtype=np.float64)
+
+        # Trees fitted on a feature subset index into X[:, estimators_features_[i]]
+        subsample_features = len(model.estimators_features_[0]) != n_features
+
+        for t, (tree, features) in enumerate(zip(trees, model.estimators_features_)):
+            column_map = np.asarray(features) if subsample_features else np.arange(n_features)
+            corrections = average_path_length(tree.n_node_samples)
+
+            # (source node, heap slot, level); the root is slot 1
+            stack = [(0, 1, 0)]
+            while stack:
+                node, slot, level = stack.pop()
+                if tree.children_left[node] != -1:
+                    feature[t, slot] = column_map[tree.feature[node]]
+                    threshold[t, slot] = tree.threshold[node]
+                    stack.append((tree.children_left[node], 2 * slot, level + 1))
+                    stack.append((tree.children_right[node], 2 * slot + 1, level + 1))
+                    continue
+
+                # Decision path length (root counts as 1) + c(n) - 1
+                value = level + corrections[node]
+
+                # Shallow leaves always route left; all bottom descendants share the value
+                span = 2 ** (depth - level)
+                first = slot * span
+                leaf_value[t, first - width:first - width + span] = value
+                for padded_level in range(depth - level):
+                    level_first = slot * 2 ** padded_level
+                    threshold[t, level_first:level_first + 2 ** padded_level] = np.inf
+
+        denominator = len(trees) * average_path_length([model.max_samples_])[0]
+
+        return cls(feature, threshold, leaf_value, depth, denominator, model.offset_, n_features)
+
+    def path_lengths(self, X):
+        """Sum over trees of the corrected path length for each row of X"""
+        # Trees split on float32 copies of the input; match that for identical routing
+        X = np.asarray(X, dtype=np.float32).reshape(-1, self.n_features)
+        depths = np.zeros(X.shape[0], dtype=np.float64)
+
+        for start in range(0, X.shape[0], CHUNK_ROWS):
+            block = X[start:start + CHUNK_ROWS]
+            if block.shape[0] <= SMALL_BATCH_ROWS:
+                self.traverse_all_trees(block, depths[start:start + CHUNK_ROWS])
+            else:
+                self.traverse_tree_by_tree(block, depths[start:start + CHUNK_ROWS])
+
+        return depths
+
+    def traverse_all_trees(self, block, depths):
+        """Advance every (row, tree) pair one level per step; lowest per-call overhead"""
+        rows = block.shape[0]
+        columns = np.ascontiguousarray(block.T).reshape(-1)
+        feature_offsets = (self.feature_index * rows).reshape(-1)
+        thresholds = self.threshold32.reshape(-1)
+        row_index = np.arange(rows, dtype=np.intp)[:, None]
+
+        node = np.broadcast_to(self.tree_base + 1, (rows, self.n_trees)).copy()
+        lookup = np.empty_like(node)
+        values = np.empty(node.shape, dtype=np.float32)
+        node_thresholds = np.empty(node.shape, dtype=np.float32)
+        go_right = np.empty(node.shape, dtype=bool)
+
+        for _ in range(self.depth):
+            np.take(feature_offsets, node, out=lookup, mode='clip')
+            lookup += row_index
+            np.take(columns, lookup, out=values, mode='clip')
+            np.take(thresholds, node, out=node_thresholds, mode='clip')
+            np.greater(values, node_thresholds, out=go_right)
+            node += node
+            node -= self.tree_base
+            node += go_right
+
+        # Bottom slot 2 ** depth + j maps to leaf j of the same tree
+        node -= self.width
+        depths += np.take(self.leaf_value.reshape(-1), node, mode='clip').sum(axis=1)
+
+    def traverse_tree_by_tree(self, block, depths):
+        """Walk one tree at a time over the whole block; best throughput for large batches"""
+        rows = block.shape[0]
+        columns = np.ascontiguousarray(block.T)
+        columns_flat = columns.reshape(-1)
+        row_index = np.arange(rows, dtype=np.intp)
+
+        node = np.empty(rows, dtype=np.intp)
+        lookup = np.empty(rows, dtype=np.intp)
+        values = np.empty(rows, dtype=np.float32)
+        thresholds = np.empty(rows, dtype=np.float32)
+        go_right = np.empty(rows, dtype=bool)
+
+        for t in range(self.n_trees):
+            feature_offsets = self.feature_index[t] * rows
+            tree_thresholds = self.threshold32[t]
+
+            # Every row starts at the root, so the first split is a plain column compare
+            np.greater(columns[self.feature_index[t, 1]], tree_thresholds[1], out=go_right)
+            np.add(go_right, 2, out=node, casting='unsafe')
+
+            for _ in range(self.depth - 1):
+                np.take(feature_offsets, node, out=lookup, mode='clip')
+                lookup += row_index
+                np.take(columns_flat, lookup, out=values, mode='clip')
+                np.take(tree_thresholds, node, out=thresholds, mode='clip')
+                np.greater(values, thresholds, out=go_right)
+                node += node
+                node += go_right
+
+            node -= self.width
+            depths += np.take(self.leaf_value[t], node, mode='clip')
+
+    def score_samples(self, X):
+        """Same contract as IsolationForest.score_samples (lower is more abnormal)"""
+        depths = self.path_lengths(X)
+        if self.denominator == 0:
+            return -np.ones_like(depths)
+        return -(2.0 ** (-depths / self.denominator))
+
+    def decision_function(self, X):
+        """Same contract as IsolationForest.decision_function"""
+        return self.score_samples(X) - self.offset_
+
+    def predict(self, X):
+        """-1 for anomalies, 1 for inliers"""
+        return np.where(self.decision_function(X) < 0, -1, 1)
+
+    def save(self, path):
+        """Write the arrays as individual .npy files so they can be memory-mapped"""
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+
+        meta = {
+            'depth': self.depth,
+            'denominator': self.denominator,
+            'offset': self.offset_,
+            'n_features': self.n_features,
+            'n_trees': self.n_trees
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a compiled forest, memory-mapping the arrays by default"""
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        arrays = {
+            name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in ARRAY_NAMES
+        }
+        return cls(
+            arrays['feature'],
+            arrays['threshold'],
+            arrays['leaf_value'],
+            meta['depth'],
+            meta['denominator'],
+            meta['offset'],
+            meta['n_features']
+        )
+
+
+class CompiledScaler:
+    """StandardScaler.transform as two arrays, so scoring never imports sklearn
+
+    transform() performs the same in-place subtract and divide as
+    StandardScaler, so scaled values are bit-identical.
+    """
+
+    def __init__(self, mean, scale):
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+
+    @classmethod
+    def from_standard_scaler(cls, scaler):
+        """Export a fitted StandardScaler (scale_ already has zero variances replaced by 1)"""
+        n_features = scaler.n_features_in_
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+        scale = scaler.scale_ if scaler.with_std else np.ones(n_features)
+        return cls(mean, scale)
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != len(self.mean):
+            raise ValueError(f"Expected (n, {len(self.mean)}) features, got {X.shape}")
+        X -= self.mean
+        X /= self.scale
+        return X
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, SCALER_FILE), 'w') as f:
+            json.dump({'mean': self.mean.tolist(), 'scale': self.scale.tolist()}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, SCALER_FILE)) as f:
+            arrays = json.load(f)
+        return cls(arrays['mean'], arrays['scale'])
+
+
+class ForestStack:
+    """Several compiled forests and their scalers, scored in one traversal
+
+    Every member's trees are padded to the deepest member's depth (the
+    extra levels route left, as shallow leaves already do) and concatenated,
+    so the tree_base offsets address any member's trees. Each row is scaled
+    with its own member's mean/scale and walks only that member's range of
+    trees; members with fewer trees than the largest fill the rest of their
+    range with one trailing tree whose leaves are all zero.
+    """
+
+    def __init__(self, forests, scalers):
+        self.depth = max(forest.depth for forest in forests)
+        self.width = 2 ** self.depth
+        self.n_features = forests[0].n_features
+        self.n_members = len(forests)
+        max_trees = max(forest.n_trees for forest in forests)
+        n_trees = sum(forest.n_trees for forest in forests) + 1
+
+        self.feature_index = np.zeros((n_trees, self.width), dtype=np.intp)
+        self.threshold32 = np.full((n_trees, self.width), np.inf, dtype=np.float32)
+        self.leaf_value = np.zeros((n_trees, self.width), dtype=np.float64)
+        self.tree_base = np.arange(n_trees, dtype=np.intp) * self.width
+
+        # member_trees[m] is the global tree index of each of member m's trees
+        self.member_trees = np.full((len(forests), max_trees), n_trees - 1, dtype=np.intp)
+        first = 0
+        for m, forest in enumerate(forests):
+            trees = slice(first, first + forest.n_trees)
+            # Heap slots keep their numbering at any depth; bottom slot j of a
+            # depth-d tree is reached as slot j * 2 ** (depth - d) after padding
+            self.feature_index[trees, :forest.width] = forest.feature_index
+            self.threshold32[trees, :forest.width] = forest.threshold32
+            self.leaf_value[trees, ::self.width // forest.width] = forest.leaf_value
+            self.member_trees[m, :forest.n_trees] = np.arange(first, first + forest.n_trees)
+            first += forest.n_trees
+
+        self.denominator = np.array([forest.denominator for forest in forests], dtype=np.float64)
+        self.offset_ = np.array([forest.offset_ for forest in forests], dtype=np.float64)
+        scalers = [scaler if isinstance(scaler, CompiledScaler) else CompiledScaler.from_standard_scaler(scaler)
+                   for scaler in scalers]
+        self.mean = np.array([scaler.mean for scaler in scalers])
+        self.scale = np.array([scaler.scale for scaler in scalers])
+
+    def nbytes(self):
+        return self.feature_index.nbytes + self.threshold32.nbytes + self.leaf_value.nbytes
+
+    def score_samples(self, X, members):
+        """IsolationForest.score_samples of each row of X under forest members[row]"""
+        X = np.array(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected (n, {self.n_features}) features, got {X.shape}")
+        members = np.asarray(members, dtype=np.intp)
+        X -= self.mean[members]
+        X /= self.scale[members]
+
+        # Rows of one member walk the same trees back to back, which keeps them in cache
+        order = np.argsort(members, kind='stable')
+        X = X[order].astype(np.float32)
+        sorted_members = members[order]
+
+        sorted_depths = np.zeros(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], SMALL_BATCH_ROWS):
+            end = start + SMALL_BATCH_ROWS
+            self.traverse(X[start:end], sorted_members[start:end], sorted_depths[start:end])
+        depths = np.empty_like(sorted_depths)
+        depths[order] = sorted_depths
+
+        denominator = self.denominator[members]
+        scores = -np.ones_like(depths)
+        nonzero = denominator != 0
+        scores[nonzero] = -(2.0 ** (-depths[nonzero] / denominator[nonzero]))
+        return scores
+
+    def traverse(self, block, members, depths):
+        """CompiledForest.traverse_all_trees with a per-row range of trees"""
+        # Row-major lookups (row * n_features + feature), so nothing is
+        # rescaled by the block size across the whole stack on every call
+        values_flat = np.ascontiguousarray(block).reshape(-1)
+        features = self.feature_index.reshape(-1)
+        thresholds = self.threshold32.reshape(-1)
+        row_offset = np.arange(block.shape[0], dtype=np.intp)[:, None] * self.n_features
+
+        base = self.tree_base[self.member_trees[members]]
+        node = base + 1
+        lookup = np.empty_like(node)
+        values = np.empty(node.shape, dtype=np.float32)
+        node_thresholds = np.empty(node.shape, dtype=np.float32)
+        go_right = np.empty(node.shape, dtype=bool)
+
+        for _ in range(self.depth):
+            np.take(features, node, out=lookup, mode='clip')
+            lookup += row_offset
+            np.take(values_flat, lookup, out=values, mode='clip')
+            np.take(thresholds, node, out=node_thresholds, mode='clip')
+            np.greater(values, node_thresholds, out=go_right)
+            node += node
+            node -= base
+            node += go_right
+
+        node -= self.width
+        depths += np.take(self.leaf_value.reshape(-1), node, mode='clip').sum(axis=1)
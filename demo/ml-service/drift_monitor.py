@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Streaming Feature Drift Monitor
+Keeps a KLL quantile sketch per model feature over live traffic and
+compares it with the sketches recorded when the active model was trained,
+so retraining can wait until the feature distributions actually move
+"""
+
+import random
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Capacity of the top compactor; 200 keeps rank error near 1.5% in about 1 KB per sketch
+DEFAULT_K = 200
+
+
+class KLLSketch:
+    """Mergeable quantile sketch in O(k) memory (Karnin, Lang, Liberty)
+
+    Level h holds items standing for 2**h values each. When a level
+    outgrows its capacity it is sorted and every other item (from a random
+    offset) moves up a level, halving the level's weight-carrying items.
+    Capacities shrink geometrically below the top level, so about 3k items
+    are retained however many values are added.
+    """
+
+    def __init__(self, k=DEFAULT_K, seed=None):
+        self.k = k
+        self.levels = [np.empty(0, dtype=np.float32)]
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.rng = random.Random(seed)
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def update(self, values):
+        """Add a batch of values"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values.astype(np.float32)])
+        self.compress()
+
+    def compress(self):
+        """Compact the lowest over-full level until every level fits"""
+        while True:
+            level = next((h for h, items in enumerate(self.levels) if len(items) > self.capacity(h)), None)
+            if level is None:
+                return
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0, dtype=np.float32))
+
+            items = np.sort(self.levels[level])
+            # An odd item out stays behind so the promoted weight is exact
+            keep = items[:len(items) % 2]
+            items = items[len(items) % 2:]
+            promoted = items[self.rng.randint(0, 1)::2]
+            self.levels[level] = keep
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def merge(self, other):
+        """Fold another sketch into this one"""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0, dtype=np.float32))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+
+    def weighted_items(self):
+        """(sorted items, cumulative weights with a leading 0)"""
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** h, dtype=np.float64)
+                                  for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.concatenate([[0.0], np.cumsum(weights[order])])
+
+    def cdf(self, points):
+        """Estimated share of values <= each point"""
+        items, cumulative = self.weighted_items()
+        if cumulative[-1] == 0:
+            return np.zeros(len(np.atleast_1d(points)))
+        return cumulative[np.searchsorted(items, points, side='right')] / cumulative[-1]
+
+    def quantiles(self, fractions):
+        """Estimated values at each rank fraction in [0, 1]"""
+        items, cumulative = self.weighted_items()
+        if not len(items):
+            return np.full(len(np.atleast_1d(fractions)), np.nan)
+        ranks = np.asarray(fractions, dtype=np.float64) * cumulative[-1]
+        return items[np.minimum(np.searchsorted(cumulative[1:], ranks, side='left'), len(items) - 1)].astype(np.float64)
+
+    def retained(self):
+        return sum(len(level) for level in self.levels)
+
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels)
+
+    def to_dict(self):
+        return {
+            'k': self.k,
+            'count': int(self.count),
+            'min': float(self.min) if self.count else None,
+            'max': float(self.max) if self.count else None,
+            'levels': [level.tolist() for level in self.levels]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['k'])
+        sketch.levels = [np.asarray(level, dtype=np.float32) for level in data['levels']]
+        sketch.count = data['count']
+        if data['count']:
+            sketch.min = data['min']
+            sketch.max = data['max']
+        return sketch
+
+
+def ks_distance(a, b):
+    """Kolmogorov-Smirnov distance between the distributions two sketches summarize"""
+    points = np.concatenate([np.concatenate(a.levels), np.concatenate(b.levels)])
+    if not len(points):
+        return 0.0
+    return float(np.max(np.abs(a.cdf(points) - b.cdf(points))))
+
+
+def feature_sketches(matrix, k=DEFAULT_K, seed=0):
+    """One serialized sketch per column of a (n, n_features) matrix"""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    sketches = []
+    for column in range(matrix.shape[1]):
+        sketch = KLLSketch(k, seed=seed + column)
+        sketch.update(matrix[:, column])
+        sketches.append(sketch.to_dict())
+    return sketches
+
+
+class DriftMonitor:
+    """Per-feature KS drift of live traffic against the active model's training sketches
+
+    Live sketches cover a tumbling window of `window` events. Once the
+    current window holds `min_events` events its scores replace the last
+    ones, so a drift decision always rests on at least that many events.
+    """
+
+    def __init__(self, feature_names, threshold=0.2, window=50000, min_events=5000, k=DEFAULT_K, seed=None):
+        self.feature_names = list(feature_names)
+        self.threshold = threshold
+        self.window = window
+        self.min_events = min_events
+        self.k = k
+        self.rng = random.Random(seed)
+        self.reference = None
+        self.reference_version = None
+        self.live = None
+        self.window_events = 0
+        self.scores = {}
+        self.stats = {'windows': 0, 'drifted_windows': 0}
+        self.reset_window()
+
+    def reset_window(self):
+        self.live = [KLLSketch(self.k, seed=self.rng.random()) for _ in self.feature_names]
+        self.window_events = 0
+
+    def set_reference(self, version, sketches):
+        """Compare against a newly activated model; sketches=None when it recorded none"""
+        self.reference_version = version
+        self.reference = [KLLSketch.from_dict(sketch) for sketch in sketches] if sketches else None
+        if sketches is None:
+            logger.info(f"Model version {version} has no training sketches; drift is not monitored for it")
+        self.scores = {}
+        self.reset_window()
+
+    def observe(self, features):
+        """Feed raw (n_events, n_features) rows from the scoring loop"""
+        if not len(features):
+            return
+        for column, sketch in enumerate(self.live):
+            sketch.update(features[:, column])
+        self.window_events += len(features)
+
+        if self.reference is not None and self.window_events >= self.min_events:
+            self.evaluate()
+        if self.window_events >= self.window:
+            self.stats['windows'] += 1
+            if self.drifted():
+                self.stats['drifted_windows'] += 1
+            self.reset_window()
+
+    def evaluate(self):
+        """Recompute per-feature scores from the current window"""
+        self.scores = {
+            name: ks_distance(live, reference)
+            for name, live, reference in zip(self.feature_names, self.live, self.reference)
+        }
+        return self.scores
+
+    def max_drift(self):
+        return max(self.scores.values()) if self.scores else None
+
+    def drifted(self):
+        """True/False once scored against a reference, None when there is nothing to compare with"""
+        if self.reference is None:
+            return None
+        return bool(self.scores) and self.max_drift() >= self.threshold
+
+    def most_drifted(self):
+        return max(self.scores, key=self.scores.get) if self.scores else None
+
+    def nbytes(self):
+        """Memory held by the live and reference sketch items"""
+        return sum(sketch.nbytes() for sketch in self.live + (self.reference or []))
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Incremental Security Event Consumer
+Pages through an index with a point-in-time and search_after cursor in
+event-time order, re-checking an allowed-lateness window behind the newest
+consumed event so late arrivals are still consumed, and each event once
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# One consumed event inside the lateness window: id hash and @timestamp (epoch millis)
+SEEN_DTYPE = np.dtype([('key', '<u8'), ('ts', '<f8')])
+
+# Seen-log entries tolerated before expired ones are compacted away
+COMPACT_MIN_ENTRIES = 10000
+
+# Recently committed seen ids kept apart from the main arrays until they pass
+# this many, or 1/RECENT_FRACTION of the main arrays, whichever is larger
+RECENT_MIN_ENTRIES = 4096
+RECENT_FRACTION = 64
+
+
+def id_key(doc_id):
+    """Stable 64-bit key for a document id"""
+    digest = hashlib.blake2b(str(doc_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def seen_log_path(checkpoint_path, generation):
+    return f"{checkpoint_path}.seen.{generation}"
+
+
+def read_checkpoint(checkpoint_path):
+    """(checkpoint, seen records) as committed; raises OSError/ValueError/KeyError if unreadable
+
+    The checkpoint JSON names the seen log and how many of its records are
+    committed, so a torn append past that count is ignored.
+    """
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+
+    if 'max_event_time' not in checkpoint:
+        # Layout before allowed lateness: a watermark and the ids consumed at exactly that timestamp
+        records = np.array([(id_key(doc_id), checkpoint['watermark']) for doc_id in checkpoint.get('boundary_ids', [])],
+                           dtype=SEEN_DTYPE)
+        # Ids consumed before that watermark are unknown, so never re-scan below it
+        return {'max_event_time': checkpoint['watermark'], 'floor': checkpoint['watermark'], 'generation': 0,
+                'seen_entries': 0}, records
+
+    records = np.empty(0, dtype=SEEN_DTYPE)
+    if checkpoint['seen_entries']:
+        records = np.fromfile(seen_log_path(checkpoint_path, checkpoint['generation']), dtype=SEEN_DTYPE,
+                              count=checkpoint['seen_entries'])
+    return checkpoint, records
+
+
+def write_checkpoint(checkpoint_path, checkpoint):
+    """Atomically replace the checkpoint JSON"""
+    # Write-then-rename so a crash never leaves a truncated checkpoint
+    os.makedirs(os.path.dirname(checkpoint_path) or '.', exist_ok=True)
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(dict(checkpoint, updated_at=datetime.utcnow().isoformat()), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def write_seen_log(checkpoint_path, generation, records, mode='wb'):
+    """Write (or append) seen records durably"""
+    with open(seen_log_path(checkpoint_path, generation), mode) as f:
+        f.write(np.ascontiguousarray(records, dtype=SEEN_DTYPE).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def sorted_contains(sorted_keys, keys):
+    """Membership of each of keys in an ascending uint64 array"""
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    positions = np.searchsorted(sorted_keys, keys)
+    positions[positions == len(sorted_keys)] = 0
+    return sorted_keys[positions] == keys
+
+
+def merge_records(records, entries):
+    """Insert ts-sorted SEEN_DTYPE entries into ts-sorted records"""
+    return np.insert(records, np.searchsorted(records['ts'], entries['ts'], side='right'), entries)
+
+
+class SeenIds:
+    """Ids consumed inside the lateness window, 24 bytes each in NumPy arrays
+
+    `records` are (key, ts) sorted by ts, as in the seen log, so expiring
+    slices a prefix off at the watermark; `keys` is the same keys sorted for
+    searchsorted membership. Commits go to the small `recent` pair first and
+    are merged into the main one once it passes 1/RECENT_FRACTION of its
+    size, so a commit copies O(recent) rather than the whole window. Expired
+    keys stay in `keys` until they outnumber the live ones and it is rebuilt;
+    their events are below the watermark, which no scan reads.
+    """
+
+    def __init__(self, records=None):
+        self.records = np.empty(0, dtype=SEEN_DTYPE)
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.recent = np.empty(0, dtype=SEEN_DTYPE)
+        self.recent_keys = np.empty(0, dtype=np.uint64)
+        if records is not None and len(records):
+            self.records = records[np.argsort(records['ts'], kind='stable')]
+            self.keys = np.sort(records['key'])
+
+    def __len__(self):
+        return len(self.records) + len(self.recent)
+
+    def contains(self, keys):
+        """Boolean mask of which keys were consumed"""
+        keys = np.asarray(keys, dtype=np.uint64)
+        return sorted_contains(self.keys, keys) | sorted_contains(self.recent_keys, keys)
+
+    def add(self, entries):
+        """Record committed (key, ts) entries"""
+        entries = np.sort(np.asarray(entries, dtype=SEEN_DTYPE), order='ts', kind='stable')
+        self.recent = merge_records(self.recent, entries)
+        keys = np.sort(entries['key'])
+        self.recent_keys = np.insert(self.recent_keys, np.searchsorted(self.recent_keys, keys), keys)
+        if len(self.recent) > max(RECENT_MIN_ENTRIES, len(self.records) // RECENT_FRACTION):
+            self.merge()
+
+    def merge(self):
+        self.records = merge_records(self.records, self.recent)
+        if len(self.keys) + len(self.recent_keys) > 2 * len(self.records):
+            self.keys = np.sort(self.records['key'])
+        else:
+            self.keys = np.insert(self.keys, np.searchsorted(self.keys, self.recent_keys), self.recent_keys)
+        self.recent = np.empty(0, dtype=SEEN_DTYPE)
+        self.recent_keys = np.empty(0, dtype=np.uint64)
+
+    def expire(self, watermark):
+        """Forget records older than the watermark"""
+        self.records = self.records[np.searchsorted(self.records['ts'], watermark):]
+        self.recent = self.recent[np.searchsorted(self.recent['ts'], watermark):]
+
+    def nbytes(self):
+        return self.records.nbytes + self.keys.nbytes + self.recent.nbytes + self.recent_keys.nbytes
+
+    def to_records(self):
+        """Every live record, for rewriting the seen log"""
+        return np.concatenate([self.records, self.recent])
+
+
+class EventConsumer:
+    """Event-time cursor over one index
+
+    The committed position is the newest event time consumed plus the ids of
+    every event consumed within `allowed_lateness` seconds of it. Each poll
+    first re-scans that window (ids only, sources fetched for unseen ids),
+    then reads everything newer, so an event indexed up to allowed_lateness
+    behind the newest one is still consumed exactly once. Later arrivals
+    are below the watermark and are not read.
+    """
+
+    def __init__(self, es, index='security-events', checkpoint_path='/models/state/security-events.checkpoint.json',
+                 page_size=1000, keep_alive='1m', start_from='now-5m', query_filter=None, allowed_lateness=300):
+        self.es = es
+        self.index = index
+        self.query_filter = query_filter
+        self.checkpoint_path = checkpoint_path
+        self.page_size = page_size
+        self.keep_alive = keep_alive
+        self.start_from = start_from
+        self.allowed_lateness_ms = float(allowed_lateness) * 1000.0
+
+        # Committed position: newest event time, and the ids consumed inside the lateness window
+        self.max_event_time = None
+        self.floor = None
+        self.seen = SeenIds()
+        self.generation = 0
+        self.log_entries = 0
+        self.load_checkpoint()
+
+        # Consumed by poll() but not yet committed, in consumption order. The async
+        # pipeline commits on an executor thread while poll_async() keeps advancing
+        # on the event loop, so pending/seen changes hold this lock (file I/O does not)
+        self.lock = threading.Lock()
+        self.pending_max_event_time = self.max_event_time
+        self.pending = []
+        self.pending_keys = set()
+        self.committed_sequence = 0
+        self.stats = {'events': 0, 'late_events': 0, 'rescanned_hits': 0}
+
+    @property
+    def watermark(self):
+        """Oldest event time still consumed, or None before the first commit"""
+        if self.max_event_time is None:
+            return None
+        watermark = self.max_event_time - self.allowed_lateness_ms
+        return watermark if self.floor is None else max(watermark, self.floor)
+
+    def load_checkpoint(self):
+        """Restore the committed position from disk"""
+        if not os.path.exists(self.checkpoint_path):
+            logger.info(f"No checkpoint for {self.index}, starting from {self.start_from}")
+            return
+
+        try:
+            checkpoint, records = read_checkpoint(self.checkpoint_path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Unreadable checkpoint {self.checkpoint_path}, starting from {self.start_from}: {str(e)}")
+            return
+
+        self.max_event_time = checkpoint['max_event_time']
+        self.floor = checkpoint.get('floor')
+        self.seen = SeenIds(records[records['ts'] >= self.watermark])
+
+        # Start a fresh log, dropping any torn append and expired records
+        self.generation = checkpoint['generation'] + 1
+        self.rewrite_seen_log()
+        logger.info(f"Resuming {self.index} from checkpoint at {self.max_event_time} "
+                    f"({len(self.seen)} events inside the lateness window)")
+
+    def rewrite_seen_log(self):
+        """Write the committed seen set as a new log generation and switch the checkpoint to it"""
+        old_generation = self.generation - 1
+        records = self.seen.to_records()
+        write_seen_log(self.checkpoint_path, self.generation, records)
+        self.log_entries = len(records)
+        self.write_checkpoint()
+        old_path = seen_log_path(self.checkpoint_path, old_generation)
+        if os.path.exists(old_path):
+            os.remove(old_path)
+
+    def write_checkpoint(self):
+        write_checkpoint(self.checkpoint_path, {
+            'index': self.index,
+            'max_event_time': self.max_event_time,
+            'allowed_lateness_ms': self.allowed_lateness_ms,
+            'floor': self.floor,
+            'generation': self.generation,
+            'seen_entries': self.log_entries
+        })
+
+    def position(self):
+        """Snapshot of the pending position, for committing a page after later pages were read"""
+        with self.lock:
+            return self.pending_max_event_time, self.committed_sequence + len(self.pending)
+
+    def commit(self, position=None):
+        """Persist the position reached by the last poll() page, or an earlier position() snapshot"""
+        if position is None:
+            position = self.position()
+        max_event_time, sequence = position
+        with self.lock:
+            count = sequence - self.committed_sequence
+            entries, self.pending = self.pending[:count], self.pending[count:]
+            self.committed_sequence = sequence
+            self.max_event_time = max_event_time
+            if max_event_time is None:
+                return
+            if self.floor is not None and max_event_time - self.allowed_lateness_ms >= self.floor:
+                self.floor = None
+
+            if entries:
+                self.seen.add(np.array(entries, dtype=SEEN_DTYPE))
+                self.pending_keys.difference_update(key for key, _ in entries)
+
+            # Forget ids that fell behind the watermark; their events can no longer be read
+            self.seen.expire(self.watermark)
+
+        # Append to the seen log, then publish its new length; rewrite it once mostly expired
+        if self.log_entries + len(entries) > max(2 * len(self.seen), COMPACT_MIN_ENTRIES):
+            self.generation += 1
+            self.rewrite_seen_log()
+            return
+        if entries:
+            write_seen_log(self.checkpoint_path, self.generation, np.array(entries, dtype=SEEN_DTYPE), mode='ab')
+            self.log_entries += len(entries)
+        self.write_checkpoint()
+
+    def reset_pending(self):
+        """Forget uncommitted progress; those events are re-read"""
+        with self.lock:
+            self.pending_max_event_time = self.max_event_time
+            self.pending = []
+            self.pending_keys = set()
+
+    def build_query(self, time_range):
+        """Range query on @timestamp plus any partition filter"""
+        query = {"range": {"@timestamp": time_range}}
+        if self.query_filter is not None:
+            query = {"bool": {"filter": [query, self.query_filter]}}
+        return query
+
+    def scans(self):
+        """(time range, with sources) per scan: the lateness window below the newest event, then newer events"""
+        if self.max_event_time is None:
+            return [({"gte": self.start_from}, True)]
+        scans = []
+        if self.watermark < self.max_event_time:
+            scans.append(({"gte": self.watermark, "lt": self.max_event_time, "format": "epoch_millis"}, False))
+        scans.append(({"gte": self.max_event_time, "format": "epoch_millis"}, True))
+        return scans
+
+    def unseen(self, hits):
+        """Hits not consumed yet"""
+        keys = [id_key(hit['_id']) for hit in hits]
+        seen = self.seen.contains(keys)
+        return [hit for hit, key, consumed in zip(hits, keys, seen) if not consumed and key not in self.pending_keys]
+
+    def fetch_body(self, pit_id, time_range, hits):
+        """Request for the sources of a rescanned page's unseen hits, in the same order"""
+        body = self.search_body(pit_id, time_range, None)
+        body["query"] = {"bool": {"filter": [self.build_query(time_range), {"ids": {"values": [hit['_id'] for hit in hits]}}]}}
+        body["size"] = len(hits)
+        return body
+
+    def poll(self):
+        """Yield pages of new hits in @timestamp order until caught up
+
+        Pages are yielded one at a time so memory stays bounded by page_size.
+        Call commit() after a page has been fully handled; uncommitted pages
+        are re-read on the next poll() or after a restart.
+        """
+        self.reset_pending()
+        pit_id = self.es.open_point_in_time(index=self.index, keep_alive=self.keep_alive)['id']
+
+        try:
+            for time_range, with_source in self.scans():
+                search_after = None
+                while True:
+                    response = self.es.search(body=self.search_body(pit_id, time_range, search_after, with_source))
+                    pit_id = response.get('pit_id', pit_id)
+                    hits = response['hits']['hits']
+                    if not hits:
+                        break
+
+                    search_after = hits[-1]['sort']
+                    new_hits = self.unseen(hits)
+                    if not with_source:
+                        self.stats['rescanned_hits'] += len(hits)
+                        if new_hits:
+                            response = self.es.search(body=self.fetch_body(pit_id, time_range, new_hits))
+                            pit_id = response.get('pit_id', pit_id)
+                            new_hits = response['hits']['hits']
+                    new_hits = self.advance(new_hits)
+                    if new_hits:
+                        yield new_hits
+
+                    if len(hits) < self.page_size:
+                        break
+        finally:
+            try:
+                self.es.close_point_in_time(id=pit_id)
+            except Exception as e:
+                logger.warning(f"Failed to close point-in-time for {self.index}: {str(e)}")
+
+    async def poll_async(self, es):
+        """poll() for an AsyncElasticsearch client; yields (hits, position) per page
+
+        Pages can be read ahead of processing, so each page carries the
+        position() to commit once that page is fully handled.
+        """
+        self.reset_pending()
+        pit_id = (await es.open_point_in_time(index=self.index, keep_alive=self.keep_alive))['id']
+
+        try:
+            for time_range, with_source in self.scans():
+                search_after = None
+                while True:
+                    response = await es.search(body=self.search_body(pit_id, time_range, search_after, with_source))
+                    pit_id = response.get('pit_id', pit_id)
+                    hits = response['hits']['hits']
+                    if not hits:
+                        break
+
+                    search_after = hits[-1]['sort']
+                    new_hits = self.unseen(hits)
+                    if not with_source:
+                        self.stats['rescanned_hits'] += len(hits)
+                        if new_hits:
+                            response = await es.search(body=self.fetch_body(pit_id, time_range, new_hits))
+                            pit_id = response.get('pit_id', pit_id)
+                            new_hits = response['hits']['hits']
+                    new_hits = self.advance(new_hits)
+                    if new_hits:
+                        yield new_hits, self.position()
+
+                    if len(hits) < self.page_size:
+                        break
+        finally:
+            try:
+                await es.close_point_in_time(id=pit_id)
+            except Exception as e:
+                logger.warning(f"Failed to close point-in-time for {self.index}: {str(e)}")
+
+    def search_body(self, pit_id, time_range, search_after, with_source=True):
+        """One page request against the point-in-time"""
+        body = {
+            "query": self.build_query(time_range),
+            "pit": {"id": pit_id, "keep_alive": self.keep_alive},
+            "sort": [{"@timestamp": "asc"}, {"_shard_doc": "asc"}],
+            "size": self.page_size,
+            "track_total_hits": False
+        }
+        if not with_source:
+            body["_source"] = False
+        if search_after is not None:
+            body["search_after"] = search_after
+        return body
+
+    def advance(self, hits):
+        """Record a page of hits as consumed; returns those that were not already"""
+        keys = [id_key(hit['_id']) for hit in hits]
+        advanced = []
+        with self.lock:
+            seen = self.seen.contains(keys)
+            for hit, key, consumed in zip(hits, keys, seen):
+                if consumed or key in self.pending_keys:
+                    continue
+
+                timestamp = hit['sort'][0]
+                if self.pending_max_event_time is not None and timestamp < self.pending_max_event_time:
+                    self.stats['late_events'] += 1
+                else:
+                    self.pending_max_event_time = timestamp
+                self.stats['events'] += 1
+                self.pending.append((key, timestamp))
+                self.pending_keys.add(key)
+                advanced.append(hit)
+        return advanced
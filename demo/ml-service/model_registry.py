@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Versioned Model Registry
+Stores each trained model as an immutable version directory with a
+manifest, and promotes versions atomically through a CURRENT pointer
+"""
+
+import os
+import json
+import uuid
+import shutil
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from compiled_forest import SCALER_FILE as COMPILED_SCALER_FILE, CompiledForest, CompiledScaler
+from drift_monitor import feature_sketches
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = 'model.pkl'
+SCALER_FILE = 'scaler.pkl'
+COMPILED_DIR = 'compiled'
+MANIFEST_FILE = 'manifest.json'
+SKETCHES_FILE = 'sketches.json'
+CURRENT_FILE = 'CURRENT'
+
+
+def summarize_features(matrix):
+    """Per-feature training statistics recorded in the manifest"""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    return {
+        'n_samples': int(matrix.shape[0]),
+        'feature_mean': matrix.mean(axis=0).tolist(),
+        'feature_std': matrix.std(axis=0).tolist(),
+        'feature_min': matrix.min(axis=0).tolist(),
+        'feature_max': matrix.max(axis=0).tolist(),
+        # Stored beside the manifest by publish(), as the drift reference
+        'feature_sketches': feature_sketches(matrix)
+    }
+
+
+class RegisteredModel:
+    """Everything needed to score with one registry version
+
+    Scoring only touches `scaler` and `compiled`; the sklearn estimator is
+    unpickled (importing sklearn) the first time `model` is read.
+    """
+
+    def __init__(self, version, manifest, model, scaler, compiled, path=None, mmap_mode='r'):
+        self.version = version
+        self.manifest = manifest
+        self._model = model
+        self.scaler = scaler
+        self.compiled = compiled
+        self.path = path
+        self.mmap_mode = mmap_mode
+
+    @property
+    def model(self):
+        if self._model is None and self.path is not None:
+            import joblib
+
+            self._model = joblib.load(os.path.join(self.path, MODEL_FILE), mmap_mode=self.mmap_mode)
+        return self._model
+
+
+class ModelRegistry:
+    def __init__(self, root='/models/registry'):
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+    def version_path(self, version):
+        """Directory holding a version's artifacts"""
+        return os.path.join(self.versions_dir, version)
+
+    def list_versions(self):
+        """All published versions, oldest first"""
+        return sorted(
+            name for name in os.listdir(self.versions_dir)
+            if not name.startswith('.') and os.path.exists(os.path.join(self.versions_dir, name, MANIFEST_FILE))
+        )
+
+    def current_version(self):
+        """Version the CURRENT pointer names, or None before the first promotion"""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def publish(self, model, scaler, feature_names, training_stats=None, source='unknown', promote=True):
+        """Write a new immutable version and optionally make it current"""
+        import joblib
+
+        training_stats = dict(training_stats or {})
+        sketches = training_stats.pop('feature_sketches', None)
+        version = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:6]}"
+        staging = os.path.join(self.versions_dir, f'.staging-{version}')
+        os.makedirs(staging)
+
+        try:
+            joblib.dump(model, os.path.join(staging, MODEL_FILE))
+            joblib.dump(scaler, os.path.join(staging, SCALER_FILE))
+            compiled = CompiledForest.from_isolation_forest(model)
+            compiled.save(os.path.join(staging, COMPILED_DIR))
+            CompiledScaler.from_standard_scaler(scaler).save(os.path.join(staging, COMPILED_DIR))
+
+            manifest = {
+                'version': version,
+                'created_at': datetime.utcnow().isoformat(),
+                'source': source,
+                'feature_names': list(feature_names),
+                'model': {
+                    'type': type(model).__name__,
+                    'params': {
+                        key: value for key, value in model.get_params().items()
+                        if isinstance(value, (int, float, str, bool, type(None)))
+                    },
+                    'offset': float(model.offset_)
+                },
+                'training_stats': training_stats
+            }
+            with open(os.path.join(staging, MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            if sketches is not None:
+                with open(os.path.join(staging, SKETCHES_FILE), 'w') as f:
+                    json.dump(sketches, f)
+
+            # A version directory only ever appears fully written
+            os.rename(staging, self.version_path(version))
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        logger.info(f"Published model version {version} ({source})")
+        if promote:
+            self.promote(version)
+        return version
+
+    def promote(self, version):
+        """Atomically point CURRENT at an existing version"""
+        if not os.path.exists(os.path.join(self.version_path(version), MANIFEST_FILE)):
+            raise ValueError(f"Unknown model version: {version}")
+
+        pointer = os.path.join(self.root, CURRENT_FILE)
+        tmp_pointer = f"{pointer}.tmp"
+        with open(tmp_pointer, 'w') as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_pointer, pointer)
+        logger.info(f"Promoted model version {version}")
+
+    def read_manifest(self, version):
+        """Manifest of a published version"""
+        with open(os.path.join(self.version_path(version), MANIFEST_FILE)) as f:
+            return json.load(f)
+
+    def read_sketches(self, version):
+        """Per-feature training sketches of a version, or None if it recorded none"""
+        try:
+            with open(os.path.join(self.version_path(version), SKETCHES_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load(self, version=None, mmap_mode='r'):
+        """Load a version (CURRENT by default) for scoring, with memory-mapped arrays
+
+        Versions with a compiled scaler load without importing sklearn;
+        older ones unpickle scaler.pkl instead.
+        """
+        version = version or self.current_version()
+        if version is None:
+            raise LookupError(f"No model version has been promoted in {self.root}")
+
+        path = self.version_path(version)
+        compiled_path = os.path.join(path, COMPILED_DIR)
+        if os.path.exists(os.path.join(compiled_path, COMPILED_SCALER_FILE)):
+            scaler = CompiledScaler.load(compiled_path)
+        else:
+            import joblib
+
+            logger.info(f"Model version {version} has no compiled scaler, loading {SCALER_FILE}")
+            scaler = joblib.load(os.path.join(path, SCALER_FILE), mmap_mode=mmap_mode)
+        return RegisteredModel(
+            version=version,
+            manifest=self.read_manifest(version),
+            model=None,
+            scaler=scaler,
+            compiled=CompiledForest.load(compiled_path, mmap_mode=mmap_mode),
+            path=path,
+            mmap_mode=mmap_mode
+        )
+
+    def import_version(self, source_root, version=None, promote=True):
+        """Copy a version (the source's CURRENT by default) from another registry; returns it or None"""
+        if not os.path.isdir(os.path.join(source_root, 'versions')):
+            return None
+        source = ModelRegistry(source_root)
+        version = version or source.current_version()
+        if version is None or not os.path.exists(os.path.join(source.version_path(version), MANIFEST_FILE)):
+            return None
+
+        if not os.path.exists(self.version_path(version)):
+            staging = os.path.join(self.versions_dir, f'.staging-{version}')
+            shutil.rmtree(staging, ignore_errors=True)
+            shutil.copytree(source.version_path(version), staging)
+            os.rename(staging, self.version_path(version))
+            logger.info(f"Imported model version {version} from {source_root}")
+        if promote:
+            self.promote(version)
+        return version
+
+    def import_legacy(self, model_path, scaler_path, feature_names):
+        """Adopt a pre-registry threat_model.pkl/scaler.pkl pair as a version"""
+        if not (os.path.exists(model_path) and os.path.exists(scaler_path)):
+            return None
+
+        import joblib
+
+        logger.info(f"Importing legacy model from {model_path}")
+        return self.publish(
+            joblib.load(model_path),
+            joblib.load(scaler_path),
+            feature_names,
+            source='legacy_import'
+        )
+
+    def prune(self, keep=5):
+        """Delete the oldest versions, never touching the current one"""
+        current = self.current_version()
+        versions = self.list_versions()
+        for version in versions[:max(0, len(versions) - keep)]:
+            if version != current:
+                shutil.rmtree(self.version_path(version), ignore_errors=True)
+                logger.info(f"Pruned model version {version}")
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+Offline Bulk Training
+Exports model features for a historical range into memory-mapped NumPy
+files, fits the scaler incrementally over them and trains the forest on a
+stratified subsample, publishing the result through the model registry
+"""
+
+import os
+import json
+import time
+import struct
+import logging
+import resource
+from datetime import datetime
+
+import numpy as np
+
+from drift_monitor import KLLSketch
+from model_registry import ModelRegistry, summarize_features
+from replay import dump_record, open_dump, range_query
+from segment_models import segment_registry_root, segment_value
+from threat_detector import FEATURE_NAMES, ThreatDetector
+from ueba_batch import event_time
+
+logger = logging.getLogger(__name__)
+
+FEATURES_FILE = 'features.npy'
+STRATA_FILE = 'strata.npy'
+EXPORT_MANIFEST = 'export.json'
+
+# Fixed .npy header size, so the final row count can be written in place once known
+NPY_HEADER_BYTES = 128
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+def npy_header(dtype, shape):
+    """Version 1.0 .npy header padded to exactly NPY_HEADER_BYTES"""
+    header = f"{{'descr': '{np.dtype(dtype).str}', 'fortran_order': False, 'shape': {tuple(shape)}, }}"
+    header_len = NPY_HEADER_BYTES - len(NPY_MAGIC) - 2
+    if len(header) + 1 > header_len:
+        raise ValueError(f"Shape {shape} does not fit a {NPY_HEADER_BYTES}-byte .npy header")
+    return NPY_MAGIC + struct.pack('<H', header_len) + (header.ljust(header_len - 1) + '\n').encode('latin1')
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class FeatureExport:
+    """Append-only feature matrix plus per-row stratum codes on disk
+
+    Both files are ordinary .npy arrays: rows are streamed to the end of
+    the file and the header's shape is rewritten on close(), so the result
+    can be reopened with np.load(mmap_mode='r') without another copy.
+    """
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.feature_file = None
+        self.strata_file = None
+
+    @classmethod
+    def create(cls, path, feature_names, stratify_by, source):
+        os.makedirs(path, exist_ok=True)
+        export = cls(path, {
+            'feature_names': list(feature_names),
+            'stratify_by': stratify_by,
+            'strata': [],
+            'rows': 0,
+            'source': source,
+            'complete': False
+        })
+        export.feature_file = open(os.path.join(path, FEATURES_FILE), 'wb')
+        export.strata_file = open(os.path.join(path, STRATA_FILE), 'wb')
+        export.write_headers()
+        return export
+
+    @classmethod
+    def open(cls, path):
+        """Reopen a finished export"""
+        with open(os.path.join(path, EXPORT_MANIFEST)) as f:
+            manifest = json.load(f)
+        if not manifest.get('complete'):
+            raise ValueError(f"Export in {path} was never completed")
+        return cls(path, manifest)
+
+    def write_headers(self):
+        n_features = len(self.manifest['feature_names'])
+        for f, dtype, shape in [(self.feature_file, np.float64, (self.manifest['rows'], n_features)),
+                                (self.strata_file, np.int16, (self.manifest['rows'],))]:
+            f.seek(0)
+            f.write(npy_header(dtype, shape))
+            f.seek(0, os.SEEK_END)
+
+    def append_events(self, events):
+        """Extract and append one page of events"""
+        if not events:
+            return
+        stratify_by = self.manifest['stratify_by']
+        values = [segment_value(event, stratify_by) for event in events]
+        self.append_rows(ThreatDetector.extract_features_batch(events), values)
+
+    def append_rows(self, features, stratum_values):
+        """Append raw feature rows with their stratum labels"""
+        strata = self.manifest['strata']
+        codes = {value: code for code, value in enumerate(strata)}
+        row_codes = np.empty(len(stratum_values), dtype=np.int16)
+        for i, value in enumerate(stratum_values):
+            code = codes.get(value)
+            if code is None:
+                if len(strata) > np.iinfo(np.int16).max:
+                    raise ValueError(f"Too many distinct {self.manifest['stratify_by']} values to stratify on")
+                code = codes[value] = len(strata)
+                strata.append(value)
+            row_codes[i] = code
+
+        self.feature_file.write(np.ascontiguousarray(features, dtype=np.float64).tobytes())
+        self.strata_file.write(row_codes.tobytes())
+        self.manifest['rows'] += len(row_codes)
+
+    def close(self):
+        """Finalize the headers and manifest"""
+        self.write_headers()
+        for f in (self.feature_file, self.strata_file):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+        self.manifest.update(complete=True, completed_at=datetime.utcnow().isoformat())
+        with open(os.path.join(self.path, EXPORT_MANIFEST), 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        logger.info(f"Exported {self.manifest['rows']:,} rows into {self.path}")
+
+    @property
+    def rows(self):
+        return self.manifest['rows']
+
+    def features(self):
+        return np.load(os.path.join(self.path, FEATURES_FILE), mmap_mode='r')
+
+    def strata(self):
+        return np.load(os.path.join(self.path, STRATA_FILE), mmap_mode='r')
+
+    def chunks(self, chunk_rows):
+        """(features, strata) copies of consecutive chunks
+
+        Each chunk is read through its own short-lived mapping, so resident
+        memory stays at one chunk however large the export is.
+        """
+        for start in range(0, self.rows, chunk_rows):
+            features, strata = self.features(), self.strata()
+            stop = min(start + chunk_rows, self.rows)
+            yield np.array(features[start:stop]), np.array(strata[start:stop])
+            del features, strata
+
+
+def export_from_es(es, path, start, end, index='security-events', stratify_by='event_type', page_size=10000,
+                   scroll_keep_alive='5m'):
+    """Scroll a time range in _doc order, fetching only the model and stratum fields"""
+    export = FeatureExport.create(path, FEATURE_NAMES, stratify_by, source={'index': index, 'start': start,
+                                                                             'end': end})
+    body = {
+        "query": range_query(start, end),
+        "sort": ["_doc"],
+        "size": page_size,
+        "_source": FEATURE_NAMES + [stratify_by]
+    }
+    response = es.search(index=index, scroll=scroll_keep_alive, body=body)
+    scroll_id = response.get('_scroll_id')
+    try:
+        while response['hits']['hits']:
+            export.append_events([hit['_source'] for hit in response['hits']['hits']])
+            response = es.scroll(scroll_id=scroll_id, scroll=scroll_keep_alive)
+            scroll_id = response.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id:
+            try:
+                es.clear_scroll(scroll_id=scroll_id)
+            except Exception as e:
+                logger.warning(f"Failed to clear export scroll: {str(e)}")
+    export.close()
+    return export
+
+
+def export_from_files(paths, path, start, end, stratify_by='event_type', page_size=10000):
+    """Stream NDJSON(.gz) dumps, keeping events inside [start, end)"""
+    export = FeatureExport.create(path, FEATURE_NAMES, stratify_by, source={'files': list(paths), 'start': start,
+                                                                             'end': end})
+    start_time, end_time = event_time({'@timestamp': start}), event_time({'@timestamp': end})
+    for dump_path in paths:
+        events = []
+        with open_dump(dump_path) as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                _, event = dump_record(json.loads(line), dump_path, line_number)
+                if start_time <= event_time(event) < end_time:
+                    events.append(event)
+                if len(events) >= page_size:
+                    export.append_events(events)
+                    events = []
+        export.append_events(events)
+    export.close()
+    return export
+
+
+class OfflineTrainer:
+    """Scaler partial_fit over an export, then a forest on a stratified subsample
+
+    Every stratum keeps its share of the subsample, but never fewer than
+    min_per_stratum rows (or all of them, if it has fewer), so rare event
+    types are still represented in the trees' subsamples.
+    """
+
+    def __init__(self, registry, sample_size=1000000, min_per_stratum=1000, chunk_rows=1000000, n_jobs=-1,
+                 model_params=None, seed=42):
+        self.registry = registry
+        self.sample_size = sample_size
+        self.min_per_stratum = min_per_stratum
+        self.chunk_rows = chunk_rows
+        self.rng = np.random.default_rng(seed)
+        self.model_params = dict(model_params or {
+            'contamination': 0.1,
+            'random_state': seed,
+            'n_estimators': 100
+        }, n_jobs=n_jobs)
+        self.phases = {}
+
+    def timed(self, phase, func, *args):
+        started = time.time()
+        result = func(*args)
+        self.phases[phase] = time.time() - started
+        logger.info(f"{phase}: {self.phases[phase]:.1f}s (peak RSS {peak_rss_mb():.0f} MB)")
+        return result
+
+    def fit_scaler(self, export):
+        """One chunked pass: scaler partial_fit, per-stratum counts, feature min/max and drift sketches"""
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler()
+        sketches = [KLLSketch(seed=column) for column in range(len(export.manifest['feature_names']))]
+        counts = np.zeros(len(export.manifest['strata']), dtype=np.int64)
+        minimum = np.full(len(export.manifest['feature_names']), np.inf)
+        maximum = np.full(len(export.manifest['feature_names']), -np.inf)
+        for features, strata in export.chunks(self.chunk_rows):
+            scaler.partial_fit(features)
+            counts += np.bincount(strata, minlength=len(counts))
+            np.minimum(minimum, features.min(axis=0), out=minimum)
+            np.maximum(maximum, features.max(axis=0), out=maximum)
+            for column, sketch in enumerate(sketches):
+                sketch.update(features[:, column])
+        return scaler, counts, minimum, maximum, [sketch.to_dict() for sketch in sketches]
+
+    def allocate(self, counts):
+        """Rows to draw per stratum: proportional, floored at min_per_stratum"""
+        total = counts.sum()
+        if total <= self.sample_size:
+            return counts.copy()
+        quota = np.floor(counts * (self.sample_size / total)).astype(np.int64)
+        return np.minimum(counts, np.maximum(quota, self.min_per_stratum))
+
+    def stratified_sample(self, export, counts, allocation=None):
+        """Gather the subsample in one chunked pass; returns (rows, their stratum codes, allocation)
+
+        Selection sampling: each chunk takes a hypergeometric share of what
+        its stratum still owes, so every row is equally likely to be drawn
+        without ever materializing indices for the whole export.
+        """
+        allocation = self.allocate(counts) if allocation is None else allocation
+        remaining = counts.copy()
+        owed = allocation.copy()
+
+        sample = np.empty((int(allocation.sum()), len(export.manifest['feature_names'])), dtype=np.float64)
+        sample_strata = np.empty(len(sample), dtype=np.int16)
+        filled = 0
+        for features, strata in export.chunks(self.chunk_rows):
+            keep = np.zeros(len(strata), dtype=bool)
+            for code in np.unique(strata):
+                rows = np.flatnonzero(strata == code)
+                take = owed[code]
+                if take < remaining[code]:
+                    take = self.rng.hypergeometric(len(rows), remaining[code] - len(rows), owed[code])
+                if take >= len(rows):
+                    keep[rows] = True
+                elif take:
+                    keep[self.rng.choice(rows, size=take, replace=False)] = True
+                remaining[code] -= len(rows)
+                owed[code] -= take
+
+            picked = features[keep]
+            sample[filled:filled + len(picked)] = picked
+            sample_strata[filled:filled + len(picked)] = strata[keep]
+            filled += len(picked)
+        return sample[:filled], sample_strata[:filled], allocation
+
+    def fit_forest(self, scaler, sample):
+        from sklearn.ensemble import IsolationForest
+
+        model = IsolationForest(**self.model_params)
+        model.fit(scaler.transform(sample))
+        return model
+
+    def train(self, export, promote=True):
+        """Train on a finished export and publish; returns (version, training_stats)"""
+        if export.rows == 0:
+            raise ValueError(f"Export in {export.path} has no rows")
+        if export.manifest['feature_names'] != FEATURE_NAMES:
+            raise ValueError(f"Export features {export.manifest['feature_names']} do not match {FEATURE_NAMES}")
+
+        started = time.time()
+        scaler, counts, minimum, maximum, sketches = self.timed('scaler_seconds', self.fit_scaler, export)
+        sample, _, allocation = self.timed('sample_seconds', self.stratified_sample, export, counts)
+        model = self.timed('fit_seconds', self.fit_forest, scaler, sample)
+
+        strata = export.manifest['strata']
+        stats = {
+            'n_samples': int(export.rows),
+            'feature_mean': scaler.mean_.tolist(),
+            'feature_std': np.sqrt(scaler.var_).tolist(),
+            'feature_min': minimum.tolist(),
+            'feature_max': maximum.tolist(),
+            # Over the whole export, not the stratified sample the forest saw
+            'feature_sketches': sketches,
+            'training_seconds': time.time() - started,
+            'phase_seconds': dict(self.phases),
+            'peak_rss_mb': peak_rss_mb(),
+            'export_bytes': os.path.getsize(os.path.join(export.path, FEATURES_FILE)),
+            'sample_rows': int(len(sample)),
+            'stratify_by': export.manifest['stratify_by'],
+            'strata_rows': {value: int(count) for value, count in zip(strata, counts)},
+            'strata_sample_rows': {value: int(take) for value, take in zip(strata, allocation)}
+        }
+        version = self.registry.publish(model, scaler, FEATURE_NAMES, training_stats=stats, source='offline_bulk',
+                                        promote=promote)
+        return version, stats
+
+    def train_segments(self, export, min_rows=10000, promote=True):
+        """One model per stratum value with at least min_rows rows; returns {value: version}
+
+        Segment models are published into their own registries (see
+        segment_models.segment_registry_root); strata below min_rows keep
+        scoring with the global model. Each segment gets its own scaler and
+        up to sample_size rows, gathered for all segments in one pass.
+        Rows missing the field never get a segment model.
+        """
+        from sklearn.preprocessing import StandardScaler
+
+        strata = export.manifest['strata']
+        segment_by = export.manifest['stratify_by']
+        scalers = {}
+        n_features = len(export.manifest['feature_names'])
+        minimum = np.full((len(strata), n_features), np.inf)
+        maximum = np.full((len(strata), n_features), -np.inf)
+
+        started = time.time()
+        for features, codes in export.chunks(self.chunk_rows):
+            for code in np.unique(codes):
+                rows = features[codes == code]
+                scalers.setdefault(code, StandardScaler()).partial_fit(rows)
+                np.minimum(minimum[code], rows.min(axis=0), out=minimum[code])
+                np.maximum(maximum[code], rows.max(axis=0), out=maximum[code])
+        counts = np.array([scalers[code].n_samples_seen_ if code in scalers else 0 for code in range(len(strata))],
+                          dtype=np.int64)
+
+        # Events without the field are a mix of everything, so they stay with the global model
+        eligible = (counts >= min_rows) & np.array([value != '' for value in strata], dtype=bool)
+        allocation = np.where(eligible, np.minimum(counts, self.sample_size), 0)
+        sample, sample_strata, _ = self.stratified_sample(export, counts, allocation)
+        shared_seconds = time.time() - started
+        logger.info(f"Segment scalers and samples for {int(eligible.sum())} {segment_by} values: "
+                    f"{shared_seconds:.1f}s (peak RSS {peak_rss_mb():.0f} MB)")
+
+        versions = {}
+        for code in np.flatnonzero(eligible):
+            fit_started = time.time()
+            rows = sample[sample_strata == code]
+            model = self.fit_forest(scalers[code], rows)
+            stats = summarize_features(rows)
+            stats.update({
+                'n_samples': int(counts[code]),
+                'feature_mean': scalers[code].mean_.tolist(),
+                'feature_std': np.sqrt(scalers[code].var_).tolist(),
+                'feature_min': minimum[code].tolist(),
+                'feature_max': maximum[code].tolist(),
+                'training_seconds': time.time() - fit_started,
+                'shared_pass_seconds': shared_seconds,
+                'peak_rss_mb': peak_rss_mb(),
+                'sample_rows': int(len(rows)),
+                'segment_by': segment_by,
+                'segment': strata[code]
+            })
+            registry = ModelRegistry(segment_registry_root(self.registry.root, segment_by, strata[code]))
+            versions[strata[code]] = registry.publish(model, scalers[code], FEATURE_NAMES, training_stats=stats,
+                                                      source='offline_bulk_segment', promote=promote)
+            registry.prune()
+
+        skipped = [value for value, ok in zip(strata, eligible) if not ok]
+        if skipped:
+            logger.info(f"{segment_by} values below {min_rows} rows use the global model: {skipped}")
+        return versions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Train a model version on historical security events')
+    parser.add_argument('--start', help='Range start, inclusive (ISO-8601); required unless --from-export')
+    parser.add_argument('--end', help='Range end, exclusive (ISO-8601); required unless --from-export')
+    parser.add_argument('--files', nargs='+', help='Export from NDJSON(.gz) dumps instead of Elasticsearch')
+    parser.add_argument('--from-export', help='Train on an existing export directory, skipping the export')
+    parser.add_argument('--export-dir', help='Where to write the export (default: <model-dir>/exports/<timestamp>)')
+    parser.add_argument('--stratify-by', default='event_type', help='Event field to stratify on (default: event_type)')
+    parser.add_argument('--segment-by',
+                        help='Also train one model per value of this field (stratifies on it instead of --stratify-by)')
+    parser.add_argument('--min-segment-rows', type=int, default=10000,
+                        help='Rows a segment needs for its own model (default: 10000)')
+    parser.add_argument('--sample-size', type=int, default=1000000,
+                        help='Rows in the stratified training subsample (default: 1000000)')
+    parser.add_argument('--min-per-stratum', type=int, default=1000,
+                        help='Minimum subsample rows per stratum (default: 1000)')
+    parser.add_argument('--n-estimators', type=int, default=100, help='Trees in the forest (default: 100)')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='Parallel jobs for the forest fit (default: all cores)')
+    parser.add_argument('--no-promote', action='store_true', help='Publish without making the version current')
+    parser.add_argument('--model-dir', default='/models', help='Model and state directory (default: /models)')
+    parser.add_argument('--es-host', default=os.environ.get('ES_HOST', 'elasticsearch'),
+                        help='Elasticsearch host (default: $ES_HOST or elasticsearch)')
+    parser.add_argument('--es-port', type=int, default=int(os.environ.get('ES_PORT', 9200)),
+                        help='Elasticsearch port (default: $ES_PORT or 9200)')
+
+    args = parser.parse_args()
+    stratify_by = args.segment_by or args.stratify_by
+    if args.from_export:
+        export = FeatureExport.open(args.from_export)
+        if args.segment_by and export.manifest['stratify_by'] != args.segment_by:
+            parser.error(f"--segment-by {args.segment_by} needs an export stratified on it, "
+                         f"not {export.manifest['stratify_by']}")
+    else:
+        if not (args.start and args.end):
+            parser.error('--start and --end are required unless --from-export is given')
+        export_dir = args.export_dir or os.path.join(args.model_dir, 'exports',
+                                                     datetime.utcnow().strftime('%Y%m%dT%H%M%S'))
+        started = time.time()
+        if args.files:
+            export = export_from_files(args.files, export_dir, args.start, args.end, stratify_by)
+        else:
+            from elasticsearch import Elasticsearch
+
+            es = Elasticsearch([f'http://{args.es_host}:{args.es_port}'])
+            export = export_from_es(es, export_dir, args.start, args.end, stratify_by=stratify_by)
+        logger.info(f"Export took {time.time() - started:.1f}s")
+
+    trainer = OfflineTrainer(
+        ModelRegistry(os.path.join(args.model_dir, 'registry')),
+        sample_size=args.sample_size,
+        min_per_stratum=args.min_per_stratum,
+        n_jobs=args.n_jobs,
+        model_params={'contamination': 0.1, 'random_state': 42, 'n_estimators': args.n_estimators}
+    )
+    version, stats = trainer.train(export, promote=not args.no_promote)
+    report = {'version': version, **stats}
+    if args.segment_by:
+        report['segment_versions'] = trainer.train_segments(export, args.min_segment_rows, promote=not args.no_promote)
+    print(json.dumps(report, indent=2))
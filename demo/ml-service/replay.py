@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Historical Replay / Backfill
+Re-scores a time range of security events with one pinned model version,
+reading Elasticsearch through sliced scroll or NDJSON(.gz) dumps across a
+process pool, and bulk-writes the results to a target index with
+resumable progress
+"""
+
+import os
+import json
+import gzip
+import time
+import queue
+import logging
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from model_registry import ModelRegistry
+from threat_detector import ThreatDetector
+from ueba_batch import event_time
+
+logger = logging.getLogger(__name__)
+
+# Per-process state of a pool worker, set once by init_worker
+WORKER = {}
+
+
+def open_dump(path):
+    """Line iterator over an .ndjson or .ndjson.gz dump"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def dump_record(record, path, line_number):
+    """(doc_id, event) from a dump line: an ES hit with _id/_source, or a bare event"""
+    if '_source' in record:
+        return record.get('_id') or f'{os.path.basename(path)}:{line_number}', record['_source']
+    return f'{os.path.basename(path)}:{line_number}', record
+
+
+def peak_rss_mb():
+    """This process's peak RSS; VmHWM resets on exec, unlike ru_maxrss, so it excludes the parent's"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def range_query(start, end, cursor=None):
+    """@timestamp in [start, end), resuming at an epoch-millis cursor (inclusive)"""
+    query = {"range": {"@timestamp": {"gte": start, "lt": end}}}
+    if cursor is None:
+        return query
+    return {"bool": {"filter": [query, {"range": {"@timestamp": {"gte": cursor, "format": "epoch_millis"}}}]}}
+
+
+class ReplayScorer:
+    """Scores pages with one registry version, independent of any live detector state"""
+
+    def __init__(self, model, target_index, anomalies_only=False):
+        self.model = model
+        self.target_index = target_index
+        self.anomalies_only = anomalies_only
+
+    def documents(self, doc_ids, events, source):
+        """[(target_index, result, doc_id)] for a page, and its anomaly count"""
+        features = ThreatDetector.extract_features_batch(events)
+        anomaly_scores = -self.model.compiled.score_samples(self.model.scaler.transform(features))
+        is_anomaly = anomaly_scores > -self.model.compiled.offset_
+        confidence = np.minimum(anomaly_scores * 10, 100)
+        replayed_at = datetime.utcnow().isoformat()
+
+        documents = []
+        for doc_id, event, flag, score, conf in zip(doc_ids, events, is_anomaly, anomaly_scores, confidence):
+            if self.anomalies_only and not flag:
+                continue
+            documents.append((self.target_index, {
+                '@timestamp': event.get('@timestamp'),
+                'event_id': doc_id,
+                'source': source,
+                'username': event.get('username'),
+                'source_ip': event.get('source_ip'),
+                'event_type': event.get('event_type'),
+                'detection': {'is_anomaly': bool(flag), 'anomaly_score': float(score), 'confidence': float(conf)},
+                'severity': ThreatDetector.calculate_severity(float(score)),
+                'model_version': self.model.version,
+                'replayed_at': replayed_at
+            }, f'{doc_id}@{self.model.version}'))
+        return documents, int(is_anomaly.sum())
+
+
+def init_worker(options, progress):
+    """Pool initializer: one ES client, bulk writer and pinned model per process"""
+    from elasticsearch import Elasticsearch
+
+    from alert_writer import BulkAlertWriter
+
+    es_factory = options.get('es_factory')
+    es = es_factory() if es_factory else Elasticsearch([options['es_url']])
+    model = ModelRegistry(os.path.join(options['model_dir'], 'registry')).load(options['model_version'])
+
+    WORKER['options'] = options
+    WORKER['progress'] = progress
+    WORKER['es'] = es
+    WORKER['writer'] = BulkAlertWriter(es, max_docs=options['bulk_size'])
+    WORKER['scorer'] = ReplayScorer(model, options['target_index'], options['anomalies_only'])
+
+
+def write_page(unit, doc_ids, events, cursor, source):
+    """Score and index one page, then report the cursor it is safe to resume from"""
+    documents, anomalies = WORKER['scorer'].documents(doc_ids, events, source)
+    writer = WORKER['writer']
+    # add() flushes on its own when the buffer fills, so count failures across the whole page
+    failed_before = writer.stats['failed']
+    for index, document, doc_id in documents:
+        writer.add(index, document, doc_id)
+    writer.flush()
+
+    failed = writer.stats['failed'] - failed_before
+    if failed:
+        raise RuntimeError(f"{failed} documents failed to index; {unit} will resume from its last cursor")
+    WORKER['progress'].put((unit, cursor, len(events), anomalies))
+
+
+def replay_slice(unit, slice_id, slice_max, cursor):
+    """Scroll one slice of the source index in @timestamp order"""
+    options, es = WORKER['options'], WORKER['es']
+    body = {
+        "query": range_query(options['start'], options['end'], cursor),
+        "sort": [{"@timestamp": "asc"}],
+        "size": options['page_size']
+    }
+    if slice_max > 1:
+        body["slice"] = {"id": slice_id, "max": slice_max}
+
+    response = es.search(index=options['source_index'], scroll=options['scroll_keep_alive'], body=body)
+    scroll_id = response.get('_scroll_id')
+    try:
+        while response['hits']['hits']:
+            hits = response['hits']['hits']
+            # The page's last timestamp is a safe inclusive restart point: re-read
+            # documents overwrite their own results instead of duplicating them
+            write_page(unit, [hit['_id'] for hit in hits], [hit['_source'] for hit in hits],
+                       hits[-1]['sort'][0], options['source_index'])
+            response = es.scroll(scroll_id=scroll_id, scroll=options['scroll_keep_alive'])
+            scroll_id = response.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id:
+            try:
+                es.clear_scroll(scroll_id=scroll_id)
+            except Exception as e:
+                logger.warning(f"Failed to clear scroll for {unit}: {str(e)}")
+    return peak_rss_mb()
+
+
+def replay_file(unit, path, cursor):
+    """Stream one dump file; the cursor is the number of lines already handled"""
+    options = WORKER['options']
+    start, end = event_time({'@timestamp': options['start']}), event_time({'@timestamp': options['end']})
+    cursor = cursor or 0
+
+    doc_ids, events = [], []
+    line_number = cursor
+    with open_dump(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if line_number <= cursor or not line.strip():
+                continue
+            doc_id, event = dump_record(json.loads(line), path, line_number)
+            if not start <= event_time(event) < end:
+                continue
+
+            doc_ids.append(doc_id)
+            events.append(event)
+            if len(events) >= options['page_size']:
+                write_page(unit, doc_ids, events, line_number, path)
+                doc_ids, events = [], []
+
+    if events:
+        write_page(unit, doc_ids, events, line_number, path)
+    return peak_rss_mb()
+
+
+class ReplayJob:
+    """Runs one backfill across a process pool and keeps its progress file
+
+    Work is split into units (scroll slices or dump files). Each unit
+    reports a resume cursor after every page it has fully indexed; the
+    parent alone writes the progress file, so a rerun after a crash or
+    Ctrl-C continues every unit from its last cursor. Result ids are
+    derived from the event id and model version, so pages replayed twice
+    overwrite rather than duplicate. Memory is bounded by page_size per
+    worker regardless of how long the range is.
+    """
+
+    def __init__(self, start, end, target_index, model_dir='/models', source_index='security-events', files=None,
+                 workers=None, slices=None, page_size=1000, bulk_size=500, scroll_keep_alive='5m',
+                 anomalies_only=False, model_version=None, progress_path=None, es_host='elasticsearch',
+                 es_port=9200, es_factory=None, report_interval=10.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.files = [os.path.abspath(path) for path in files or []]
+        self.slices = slices or self.workers
+        self.model_dir = model_dir
+        self.report_interval = report_interval
+        self.progress_path = progress_path or os.path.join(model_dir, 'state', f'replay-{target_index}.json')
+
+        model_version = model_version or ModelRegistry(os.path.join(model_dir, 'registry')).current_version()
+        if model_version is None:
+            raise LookupError(f"No model version to replay with in {model_dir}")
+
+        self.options = {
+            'start': start,
+            'end': end,
+            'source_index': source_index,
+            'target_index': target_index,
+            'model_dir': model_dir,
+            'model_version': model_version,
+            'page_size': page_size,
+            'bulk_size': bulk_size,
+            'scroll_keep_alive': scroll_keep_alive,
+            'anomalies_only': anomalies_only,
+            'es_url': f'http://{es_host}:{es_port}',
+            'es_factory': es_factory
+        }
+        self.units = {}
+        self.progress_time = 0.0
+
+    def identity(self):
+        """Parameters a progress file must match to be resumed"""
+        keys = ['start', 'end', 'source_index', 'target_index', 'model_version', 'anomalies_only']
+        identity = {key: self.options[key] for key in keys}
+        identity['files'] = self.files
+        identity['slices'] = None if self.files else self.slices
+        return identity
+
+    def unit_specs(self):
+        """unit key -> (function, args before the cursor); each returns its worker's peak RSS"""
+        if self.files:
+            return {f'file:{path}': (replay_file, (path,)) for path in self.files}
+        return {f'slice-{i}-of-{self.slices}': (replay_slice, (i, self.slices)) for i in range(self.slices)}
+
+    def load_progress(self, restart=False):
+        """Adopt a matching progress file; a different job refuses to overwrite it"""
+        fresh = {key: {'cursor': None, 'events': 0, 'anomalies': 0, 'done': False} for key in self.unit_specs()}
+        if restart or not os.path.exists(self.progress_path):
+            self.units = fresh
+            return
+
+        with open(self.progress_path) as f:
+            progress = json.load(f)
+        if progress.get('job') != self.identity():
+            raise ValueError(f"{self.progress_path} belongs to a different replay ({progress.get('job')}); "
+                             f"pass --restart or another --progress path")
+        self.units = progress['units']
+        done = sum(1 for unit in self.units.values() if unit['done'])
+        logger.info(f"Resuming replay from {self.progress_path}: {done}/{len(self.units)} units done")
+
+    def save_progress(self, force=False):
+        """Write-then-rename, at most once per second unless forced"""
+        if not force and time.monotonic() - self.progress_time < 1.0:
+            return
+        self.progress_time = time.monotonic()
+
+        progress = {'job': self.identity(), 'units': self.units, 'updated_at': datetime.utcnow().isoformat()}
+        os.makedirs(os.path.dirname(self.progress_path) or '.', exist_ok=True)
+        tmp_path = f"{self.progress_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(progress, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.progress_path)
+
+    def record(self, message, totals):
+        unit, cursor, events, anomalies = message
+        state = self.units[unit]
+        state['cursor'] = cursor
+        state['events'] += events
+        state['anomalies'] += anomalies
+        totals['events'] += events
+        totals['anomalies'] += anomalies
+        self.save_progress()
+
+    def report(self, totals, started, final=False):
+        seconds = time.monotonic() - started
+        done = sum(1 for unit in self.units.values() if unit['done'])
+        logger.info(
+            f"Replay {'finished' if final else 'progress'}: {totals['events']:,} events in {seconds:.1f}s "
+            f"({totals['events'] / max(seconds, 1e-9):,.0f} ev/s), {totals['anomalies']:,} anomalies, "
+            f"{done}/{len(self.units)} units done"
+        )
+
+    def run(self, restart=False):
+        """Replay every unfinished unit; returns the throughput report"""
+        self.load_progress(restart)
+        specs = self.unit_specs()
+        pending = [key for key, state in self.units.items() if not state['done']]
+        logger.info(f"Replaying {self.options['start']} .. {self.options['end']} into {self.options['target_index']} "
+                    f"with model {self.options['model_version']}: {len(pending)} units on {self.workers} workers")
+
+        context = multiprocessing.get_context('spawn')
+        progress = context.Queue()
+        totals = {'events': 0, 'anomalies': 0, 'failed_units': 0, 'worker_peak_rss_mb': 0.0}
+        started = last_report = time.monotonic()
+
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=init_worker,
+                                 initargs=(self.options, progress)) as pool:
+            futures = {}
+            for key in pending:
+                function, args = specs[key]
+                futures[pool.submit(function, key, *args, self.units[key]['cursor'])] = key
+
+            try:
+                while futures:
+                    try:
+                        self.record(progress.get(timeout=0.2), totals)
+                    except queue.Empty:
+                        pass
+
+                    finished, _ = wait(futures, timeout=0, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        key = futures.pop(future)
+                        try:
+                            totals['worker_peak_rss_mb'] = max(totals['worker_peak_rss_mb'], future.result())
+                        except Exception as e:
+                            totals['failed_units'] += 1
+                            logger.error(f"Replay unit {key} failed, rerun to resume it: {str(e)}")
+                            continue
+                        # Its last page may still be queued; it is drained before marking done
+                        while True:
+                            try:
+                                self.record(progress.get_nowait(), totals)
+                            except queue.Empty:
+                                break
+                        self.units[key]['done'] = True
+                        self.save_progress(force=True)
+
+                    if time.monotonic() - last_report >= self.report_interval:
+                        self.report(totals, started)
+                        last_report = time.monotonic()
+            except KeyboardInterrupt:
+                logger.info("Replay interrupted; progress saved, rerun the same command to resume")
+                for future in futures:
+                    future.cancel()
+                raise
+            finally:
+                self.save_progress(force=True)
+
+        while True:
+            try:
+                self.record(progress.get_nowait(), totals)
+            except queue.Empty:
+                break
+        self.save_progress(force=True)
+
+        seconds = time.monotonic() - started
+        self.report(totals, started, final=True)
+        return {
+            'events': totals['events'],
+            'anomalies': totals['anomalies'],
+            'failed_units': totals['failed_units'],
+            'seconds': seconds,
+            'events_per_second': totals['events'] / max(seconds, 1e-9),
+            'units': len(self.units),
+            'worker_peak_rss_mb': totals['worker_peak_rss_mb'],
+            'model_version': self.options['model_version']
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Re-score historical security events with the current model')
+    parser.add_argument('--start', required=True, help='Range start, inclusive (ISO-8601)')
+    parser.add_argument('--end', required=True, help='Range end, exclusive (ISO-8601)')
+    parser.add_argument('--target-index', required=True, help='Index receiving one result document per event')
+    parser.add_argument('--files', nargs='+', help='Read NDJSON(.gz) dumps instead of Elasticsearch')
+    parser.add_argument('--source-index', default='security-events', help='Index to scroll (default: security-events)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Scoring processes (default: CPU count)')
+    parser.add_argument('--slices', type=int, help='Sliced-scroll slices (default: --workers)')
+    parser.add_argument('--page-size', type=int, default=1000, help='Events per scroll page (default: 1000)')
+    parser.add_argument('--model-version', help='Registry version to score with (default: current)')
+    parser.add_argument('--anomalies-only', action='store_true', help='Only write results flagged as anomalous')
+    parser.add_argument('--progress', help='Progress file (default: <model-dir>/state/replay-<target-index>.json)')
+    parser.add_argument('--restart', action='store_true', help='Ignore existing progress and start over')
+    parser.add_argument('--model-dir', default='/models', help='Model and state directory (default: /models)')
+    parser.add_argument('--es-host', default=os.environ.get('ES_HOST', 'elasticsearch'),
+                        help='Elasticsearch host (default: $ES_HOST or elasticsearch)')
+    parser.add_argument('--es-port', type=int, default=int(os.environ.get('ES_PORT', 9200)),
+                        help='Elasticsearch port (default: $ES_PORT or 9200)')
+
+    args = parser.parse_args()
+    job = ReplayJob(
+        args.start, args.end, args.target_index,
+        model_dir=args.model_dir,
+        source_index=args.source_index,
+        files=args.files,
+        workers=args.workers,
+        slices=args.slices,
+        page_size=args.page_size,
+        anomalies_only=args.anomalies_only,
+        model_version=args.model_version,
+        progress_path=args.progress,
+        es_host=args.es_host,
+        es_port=args.es_port
+    )
+    report = job.run(restart=args.restart)
+    print(json.dumps(report, indent=2))
+    raise SystemExit(1 if report['failed_units'] else 0)
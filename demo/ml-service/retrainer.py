@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Background Model Retraining
+Keeps a fixed-size, recency-biased reservoir of feature vectors and
+trains a fresh Isolation Forest in a separate process when live features
+drift from the active model's (or, without drift data, on a schedule),
+publishing the result through the model registry
+"""
+
+import os
+import time
+import logging
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ReservoirSample:
+    """Fixed-capacity sample of recent feature vectors
+
+    Rows are appended until the buffer is full; after that every new row
+    overwrites a uniformly random slot. A row therefore survives about
+    `capacity` later arrivals on average, so the sample tracks recent
+    traffic in O(capacity) memory regardless of volume.
+    """
+
+    def __init__(self, capacity, n_features, seed=None):
+        self.capacity = capacity
+        self.buffer = np.empty((capacity, n_features), dtype=np.float64)
+        self.size = 0
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+
+    def add_batch(self, rows):
+        """Insert a (n, n_features) batch"""
+        rows = np.asarray(rows, dtype=np.float64)
+        self.seen += rows.shape[0]
+
+        free = min(self.capacity - self.size, rows.shape[0])
+        if free > 0:
+            self.buffer[self.size:self.size + free] = rows[:free]
+            self.size += free
+            rows = rows[free:]
+
+        if rows.shape[0]:
+            slots = self.rng.integers(0, self.capacity, size=rows.shape[0])
+            self.buffer[slots] = rows
+
+    def snapshot(self):
+        """Copy of the current sample"""
+        return self.buffer[:self.size].copy()
+
+
+def train_and_publish(registry_root, data_path, feature_names, model_params, max_cpu_seconds, nice_level):
+    """Child-process entry point: fit scaler + forest on a snapshot and publish it"""
+    # Lazy imports keep the parent's import graph out of the spawn payload
+    import resource
+    from sklearn.ensemble import IsolationForest
+    from sklearn.preprocessing import StandardScaler
+    from model_registry import ModelRegistry, summarize_features
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # CPU share: lowest scheduling priority plus a hard CPU-time ceiling
+    os.nice(nice_level)
+    resource.setrlimit(resource.RLIMIT_CPU, (max_cpu_seconds, max_cpu_seconds + 5))
+
+    data = np.load(data_path)
+    started = time.time()
+
+    scaler = StandardScaler()
+    model = IsolationForest(**model_params)
+    model.fit(scaler.fit_transform(data))
+
+    stats = summarize_features(data)
+    stats['training_seconds'] = time.time() - started
+
+    registry = ModelRegistry(registry_root)
+    registry.publish(model, scaler, feature_names, training_stats=stats, source='reservoir_retrain')
+    registry.prune()
+
+
+class BackgroundRetrainer:
+    def __init__(self, registry, feature_names, reservoir_size=50000, min_interval=3600, min_samples=5000,
+                 max_cpu_seconds=300, nice_level=10, model_params=None, drift_monitor=None):
+        self.registry = registry
+        # With a drift monitor, min_interval is only a cooldown between drift-triggered retrains
+        self.drift_monitor = drift_monitor
+        self.feature_names = list(feature_names)
+        self.reservoir = ReservoirSample(reservoir_size, len(self.feature_names))
+        self.min_interval = min_interval
+        self.min_samples = min_samples
+        self.max_cpu_seconds = max_cpu_seconds
+        self.nice_level = nice_level
+        self.model_params = model_params or {
+            'contamination': 0.1,
+            'random_state': 42,
+            'n_estimators': 100,
+            # Single-threaded fit so a retrain never takes more than one core
+            'n_jobs': 1
+        }
+
+        # spawn: the scoring process runs background threads that must not be forked
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None
+        self.data_path = None
+        self.last_started = time.monotonic()
+        self.stats = {'drift_retrains': 0, 'scheduled_retrains': 0, 'skipped_no_drift': 0}
+
+    def observe(self, features):
+        """Feed raw (unscaled) feature rows from the scoring loop"""
+        if len(features):
+            self.reservoir.add_batch(features)
+
+    def maybe_retrain(self):
+        """Reap a finished retrain or start a new one when due; never blocks"""
+        if self.process is not None:
+            if self.process.is_alive():
+                return False
+            self.reap()
+
+        if time.monotonic() - self.last_started < self.min_interval:
+            return False
+        if self.reservoir.size < self.min_samples:
+            return False
+
+        monitor = self.drift_monitor
+        # Scores against a model that has since been replaced say nothing about the new one
+        if monitor is not None and monitor.reference_version != self.registry.current_version():
+            return False
+        # None: the active model recorded no training sketches, so fall back to the schedule
+        drifted = monitor.drifted() if monitor is not None else None
+        if drifted is False:
+            self.stats['skipped_no_drift'] += 1
+            return False
+        if drifted:
+            reason = (f"drift {monitor.max_drift():.3f} on {monitor.most_drifted()} "
+                      f"(threshold {monitor.threshold})")
+            self.stats['drift_retrains'] += 1
+        else:
+            reason = 'scheduled'
+            self.stats['scheduled_retrains'] += 1
+
+        fd, self.data_path = tempfile.mkstemp(prefix='reservoir-', suffix='.npy', dir=self.registry.root)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, self.reservoir.snapshot())
+
+        self.process = self.context.Process(
+            target=train_and_publish,
+            args=(self.registry.root, self.data_path, self.feature_names, self.model_params,
+                  self.max_cpu_seconds, self.nice_level),
+            name='model-retrain',
+            daemon=True
+        )
+        self.process.start()
+        self.last_started = time.monotonic()
+        logger.info(f"Started background retrain on {self.reservoir.size} samples (seen {self.reservoir.seen}): {reason}")
+        return True
+
+    def reap(self):
+        """Collect the exit status of the last retrain and clean up its snapshot"""
+        if self.process.exitcode == 0:
+            logger.info("Background retrain finished and published a new model version")
+        else:
+            logger.error(f"Background retrain failed with exit code {self.process.exitcode}")
+
+        self.process = None
+        if self.data_path and os.path.exists(self.data_path):
+            os.remove(self.data_path)
+        self.data_path = None
+
+    def stop(self):
+        """Terminate an in-flight retrain on shutdown"""
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=5)
+        if self.process is not None:
+            self.reap()
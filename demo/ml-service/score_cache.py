@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Score Memoization Cache
+LRU cache of anomaly scores keyed on (optionally quantized) feature
+vectors, so repeated near-identical events skip the forest traversal
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def parse_quantization(pairs):
+    """{'feature': step} from ['feature=step', ...] command-line pairs"""
+    quantization = {}
+    for pair in pairs or []:
+        name, _, step = pair.partition('=')
+        quantization[name] = float(step)
+    return quantization
+
+
+class ScoreCache:
+    """Anomaly scores for feature vectors, per model slot and version
+
+    Features with a quantization step are rounded to the nearest multiple
+    of it, and every event in a bucket is scored as that grid point, so the
+    result does not depend on which event filled the cache first. Features
+    without a step must match exactly. Each slot (the global model, or one
+    segment's model) holds entries for a single version; a slot's entries
+    are dropped when a different version asks for scores through it.
+    """
+
+    def __init__(self, feature_names, capacity=100000, quantization=None):
+        self.capacity = capacity
+        quantization = quantization or {}
+        unknown = set(quantization) - set(feature_names)
+        if unknown:
+            raise ValueError(f"Quantization given for unknown features: {sorted(unknown)}")
+        self.steps = np.array([quantization.get(name, 0.0) for name in feature_names], dtype=np.float64)
+        self.quantized = self.steps > 0
+
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def grid_points(self, features):
+        """Representative point of each row's bucket"""
+        points = np.array(features, dtype=np.float64)
+        if self.quantized.any():
+            steps = self.steps[self.quantized]
+            points[:, self.quantized] = np.round(points[:, self.quantized] / steps) * steps
+        # Adding 0.0 folds -0.0 into 0.0 so both produce the same key bytes
+        return points + 0.0
+
+    def invalidate(self, slot, version):
+        """Drop a slot's entries for a new model version; caller holds the lock"""
+        stale = [key for key in self.entries if key[0] == slot]
+        if stale:
+            self.stats['invalidations'] += 1
+            logger.info(f"Score cache cleared {len(stale)} entries for model version {version}")
+        for key in stale:
+            del self.entries[key]
+        self.versions[slot] = version
+
+    def scores(self, features, version, score_rows, slot=None):
+        """Anomaly scores for a (n, n_features) matrix
+
+        score_rows(points) computes scores for the rows that miss, in one
+        vectorized call. Rows repeated within the batch are looked up once.
+        """
+        return self.slot_scores(features, np.zeros(len(features), dtype=np.intp), [slot], [version],
+                                lambda points, slot_codes: score_rows(points))
+
+    def slot_scores(self, features, slot_codes, slots, versions, score_rows):
+        """scores() with each row in its own slot: slots[slot_codes[row]] at versions[slot_codes[row]]
+
+        score_rows(points, slot_codes) scores every miss, across slots, in
+        one call.
+        """
+        points = self.grid_points(features)
+        if len(points) == 0:
+            return np.empty(0, dtype=np.float64)
+
+        # The slot code rides along as an extra column so equal rows in different slots stay apart
+        slot_codes = np.asarray(slot_codes, dtype=np.intp)
+        keyed = np.column_stack([points, slot_codes.astype(np.float64)])
+        rows = np.ascontiguousarray(keyed).view(np.dtype((np.void, keyed.dtype.itemsize * keyed.shape[1])))
+        unique_rows, first_index, inverse = np.unique(rows.ravel(), return_index=True, return_inverse=True)
+        unique_codes = slot_codes[first_index]
+        keys = [(slots[code], points[i].tobytes()) for code, i in zip(unique_codes, first_index)]
+        unique_scores = np.empty(len(keys), dtype=np.float64)
+        event_counts = np.bincount(inverse.ravel(), minlength=len(keys))
+
+        missing = []
+        with self.lock:
+            for slot, version in zip(slots, versions):
+                if self.versions.get(slot) != version:
+                    self.invalidate(slot, version)
+
+            for i, key in enumerate(keys):
+                score = self.entries.get(key)
+                if score is None:
+                    missing.append(i)
+                else:
+                    self.entries.move_to_end(key)
+                    unique_scores[i] = score
+
+        if missing:
+            missing = np.array(missing, dtype=np.intp)
+            unique_scores[missing] = score_rows(points[first_index[missing]], unique_codes[missing])
+
+        with self.lock:
+            missed_events = int(event_counts[missing].sum()) if len(missing) else 0
+            self.stats['misses'] += missed_events
+            self.stats['hits'] += len(points) - missed_events
+
+            # A swap may have happened while scoring; never store old-version scores
+            current = [self.versions.get(slot) == version for slot, version in zip(slots, versions)]
+            for i in missing:
+                if current[unique_codes[i]]:
+                    self.entries[keys[i]] = float(unique_scores[i])
+            overflow = len(self.entries) - self.capacity
+            for _ in range(max(0, overflow)):
+                self.entries.popitem(last=False)
+            self.stats['evictions'] += max(0, overflow)
+
+        return unique_scores[inverse.ravel()]
+
+    def hit_rate(self):
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
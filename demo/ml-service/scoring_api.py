@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Micro-Batching Scoring API
+Local HTTP endpoint for synchronous single-event scoring; concurrent
+requests are collected into micro-batches and scored with one vectorized
+call against the detector's active model
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+QUEUE_DEPTH_BUCKETS = [0, 1, 4, 16, 64, 256, 1024, 4096]
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25]
+
+
+class Histogram:
+    """Cumulative-bucket histogram rendered in the Prometheus text format"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = list(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {count}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.total}')
+        lines.append(f'{self.name}_sum {self.sum}')
+        lines.append(f'{self.name}_count {self.total}')
+        return '\n'.join(lines)
+
+
+class MicroBatcher:
+    """Coalesces concurrent submit() calls into batches of up to max_batch_size
+
+    A batch is dispatched when it is full or when its oldest request has
+    waited max_delay seconds. Scoring runs on one worker thread, so the
+    next batch fills while the previous one is being scored.
+    """
+
+    def __init__(self, score_batch, max_batch_size=256, max_delay=0.002, max_queue=10000):
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+
+        self.queue = None
+        self.task = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='score-batch')
+        self.batch_sizes = Histogram('ml_scoring_batch_size', 'Events per scored micro-batch', BATCH_SIZE_BUCKETS)
+        self.queue_depths = Histogram(
+            'ml_scoring_queue_depth', 'Requests still queued when a micro-batch is dispatched', QUEUE_DEPTH_BUCKETS
+        )
+        self.latencies = Histogram('ml_scoring_request_seconds', 'Request latency including batching delay',
+                                   LATENCY_BUCKETS)
+        self.rejected = 0
+
+    def start(self):
+        """Create the queue and dispatcher on the running loop"""
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.task = asyncio.get_running_loop().create_task(self.dispatch())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, event):
+        """Score one event as part of the next micro-batch; raises asyncio.QueueFull when saturated"""
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((event, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+        result = await future
+        self.latencies.observe(time.perf_counter() - started)
+        return result
+
+    async def dispatch(self):
+        """Collect and score batches until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Drain whatever is already waiting without delaying the batch further
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            self.batch_sizes.observe(len(batch))
+            self.queue_depths.observe(self.queue.qsize())
+
+            events = [event for event, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.score_batch, events)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class ScoringServer:
+    """aiohttp server for a ThreatDetector, run on its own thread and event loop"""
+
+    def __init__(self, detector, host='0.0.0.0', port=8000, max_batch_size=256, max_delay=0.002, max_queue=10000):
+        self.detector = detector
+        self.host = host
+        self.port = port
+        self.batcher = MicroBatcher(self.score_events, max_batch_size, max_delay, max_queue)
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+
+    def score_events(self, events):
+        """One vectorized pass over a micro-batch"""
+        active = self.detector.active_model
+        results = self.detector.detect_anomalies(events)
+        for result in results:
+            result['severity'] = self.detector.calculate_severity(result['anomaly_score'])
+            result.setdefault('model_version', active.version)
+        return results
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post('/score', self.handle_score)
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.router.add_get('/health', self.handle_health)
+        app.router.add_get('/ready', self.handle_ready)
+        return app
+
+    async def handle_score(self, request):
+        """POST one event (JSON object), or a JSON list of events"""
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.json_response({'error': 'body must be JSON'}, status=400)
+
+        events = payload if isinstance(payload, list) else [payload]
+        if not all(isinstance(event, dict) for event in events):
+            return web.json_response({'error': 'events must be JSON objects'}, status=400)
+
+        if self.detector.active_model is None:
+            return web.json_response({'error': 'model still loading'}, status=503)
+
+        # Reject bad input here so it cannot fail the micro-batch it would share
+        feature_names = self.detector.active_model.manifest['feature_names']
+        for event in events:
+            invalid = [name for name in feature_names if not isinstance(event.get(name, 0), (int, float))]
+            if invalid:
+                return web.json_response({'error': f'non-numeric features: {invalid}'}, status=400)
+
+        try:
+            results = await asyncio.gather(*(self.batcher.submit(event) for event in events))
+        except asyncio.QueueFull:
+            return web.json_response({'error': 'scoring queue full'}, status=503)
+        except Exception as e:
+            logger.error(f"Scoring request failed: {str(e)}")
+            return web.json_response({'error': str(e)}, status=500)
+
+        return web.json_response(results if isinstance(payload, list) else results[0])
+
+    async def handle_metrics(self, request):
+        """Prometheus text exposition"""
+        batcher = self.batcher
+        lines = [
+            batcher.batch_sizes.render(),
+            batcher.queue_depths.render(),
+            batcher.latencies.render(),
+            '# HELP ml_scoring_queue_current Requests waiting for a micro-batch',
+            '# TYPE ml_scoring_queue_current gauge',
+            f'ml_scoring_queue_current {batcher.queue.qsize()}',
+            '# HELP ml_scoring_rejected_total Requests refused because the queue was full',
+            '# TYPE ml_scoring_rejected_total counter',
+            f'ml_scoring_rejected_total {batcher.rejected}'
+        ]
+        cache = self.detector.score_cache
+        if cache is not None:
+            for name, help_text in [('hits', 'Events scored from the score cache'),
+                                    ('misses', 'Events that needed a forest traversal'),
+                                    ('evictions', 'Score cache entries evicted by LRU'),
+                                    ('invalidations', 'Score cache clears on model version change')]:
+                lines += [f'# HELP ml_score_cache_{name}_total {help_text}',
+                          f'# TYPE ml_score_cache_{name}_total counter',
+                          f'ml_score_cache_{name}_total {cache.stats[name]}']
+            lines += ['# HELP ml_score_cache_entries Feature vectors currently cached',
+                      '# TYPE ml_score_cache_entries gauge',
+                      f'ml_score_cache_entries {len(cache.entries)}']
+        segments = self.detector.segment_models
+        if segments is not None:
+            for name, help_text in [('loads', 'Segment models loaded into the LRU'),
+                                    ('evictions', 'Segment models evicted from the LRU'),
+                                    ('load_failures', 'Segment models that failed to load')]:
+                lines += [f'# HELP ml_segment_model_{name}_total {help_text}',
+                          f'# TYPE ml_segment_model_{name}_total counter',
+                          f'ml_segment_model_{name}_total {segments.stats[name]}']
+            lines += ['# HELP ml_segment_models_loaded Segment models currently loaded',
+                      '# TYPE ml_segment_models_loaded gauge',
+                      f'ml_segment_models_loaded {len(segments.models)}',
+                      '# HELP ml_segment_models_available Segments with a promoted model version',
+                      '# TYPE ml_segment_models_available gauge',
+                      f'ml_segment_models_available {len(segments.available)}']
+        drift = self.detector.drift_monitor
+        lines += ['# HELP ml_feature_drift KS distance between live and training-time feature distributions',
+                  '# TYPE ml_feature_drift gauge']
+        lines += [f'ml_feature_drift{{feature="{name}"}} {score}' for name, score in drift.scores.items()]
+        lines += ['# HELP ml_feature_drift_threshold Drift that triggers a retrain',
+                  '# TYPE ml_feature_drift_threshold gauge',
+                  f'ml_feature_drift_threshold {drift.threshold}',
+                  '# HELP ml_drift_window_events Events in the current drift window',
+                  '# TYPE ml_drift_window_events gauge',
+                  f'ml_drift_window_events {drift.window_events}',
+                  '# HELP ml_drift_windows_total Completed drift windows',
+                  '# TYPE ml_drift_windows_total counter',
+                  f'ml_drift_windows_total {drift.stats["windows"]}',
+                  '# HELP ml_drift_windows_drifted_total Completed drift windows above the threshold',
+                  '# TYPE ml_drift_windows_drifted_total counter',
+                  f'ml_drift_windows_drifted_total {drift.stats["drifted_windows"]}',
+                  '# HELP ml_drift_sketch_bytes Memory held by live and reference feature sketches',
+                  '# TYPE ml_drift_sketch_bytes gauge',
+                  f'ml_drift_sketch_bytes {drift.nbytes()}']
+        # The API starts before the detector has built its retrainer
+        retrainer = getattr(self.detector, 'retrainer', None)
+        if retrainer is not None:
+            for name, help_text in [('drift_retrains', 'Retrains started because features drifted'),
+                                    ('scheduled_retrains', 'Retrains started on the schedule (model without sketches)')]:
+                lines += [f'# HELP ml_{name}_total {help_text}',
+                          f'# TYPE ml_{name}_total counter',
+                          f'ml_{name}_total {retrainer.stats[name]}']
+        return web.Response(text='\n'.join(lines) + '\n', content_type='text/plain')
+
+    async def handle_health(self, request):
+        active = self.detector.active_model
+        return web.json_response({'status': 'ok', 'model_version': active.version if active else None})
+
+    async def handle_ready(self, request):
+        """200 once a model is loaded, 503 while the service is still starting"""
+        active = self.detector.active_model
+        if active is None:
+            return web.json_response({'status': 'starting'}, status=503)
+        return web.json_response({'status': 'ready', 'model_version': active.version,
+                                  'startup': self.detector.startup})
+
+    async def serve(self):
+        """Run until the loop is stopped"""
+        self.batcher.start()
+        runner = web.AppRunner(self.build_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        logger.info(f"Scoring API listening on {self.host}:{self.port} "
+                    f"(max batch {self.batcher.max_batch_size}, max delay {self.batcher.max_delay * 1000:.1f} ms)")
+        self.ready.set()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.batcher.stop()
+            await runner.cleanup()
+
+    def start(self):
+        """Serve from a daemon thread so the poll loop keeps the main thread"""
+        self.loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.main_task = self.loop.create_task(self.serve())
+            try:
+                self.loop.run_until_complete(self.main_task)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self.loop.close()
+
+        self.thread = threading.Thread(target=run, name='scoring-api', daemon=True)
+        self.thread.start()
+        self.ready.wait(timeout=10)
+
+    def stop(self):
+        """Cancel the server and wait for in-flight batches"""
+        if self.loop is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.main_task.cancel)
+            self.thread.join(timeout=10)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Per-Segment Baseline Models
+Routes each batch by a segment key (department, event_type, ...) to that
+segment's registry version, falling back to the global model, with a
+bounded LRU of lazily loaded, memory-mapped segment models
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from compiled_forest import ForestStack
+from model_registry import ModelRegistry
+from ueba_batch import factorize
+
+logger = logging.getLogger(__name__)
+
+# Segment label reported for rows scored by the global model
+GLOBAL_SEGMENT = '__global__'
+
+
+def segment_value(event, segment_by):
+    """Segment of one event; '' when the field is missing, which always scores globally"""
+    value = event.get(segment_by)
+    return '' if value is None else str(value)
+
+
+def segment_registry_root(registry_root, segment_by, value):
+    """Registry directory of one segment's model versions"""
+    return os.path.join(registry_root, 'segments', segment_by, quote(str(value), safe=''))
+
+
+class SegmentModels:
+    """Segment value -> RegisteredModel, for one segment key
+
+    refresh() re-reads which segments have a promoted version (cheap: one
+    small file per segment) and drops cached models whose version moved;
+    get() loads on first use and evicts the least recently used model past
+    `capacity`. Loads go through ModelRegistry.load, so forest arrays are
+    memory-mapped and an evicted model costs no more than its page cache.
+    stacked() scores a whole page in one traversal through a ForestStack of
+    the global model plus every cached segment model, rebuilt only when the
+    set of loaded versions changes.
+    """
+
+    def __init__(self, registry_root, segment_by, feature_names, capacity=16):
+        self.registry_root = registry_root
+        self.segment_by = segment_by
+        self.feature_names = list(feature_names)
+        self.capacity = capacity
+        self.root = os.path.join(registry_root, 'segments', segment_by)
+
+        self.available = {}
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'loads': 0, 'evictions': 0, 'hits': 0, 'load_failures': 0, 'stack_builds': 0}
+        self.stack = (None, None)
+        self.refresh()
+
+    def registry(self, value):
+        return ModelRegistry(segment_registry_root(self.registry_root, self.segment_by, value))
+
+    def refresh(self):
+        """Pick up newly promoted segment versions; returns the segments whose version changed"""
+        available = {}
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                try:
+                    with open(os.path.join(self.root, name, 'CURRENT')) as f:
+                        version = f.read().strip()
+                except OSError:
+                    continue
+                if version:
+                    available[unquote(name)] = version
+
+        changed = [value for value, version in available.items() if self.available.get(value) != version]
+        changed += [value for value in self.available if value not in available]
+        with self.lock:
+            self.available = available
+            for value in changed:
+                self.models.pop(value, None)
+        if changed:
+            logger.info(f"Segment models by {self.segment_by}: {len(available)} available, updated {sorted(changed)}")
+        return changed
+
+    def get(self, value):
+        """Model for a segment value, or None to use the global model"""
+        version = self.available.get(value)
+        if version is None:
+            return None
+
+        with self.lock:
+            model = self.models.get(value)
+            if model is not None and model.version == version:
+                self.models.move_to_end(value)
+                self.stats['hits'] += 1
+                return model
+
+        try:
+            model = self.registry(value).load(version)
+        except Exception as e:
+            logger.error(f"Failed to load {self.segment_by}={value} model {version}: {str(e)}")
+            self.stats['load_failures'] += 1
+            self.available.pop(value, None)
+            return None
+        if model.manifest['feature_names'] != self.feature_names:
+            logger.error(f"{self.segment_by}={value} model {version} expects features "
+                         f"{model.manifest['feature_names']}, using the global model")
+            self.available.pop(value, None)
+            return None
+
+        with self.lock:
+            self.stats['loads'] += 1
+            self.models[value] = model
+            self.models.move_to_end(value)
+            while len(self.models) > self.capacity:
+                self.models.popitem(last=False)
+                self.stats['evictions'] += 1
+        return model
+
+    def stacked(self, values, fallback):
+        """Plan for scoring a page in one pass
+
+        Returns (stack, members, segments, models): members[row] indexes
+        the ForestStack member that scores that row; segments and models
+        name each member, with member 0 the global model `fallback`.
+        """
+        codes, uniques = factorize(values)
+        page = {}
+        for value in uniques:
+            model = self.get(value)
+            if model is not None:
+                page[value] = model
+        with self.lock:
+            loaded = dict(self.models)
+        # Models this page needed but already evicted (cache smaller than the page) ride along
+        loaded.update(page)
+
+        segments = [GLOBAL_SEGMENT] + sorted(loaded)
+        models = [fallback] + [loaded[value] for value in segments[1:]]
+        key = tuple((segment, model.version) for segment, model in zip(segments, models))
+        stack_key, stack = self.stack
+        if key != stack_key:
+            stack = ForestStack([model.compiled for model in models], [model.scaler for model in models])
+            self.stack = (key, stack)
+            self.stats['stack_builds'] += 1
+            logger.info(f"Stacked {len(models)} models ({stack.nbytes() / 2**20:.1f} MB) for one-pass scoring")
+
+        member_of = {segment: m for m, segment in enumerate(segments)}
+        unique_members = np.array([member_of[value] if value in page else 0 for value in uniques], dtype=np.intp)
+        return stack, unique_members[codes], segments, models
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Entity Sharding
+Hash-partitions security events by entity (username, falling back to
+source_ip) so each detection worker owns a disjoint slice of users, and
+redistributes per-shard state when the number of shards changes
+"""
+
+import os
+import glob
+import json
+import logging
+
+import numpy as np
+
+from event_consumer import SEEN_DTYPE, read_checkpoint, write_checkpoint, write_seen_log
+from ueba_state import UserStateStore, java_string_hash
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_FILE = 'shards.json'
+CHECKPOINT_NAME = 'security-events'
+USER_STATE_NAME = 'ueba_users'
+
+# Fields an event is partitioned by, first non-empty one wins
+PARTITION_FIELDS = ['username', 'source_ip']
+
+# Shards own contiguous ranges of the unsigned 32-bit route hash. Layouts
+# written before that (floorMod of the signed hash) are migrated by rebalance()
+PARTITIONING = 'route-range'
+LEGACY_PARTITIONING = 'floormod'
+
+# Ingest pipeline storing each event's route hash in ROUTE_FIELD, computed once
+# when the event is indexed; must agree with partition_key/java_string_hash below
+ROUTE_PIPELINE = 'shard-route'
+ROUTE_FIELD = 'shard_route'
+ROUTE_SCRIPT = """
+String key = '';
+for (String field : params.fields) {
+    def value = ctx[field];
+    if (value != null && !value.toString().isEmpty()) {
+        key = value.toString();
+        break;
+    }
+}
+ctx[params.target] = Integer.toUnsignedLong(key.hashCode());
+"""
+
+# Same rule from keyword doc values, only for events indexed before the pipeline
+# existed. Values over the keyword ignore_above (256) have no doc value, so such
+# a username falls back to source_ip here while the pipeline hashes it
+LEGACY_ROUTE_SCRIPT = """
+String key = '';
+for (String field : params.fields) {
+    String column = field + '.keyword';
+    if (doc.containsKey(column) && doc[column].size() > 0 && !doc[column].value.isEmpty()) {
+        key = doc[column].value;
+        break;
+    }
+}
+long route = Integer.toUnsignedLong(key.hashCode());
+return route >= params.gte && route < params.lt;
+"""
+
+
+def shard_of(route, shard_count):
+    """Shard for an unsigned 32-bit route hash: the range it falls in"""
+    return (route * shard_count) >> 32
+
+
+def shard_bounds(shard, shard_count):
+    """[gte, lt) route hashes owned by one shard"""
+    return -(-(shard << 32) // shard_count), -(-((shard + 1) << 32) // shard_count)
+
+
+def partition_key(event):
+    """Entity an event is routed by: its first non-empty partition field, or ''"""
+    for field in PARTITION_FIELDS:
+        value = event.get(field)
+        if value is not None and str(value) != '':
+            return str(value)
+    return ''
+
+
+def route_hash(event):
+    """What the ingest pipeline stores in ROUTE_FIELD"""
+    return java_string_hash(partition_key(event))
+
+
+def event_shard(event, shard_count):
+    """Shard that owns an event"""
+    return shard_of(route_hash(event), shard_count)
+
+
+def install_route_pipeline(es, index):
+    """Create the route pipeline and make it the index's default, so every writer gets ROUTE_FIELD
+
+    Idempotent; run by every sharded worker on startup. On failure the
+    workers still partition correctly, through the legacy script clause.
+    """
+    try:
+        es.ingest.put_pipeline(id=ROUTE_PIPELINE, description='Entity route hash for sharded detection', processors=[
+            {'script': {'lang': 'painless', 'source': ROUTE_SCRIPT,
+                        'params': {'fields': PARTITION_FIELDS, 'target': ROUTE_FIELD}}}
+        ])
+        settings = {'index': {'default_pipeline': ROUTE_PIPELINE}}
+        if es.indices.exists(index=index):
+            es.indices.put_settings(index=index, settings=settings)
+        else:
+            es.indices.create(index=index, settings=settings)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not install the {ROUTE_PIPELINE} ingest pipeline on {index}, "
+                       f"every event will be routed by script: {str(e)}")
+        return False
+
+
+def shard_query(shard, shard_count):
+    """Query clause selecting one shard's events, or None when unsharded
+
+    A range on the indexed route hash; the script clause only runs on
+    events indexed before the pipeline, which carry no ROUTE_FIELD.
+    """
+    if shard_count <= 1:
+        return None
+    gte, lt = shard_bounds(shard, shard_count)
+    return {
+        "bool": {
+            "should": [
+                {"range": {ROUTE_FIELD: {"gte": gte, "lt": lt}}},
+                {
+                    "bool": {
+                        "must_not": {"exists": {"field": ROUTE_FIELD}},
+                        "filter": {
+                            "script": {
+                                "script": {
+                                    "source": LEGACY_ROUTE_SCRIPT,
+                                    "lang": "painless",
+                                    "params": {"fields": PARTITION_FIELDS, "gte": gte, "lt": lt}
+                                }
+                            }
+                        }
+                    }
+                }
+            ],
+            "minimum_should_match": 1
+        }
+    }
+
+
+def shard_suffix(shard, shard_count, partitioning=PARTITIONING):
+    """File-name suffix for a shard's state; unsharded keeps the original names"""
+    if shard_count <= 1:
+        return ''
+    if partitioning == LEGACY_PARTITIONING:
+        return f'.shard-{shard}-of-{shard_count}'
+    return f'.range-{shard}-of-{shard_count}'
+
+
+def checkpoint_path(state_dir, shard=0, shard_count=1, partitioning=PARTITIONING):
+    """Cursor checkpoint file for one shard"""
+    return os.path.join(state_dir, f'{CHECKPOINT_NAME}{shard_suffix(shard, shard_count, partitioning)}.checkpoint.json')
+
+
+def user_state_path(state_dir, shard=0, shard_count=1, partitioning=PARTITIONING):
+    """UEBA state table for one shard"""
+    return os.path.join(state_dir, f'{USER_STATE_NAME}{shard_suffix(shard, shard_count, partitioning)}.dat')
+
+
+def ready_path(state_dir, shard=0, shard_count=1):
+    """File a worker writes once it can score, and removes on shutdown"""
+    return os.path.join(state_dir, f'ready{shard_suffix(shard, shard_count)}')
+
+
+def read_layout(state_dir):
+    """(shard count, partitioning) the state directory is currently laid out for"""
+    try:
+        with open(os.path.join(state_dir, LAYOUT_FILE)) as f:
+            layout = json.load(f)
+    except FileNotFoundError:
+        return 1, PARTITIONING
+    return layout['shard_count'], layout.get('partitioning', LEGACY_PARTITIONING)
+
+
+def write_layout(state_dir, shard_count):
+    """Atomically record the shard count"""
+    path = os.path.join(state_dir, LAYOUT_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'shard_count': shard_count, 'partitioning': PARTITIONING}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def remove_state_files(state_dir, shard_count, partitioning=PARTITIONING):
+    """Delete every shard's checkpoint and UEBA table for a layout"""
+    for shard in range(shard_count):
+        for path in (checkpoint_path(state_dir, shard, shard_count, partitioning),
+                     user_state_path(state_dir, shard, shard_count, partitioning)):
+            for candidate in [path, f"{path}.json"] + glob.glob(glob.escape(path) + '.seen.*'):
+                if os.path.exists(candidate):
+                    os.remove(candidate)
+
+
+def merge_checkpoints(state_dir, shard_count, partitioning=PARTITIONING):
+    """Earliest committed position across a layout's shards, or None if none committed
+
+    Returns (max_event_time, seen records). Every new shard restarts from the
+    slowest old shard; old shards own disjoint events, so the union of their
+    seen ids is safe to skip. Events the faster shards handled before their
+    own lateness window are re-read (at-least-once), but none are skipped.
+    """
+    max_event_time, seen = None, []
+    for shard in range(shard_count):
+        try:
+            checkpoint, records = read_checkpoint(checkpoint_path(state_dir, shard, shard_count, partitioning))
+        except (OSError, ValueError, KeyError):
+            # A shard that never committed has no position to preserve
+            continue
+        if max_event_time is None or checkpoint['max_event_time'] < max_event_time:
+            max_event_time = checkpoint['max_event_time']
+        seen.append(records)
+    if max_event_time is None:
+        return None
+    return max_event_time, np.unique(np.concatenate(seen)) if seen else np.empty(0, dtype=SEEN_DTYPE)
+
+
+def rebalance(state_dir, new_count):
+    """Redistribute checkpoints and UEBA state from the recorded layout to new_count shards
+
+    Must only run while no worker is active. New files are written first and
+    the layout file is switched last, so a crash midway is redone on restart.
+    A legacy (floorMod) layout is redistributed even at the same count; its
+    files have their own names, so old and new never collide.
+    """
+    old_count, old_partitioning = read_layout(state_dir)
+    if old_count == new_count and (old_count <= 1 or old_partitioning == PARTITIONING):
+        return False
+
+    logger.info(f"Rebalancing detection state from {old_count} ({old_partitioning}) to {new_count} shards")
+    os.makedirs(state_dir, exist_ok=True)
+    remove_state_files(state_dir, new_count)
+
+    # Cursor: every new shard resumes from the slowest old shard
+    merged = merge_checkpoints(state_dir, old_count, old_partitioning)
+    if merged is not None:
+        max_event_time, seen = merged
+        for shard in range(new_count):
+            path = checkpoint_path(state_dir, shard, new_count)
+            write_seen_log(path, 0, seen)
+            write_checkpoint(path, {
+                'index': CHECKPOINT_NAME,
+                'max_event_time': max_event_time,
+                'generation': 0,
+                'seen_entries': len(seen)
+            })
+
+    # UEBA state: every user record moves to the shard its route hash maps to; a user
+    # present in several old shards (e.g. 'unknown', partitioned by source_ip) is merged
+    targets = [UserStateStore(user_state_path(state_dir, shard, new_count)) for shard in range(new_count)]
+    moved = 0
+    for shard in range(old_count):
+        path = user_state_path(state_dir, shard, old_count, old_partitioning)
+        if not os.path.exists(path):
+            continue
+        source = UserStateStore(path)
+        for records in source.iter_records():
+            # Same range rule as shard_of, for a whole chunk
+            destinations = (records['route'].astype(np.uint64) * np.uint64(new_count)) >> np.uint64(32)
+            for target_shard, target in enumerate(targets):
+                selected = records[destinations == target_shard]
+                if len(selected):
+                    target.insert_records(selected)
+            moved += len(records)
+        source.close()
+    for target in targets:
+        target.close()
+
+    write_layout(state_dir, new_count)
+    remove_state_files(state_dir, old_count, old_partitioning)
+    logger.info(f"Rebalanced {moved} user records into {new_count} shards")
+    return True
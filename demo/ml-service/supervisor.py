@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Detection Worker Supervisor
+Runs N ThreatDetector worker processes, each owning one hash partition of
+entities, restarts workers that crash and rebalances state when N changes
+"""
+
+import os
+import time
+import signal
+import logging
+import multiprocessing
+
+from score_cache import parse_quantization
+from sharding import read_layout, rebalance
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def run_worker(shard, shard_count, detector_options):
+    """Worker-process entry point: one ThreatDetector bound to one shard"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - %(levelname)s - [shard {shard}/{shard_count}] %(message)s',
+        # Replaces the handler installed when this module was imported in the child
+        force=True
+    )
+
+    # Imported here so the supervisor itself never loads sklearn
+    from threat_detector import ThreatDetector, handle_sigterm
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    options = dict(detector_options)
+    if shard != 0:
+        # The scoring API binds a fixed port, so only shard 0 serves it
+        options.pop('api_port', None)
+    detector = ThreatDetector(
+        shard=shard,
+        shard_count=shard_count,
+        # One retrainer is enough: every worker hot-swaps whatever the registry promotes
+        retrain=(shard == 0),
+        **options
+    )
+    detector.process_events()
+
+
+class WorkerSupervisor:
+    def __init__(self, worker_count, model_dir='/models', detector_options=None, check_interval=1.0,
+                 restart_backoff=1.0, max_restart_backoff=60.0, stop_timeout=30.0):
+        self.worker_count = worker_count
+        self.model_dir = model_dir
+        self.state_dir = os.path.join(model_dir, 'state')
+        self.desired_path = os.path.join(self.state_dir, 'workers')
+        self.detector_options = dict(detector_options or {}, model_dir=model_dir)
+        self.check_interval = check_interval
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.stop_timeout = stop_timeout
+
+        # spawn: workers get a clean interpreter instead of a fork of this one
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = {}
+        self.started_at = {}
+        self.failures = {}
+        self.restart_at = {}
+
+    def spawn(self, shard):
+        """Start the worker for one shard"""
+        process = self.context.Process(
+            target=run_worker,
+            args=(shard, self.worker_count, self.detector_options),
+            name=f'detector-shard-{shard}'
+        )
+        process.start()
+        self.workers[shard] = process
+        self.started_at[shard] = time.monotonic()
+        self.restart_at.pop(shard, None)
+        logger.info(f"Started worker {shard}/{self.worker_count} (pid {process.pid})")
+
+    def start(self):
+        """Lay state out for worker_count shards and start every worker"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        rebalance(self.state_dir, self.worker_count)
+        for shard in range(self.worker_count):
+            self.spawn(shard)
+
+    def check_workers(self):
+        """Restart workers that exited, backing off on repeated crashes"""
+        now = time.monotonic()
+        for shard, process in list(self.workers.items()):
+            if process.is_alive():
+                continue
+
+            if shard not in self.restart_at:
+                # A worker that ran for a while before dying starts its backoff over
+                if now - self.started_at[shard] > self.max_restart_backoff:
+                    self.failures[shard] = 0
+                self.failures[shard] = self.failures.get(shard, 0) + 1
+                delay = min(self.restart_backoff * 2 ** (self.failures[shard] - 1), self.max_restart_backoff)
+                self.restart_at[shard] = now + delay
+                logger.error(f"Worker {shard} exited with code {process.exitcode}, restarting in {delay:.0f}s")
+
+            if now >= self.restart_at[shard]:
+                self.spawn(shard)
+
+    def stop_workers(self):
+        """SIGTERM every worker so it flushes alerts, state and its checkpoint, then wait"""
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+
+        deadline = time.monotonic() + self.stop_timeout
+        for shard, process in self.workers.items():
+            process.join(timeout=max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.error(f"Worker {shard} did not stop within {self.stop_timeout:.0f}s, killing it")
+                process.kill()
+                process.join()
+
+        self.workers = {}
+        self.restart_at = {}
+
+    def resize(self, worker_count):
+        """Stop all workers, repartition their state for worker_count shards and restart"""
+        logger.info(f"Resizing from {self.worker_count} to {worker_count} workers")
+        self.stop_workers()
+        self.worker_count = worker_count
+        self.failures = {}
+        self.start()
+
+    def desired_worker_count(self):
+        """Worker count requested through the control file, if any"""
+        try:
+            with open(self.desired_path) as f:
+                return max(1, int(f.read().strip()))
+        except FileNotFoundError:
+            return self.worker_count
+        except ValueError:
+            logger.error(f"Ignoring unreadable worker count in {self.desired_path}")
+            return self.worker_count
+
+    def run(self):
+        """Supervise until interrupted"""
+        layout_count, partitioning = read_layout(self.state_dir)
+        logger.info(f"Supervising {self.worker_count} detection workers "
+                    f"(state laid out for {layout_count}, {partitioning})")
+        self.start()
+        try:
+            while True:
+                desired = self.desired_worker_count()
+                if desired != self.worker_count:
+                    self.resize(desired)
+                self.check_workers()
+                time.sleep(self.check_interval)
+        finally:
+            self.stop_workers()
+
+
+def handle_sigterm(signum, frame):
+    """Turn docker stop into a clean shutdown of every worker"""
+    raise SystemExit(0)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run sharded ML detection workers')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--es-host', default=os.environ.get('ES_HOST', 'elasticsearch'),
+                        help='Elasticsearch host (default: $ES_HOST or elasticsearch)')
+    parser.add_argument('--es-port', type=int, default=int(os.environ.get('ES_PORT', 9200)),
+                        help='Elasticsearch port (default: $ES_PORT or 9200)')
+    parser.add_argument('--model-dir', default='/models', help='Model and state directory (default: /models)')
+    parser.add_argument('--poll-interval', type=int, default=60, help='Seconds between polls (default: 60)')
+    parser.add_argument('--async-pipeline', action='store_true',
+                        help='Run each worker with the pipelined asyncio loop')
+    parser.add_argument('--api-port', type=int, help='Serve the scoring API from shard 0 on this port')
+    parser.add_argument('--score-cache-size', type=int, default=0,
+                        help='Per-worker score cache entries (default: 0, disabled)')
+    parser.add_argument('--score-quantization', nargs='*', metavar='FEATURE=STEP',
+                        help='Round features to multiples of STEP before cache lookup')
+    parser.add_argument('--segment-by', help='Route events to per-segment models keyed on this field')
+    parser.add_argument('--allowed-lateness', type=float, default=300,
+                        help='Seconds an event may arrive behind the newest one and still be scored (default: 300)')
+    parser.add_argument('--seed-registry', default=os.environ.get('ML_SEED_REGISTRY', '/opt/ml-seed/registry'),
+                        help='Registry whose current model is adopted when the model dir is empty')
+    parser.add_argument('--drift-threshold', type=float, default=0.2,
+                        help='KS distance between live and training features that triggers a retrain (default: 0.2)')
+    parser.add_argument('--drift-window', type=int, default=50000,
+                        help='Events per drift measurement window (default: 50000)')
+
+    args = parser.parse_args()
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    supervisor = WorkerSupervisor(
+        args.workers,
+        model_dir=args.model_dir,
+        detector_options={
+            'es_host': args.es_host,
+            'es_port': args.es_port,
+            'poll_interval': args.poll_interval,
+            'async_pipeline': args.async_pipeline,
+            'api_port': args.api_port,
+            'score_cache_size': args.score_cache_size,
+            'score_quantization': parse_quantization(args.score_quantization),
+            'segment_by': args.segment_by,
+            'allowed_lateness': args.allowed_lateness,
+            'seed_registry': args.seed_registry,
+            'drift_threshold': args.drift_threshold,
+            'drift_window': args.drift_window
+        }
+    )
+    supervisor.run()
@@ -4,84 +4,286 @@ AI-Driven Threat Detection Service
 Uses machine learning for anomaly detection and behavioral analysis
 """
 
-import json
 import time
+
+# Start of the import graph, for the startup timings logged once ready
+IMPORT_STARTED = time.time()
+
+import json
+import asyncio
 import logging
 from datetime import datetime
-from elasticsearch import Elasticsearch
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
 import numpy as np
-import joblib
 import os
+import signal
+
+from alert_writer import BulkAlertWriter
+from drift_monitor import DriftMonitor
+from event_consumer import EventConsumer, id_key
+from model_registry import ModelRegistry, summarize_features
+from retrainer import BackgroundRetrainer
+from score_cache import ScoreCache, parse_quantization
+from segment_models import SegmentModels, segment_value
+from sharding import checkpoint_path, install_route_pipeline, ready_path, shard_query, user_state_path
+from ueba_batch import aggregate_user_metrics, event_times, factorize
+from ueba_state import UserStateStore
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Feature columns used by the anomaly model, in matrix order
+FEATURE_NAMES = [
+    'failed_logins',
+    'packet_count',
+    'byte_count',
+    'connection_duration',
+    'port_scan_score'
+]
+
+# Baseline model baked into the image, adopted when the registry is empty
+SEED_REGISTRY = os.environ.get('ML_SEED_REGISTRY', '/opt/ml-seed/registry')
+
+def train_synthetic_model(registry):
+    """Train model with synthetic baseline data and publish it; returns the version"""
+    # sklearn is only needed to train; scoring runs on the compiled artifacts
+    from sklearn.ensemble import IsolationForest
+    from sklearn.preprocessing import StandardScaler
+    
+    # Generate synthetic normal behavior patterns
+    np.random.seed(42)
+    normal_data = np.random.normal(loc=50, scale=10, size=(1000, 5))
+    
+    model = IsolationForest(
+        contamination=0.1,
+        random_state=42,
+        n_estimators=100
+    )
+    scaler = StandardScaler()
+    
+    # Fit the scaler and model
+    started = time.time()
+    scaled_data = scaler.fit_transform(normal_data)
+    model.fit(scaled_data)
+    
+    # Publish as a registry version
+    stats = summarize_features(normal_data)
+    stats['training_seconds'] = time.time() - started
+    return registry.publish(model, scaler, FEATURE_NAMES, training_stats=stats, source='synthetic')
+
 class ThreatDetector:
-    def __init__(self, es_host='elasticsearch', es_port=9200):
-        self.es = Elasticsearch([f'http://{es_host}:{es_port}'])
-        self.model = None
-        self.scaler = StandardScaler()
+    def __init__(self, es_host='elasticsearch', es_port=9200, model_dir='/models', poll_interval=60,
+                 retrain_interval=3600, shard=0, shard_count=1, retrain=True, es=None, async_pipeline=False,
+                 api_port=None, score_cache_size=0, score_quantization=None, segment_by=None, segment_cache_size=16,
+                 allowed_lateness=300, seed_registry=SEED_REGISTRY, drift_threshold=0.2, drift_window=50000):
+        self.es_url = f'http://{es_host}:{es_port}'
+        if es is None:
+            from elasticsearch import Elasticsearch
+            
+            es = Elasticsearch([self.es_url])
+        self.es = es
+        self.model_dir = model_dir
+        self.seed_registry = seed_registry
+        self.poll_interval = poll_interval
+        self.async_pipeline = async_pipeline
+        self.api_port = api_port
+        self.scoring_server = None
+        self.shard = shard
+        self.shard_count = shard_count
+        self.startup = {}
+        
+        # Each shard consumes a disjoint entity partition with its own cursor and UEBA state
+        state_dir = os.path.join(model_dir, 'state')
+        self.ready_path = ready_path(state_dir, shard, shard_count)
+        if os.path.exists(self.ready_path):
+            os.remove(self.ready_path)
+        # Workers filter on a route hash the ingest pipeline stores once per event
+        if shard_count > 1:
+            install_route_pipeline(self.es, 'security-events')
+        self.consumer = EventConsumer(
+            self.es,
+            index='security-events',
+            checkpoint_path=checkpoint_path(state_dir, shard, shard_count),
+            query_filter=shard_query(shard, shard_count),
+            allowed_lateness=allowed_lateness
+        )
+        self.alert_writer = BulkAlertWriter(self.es)
+        self.user_state = UserStateStore(user_state_path(state_dir, shard, shard_count))
+        # Events folded into user_state whose page is not committed yet: id key -> UEBA alerts they raised.
+        # A re-read page (after a failed alert write) is not folded twice and re-sends the same alerts
+        self.folded = {}
+        self.registry = ModelRegistry(os.path.join(model_dir, 'registry'))
+        self.active_model = None
+        # Optional memo of anomaly scores for repeated feature vectors
+        self.score_cache = ScoreCache(FEATURE_NAMES, score_cache_size, score_quantization) if score_cache_size else None
+        # Optional per-segment baselines (e.g. by department), global model as fallback
+        self.segment_models = SegmentModels(
+            self.registry.root, segment_by, FEATURE_NAMES, segment_cache_size
+        ) if segment_by else None
+        # Live feature sketches vs. the active model's training sketches; gates retraining
+        self.drift_monitor = DriftMonitor(FEATURE_NAMES, threshold=drift_threshold, window=drift_window)
+        
+        # Serve /health and /ready while the model loads; /score answers 503 until then
+        if api_port:
+            self.start_scoring_server()
+        started = time.time()
         self.initialize_model()
+        self.startup['model_seconds'] = time.time() - started
+        self.retrainer = BackgroundRetrainer(
+            self.registry, FEATURE_NAMES, min_interval=retrain_interval, drift_monitor=self.drift_monitor
+        ) if retrain else None
         
     def initialize_model(self):
         """Initialize or load the anomaly detection model"""
-        model_path = '/models/threat_model.pkl'
-        if os.path.exists(model_path):
-            logger.info("Loading existing model...")
-            self.model = joblib.load(model_path)
-        else:
-            logger.info("Creating new Isolation Forest model...")
-            self.model = IsolationForest(
-                contamination=0.1,
-                random_state=42,
-                n_estimators=100
-            )
-            # Train on synthetic data initially
-            self.train_initial_model()
+        # Only shard 0 bootstraps the registry; other shards wait for its first version
+        while self.shard != 0 and self.registry.current_version() is None:
+            logger.info("Waiting for shard 0 to publish the first model version...")
+            time.sleep(1)
             
+        if self.registry.current_version() is None:
+            # Adopt a model saved before the registry existed, otherwise bootstrap one
+            legacy_version = self.registry.import_legacy(
+                os.path.join(self.model_dir, 'threat_model.pkl'),
+                os.path.join(self.model_dir, 'scaler.pkl'),
+                FEATURE_NAMES
+            )
+            if legacy_version is None and self.seed_registry:
+                # The image's pre-trained baseline: a file copy, no training or sklearn import
+                legacy_version = self.registry.import_version(self.seed_registry)
+            if legacy_version is None:
+                logger.info("Creating new Isolation Forest model...")
+                self.train_initial_model()
+                
+        self.refresh_model()
+        
     def train_initial_model(self):
         """Train model with synthetic baseline data"""
-        # Generate synthetic normal behavior patterns
-        np.random.seed(42)
-        normal_data = np.random.normal(loc=50, scale=10, size=(1000, 5))
-        
-        # Fit the scaler and model
-        scaled_data = self.scaler.fit_transform(normal_data)
-        self.model.fit(scaled_data)
-        
-        # Save model
-        os.makedirs('/models', exist_ok=True)
-        joblib.dump(self.model, '/models/threat_model.pkl')
-        joblib.dump(self.scaler, '/models/scaler.pkl')
+        train_synthetic_model(self.registry)
         logger.info("Initial model trained and saved")
         
+    def start_scoring_server(self):
+        # Only the API needs aiohttp's server
+        from scoring_api import ScoringServer
+        
+        self.scoring_server = ScoringServer(self, port=self.api_port)
+        self.scoring_server.start()
+        
+    def mark_ready(self):
+        """Write the readiness file once a model is active, with startup timings"""
+        self.startup['ready_seconds'] = time.time() - IMPORT_STARTED
+        os.makedirs(os.path.dirname(self.ready_path), exist_ok=True)
+        tmp_path = f"{self.ready_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(self.startup, pid=os.getpid(), model_version=self.active_model.version), f)
+        os.replace(tmp_path, self.ready_path)
+        logger.info(f"Ready in {self.startup['ready_seconds']:.2f}s since import "
+                    f"(model {self.active_model.version} loaded in {self.startup['model_seconds']:.2f}s)")
+        
+    def refresh_model(self):
+        """Swap in the registry's current version if it changed; True when swapped"""
+        if self.segment_models is not None:
+            self.segment_models.refresh()
+            
+        version = self.registry.current_version()
+        if self.active_model is not None and version == self.active_model.version:
+            return False
+            
+        try:
+            candidate = self.registry.load(version)
+        except Exception as e:
+            logger.error(f"Failed to load model version {version}: {str(e)}")
+            return False
+            
+        if candidate.manifest['feature_names'] != FEATURE_NAMES:
+            logger.error(f"Model version {version} expects features {candidate.manifest['feature_names']}, keeping current model")
+            return False
+            
+        # Single reference swap: in-flight batches keep the model they started with
+        previous = self.active_model.version if self.active_model else None
+        self.active_model = candidate
+        self.drift_monitor.set_reference(version, self.registry.read_sketches(version))
+        logger.info(f"Active model version: {version} (previous: {previous})")
+        return True
+        
     def extract_features(self, event):
         """Extract numerical features from security events"""
-        features = [
-            event.get('failed_logins', 0),
-            event.get('packet_count', 0),
-            event.get('byte_count', 0),
-            event.get('connection_duration', 0),
-            event.get('port_scan_score', 0)
-        ]
+        features = [event.get(name, 0) for name in FEATURE_NAMES]
         return np.array(features).reshape(1, -1)
         
+    @staticmethod
+    def extract_features_batch(events):
+        """Build one (n_events, n_features) matrix for a batch of events"""
+        rows = [[event.get(name, 0) for name in FEATURE_NAMES] for event in events]
+        return np.array(rows, dtype=np.float64).reshape(len(events), len(FEATURE_NAMES))
+        
     def detect_anomaly(self, event):
         """Detect if an event is anomalous"""
-        features = self.extract_features(event)
-        scaled_features = self.scaler.transform(features)
+        return self.detect_anomalies([event])[0]
+        
+    def detect_anomalies(self, events):
+        """Detect anomalies for a batch of events with a single model pass"""
+        if not events:
+            return []
+            
+        return self.score_features(self.extract_features_batch(events), self.event_segments(events))
         
-        # Predict (-1 for anomaly, 1 for normal)
-        prediction = self.model.predict(scaled_features)[0]
-        anomaly_score = -self.model.score_samples(scaled_features)[0]
+    def event_segments(self, events):
+        """Segment value of every event, or None when segment models are off"""
+        if self.segment_models is None:
+            return None
+        key = self.segment_models.segment_by
+        return [segment_value(event, key) for event in events]
         
-        return {
-            'is_anomaly': prediction == -1,
-            'anomaly_score': float(anomaly_score),
-            'confidence': min(anomaly_score * 10, 100)
-        }
+    def score_with(self, model, features, slot=None):
+        """Anomaly scores from one registered model, through the score cache if enabled"""
+        # One forest traversal; predict() is score_samples() < offset_ (-1 for anomaly)
+        def traverse(rows):
+            return -model.compiled.score_samples(model.scaler.transform(rows))
+        
+        if self.score_cache is not None:
+            return self.score_cache.scores(features, model.version, traverse, slot)
+        return traverse(features)
+        
+    def score_features(self, features, segments=None):
+        """Score a raw (n_events, n_features) matrix, routed by segment when given"""
+        # Hold one reference so a concurrent hot-swap can't mix scaler and forest
+        active = self.active_model
+        
+        if segments is None or self.segment_models is None:
+            anomaly_scores = self.score_with(active, features)
+            is_anomaly = anomaly_scores > -active.compiled.offset_
+            confidence = np.minimum(anomaly_scores * 10, 100)
+            return [
+                {
+                    'is_anomaly': bool(flag),
+                    'anomaly_score': float(score),
+                    'confidence': float(conf)
+                }
+                for flag, score, conf in zip(is_anomaly, anomaly_scores, confidence)
+            ]
+            
+        # One traversal for the whole page: each row walks its own segment's trees
+        stack, members, labels, models = self.segment_models.stacked(segments, active)
+
+        def traverse(rows, row_members):
+            return -stack.score_samples(rows, row_members)
+
+        if self.score_cache is not None:
+            versions = [model.version for model in models]
+            anomaly_scores = self.score_cache.slot_scores(features, members, labels, versions, traverse)
+        else:
+            anomaly_scores = traverse(features, members)
+        is_anomaly = anomaly_scores > -stack.offset_[members]
+        confidence = np.minimum(anomaly_scores * 10, 100)
+        return [
+            {
+                'is_anomaly': bool(flag),
+                'anomaly_score': float(score),
+                'confidence': float(conf),
+                'segment': labels[member],
+                'model_version': models[member].version
+            }
+            for flag, score, conf, member in zip(is_anomaly, anomaly_scores, confidence, members)
+        ]
         
     def analyze_behavioral_patterns(self, user_events):
         """UEBA - User and Entity Behavior Analytics"""
@@ -114,24 +316,131 @@ class ThreatDetector:
             }
         }
         
+    def analyze_behavioral_batch(self, events, min_events=3):
+        """Stateless columnar UEBA over one batch: {username: (analysis, event_count)}; alerts use self.user_state"""
+        return aggregate_user_metrics(events, min_events=min_events)
+        
+    def process_batch(self, events, event_ids=None):
+        """Run anomaly detection and UEBA over one batch of events"""
+        alerts, threats_detected = self.analyze_batch(events, event_ids)
+        for index, alert, doc_id in alerts:
+            self.alert_writer.add(index, alert, doc_id)
+        return threats_detected
+        
+    def analyze_batch(self, events, event_ids=None):
+        """Score one batch and update UEBA state; returns ([(index, alert, doc_id)], threats_detected)
+
+        With the events' _ids, alerts get deterministic ids (so a re-read
+        page overwrites rather than duplicates them) and events already
+        folded into UEBA state for an uncommitted page are not folded
+        again; call committed() once the page's checkpoint is written.
+        """
+        alerts = []
+        # Run anomaly detection on the whole batch at once
+        features = self.extract_features_batch(events)
+        if self.retrainer is not None:
+            self.retrainer.observe(features)
+        self.drift_monitor.observe(features)
+        detection_results = self.score_features(features, self.event_segments(events)) if events else []
+        
+        threats_detected = 0
+        doc_ids = event_ids if event_ids is not None else [None] * len(events)
+        for event, event_id, detection_result in zip(events, doc_ids, detection_results):
+            if detection_result['is_anomaly']:
+                threats_detected += 1
+                # Store threat alert
+                threat_alert = {
+                    '@timestamp': datetime.utcnow().isoformat(),
+                    'original_event': event,
+                    'detection': detection_result,
+                    'alert_type': 'ML_ANOMALY_DETECTED',
+                    'severity': self.calculate_severity(detection_result['anomaly_score'])
+                }
+                
+                alerts.append(('threat-alerts', threat_alert,
+                               None if event_id is None else f"{event_id}@ML_ANOMALY_DETECTED"))
+                logger.warning(f"Threat detected! Score: {detection_result['anomaly_score']:.2f}")
+        
+        # Events folded before their page failed to commit: resend their alerts, skip the fold
+        keys = None
+        if event_ids is not None:
+            keys = [id_key(event_id) for event_id in event_ids]
+            fresh = [i for i, key in enumerate(keys) if key not in self.folded]
+            if len(fresh) < len(events):
+                for key in dict.fromkeys(key for key in keys if key in self.folded):
+                    alerts.extend(self.folded[key])
+                events = [events[i] for i in fresh]
+                keys = [keys[i] for i in fresh]
+        
+        # Fold the batch into persistent per-user state with columnar reductions
+        usernames = [event.get('username', 'unknown') for event in events]
+        self.user_state.update_batch(events, usernames)
+        
+        # Analyze user behavior from accumulated state; alert when risk escalates
+        user_codes, touched_users = factorize(usernames)
+        newest = np.full(len(touched_users), -np.inf)
+        if events:
+            np.maximum.at(newest, user_codes, event_times(events))
+        # A user's last event in the batch carries the UEBA alert it raised
+        last_event = {}
+        if keys is not None:
+            for code, key in zip(user_codes.tolist(), keys):
+                last_event[code] = key
+                self.folded.setdefault(key, [])
+        for code, (username, behavior_analysis, event_count, escalated) in enumerate(
+                self.user_state.assess_batch(touched_users)):
+            if escalated:
+                alert = {
+                    '@timestamp': datetime.utcnow().isoformat(),
+                    'alert_type': 'UEBA_RISK',
+                    'username': username,
+                    'analysis': behavior_analysis,
+                    'event_count': event_count
+                }
+                entry = ('ueba-alerts', alert, None if keys is None else f"{username}@{int(newest[code] * 1000)}")
+                alerts.append(entry)
+                if keys is not None:
+                    self.folded[last_event[code]].append(entry)
+                logger.warning(f"UEBA Risk: {username} - {behavior_analysis['risk_level']}")
+                
+        return alerts, threats_detected
+        
+    def committed(self, event_ids):
+        """Forget the fold bookkeeping for events whose page checkpoint is now written"""
+        for event_id in event_ids:
+            self.folded.pop(id_key(event_id), None)
+        
     def process_events(self):
         """Main processing loop"""
         logger.info("Starting threat detection service...")
         
+        if self.api_port and self.scoring_server is None:
+            self.start_scoring_server()
+        self.mark_ready()
+            
+        try:
+            if self.async_pipeline:
+                asyncio.run(self.run_async_pipeline())
+            else:
+                self.run_poll_loop()
+        finally:
+            if self.scoring_server is not None:
+                self.scoring_server.stop()
+            if self.retrainer is not None:
+                self.retrainer.stop()
+            self.alert_writer.close()
+            self.user_state.flush()
+            if os.path.exists(self.ready_path):
+                os.remove(self.ready_path)
+            
+    def run_poll_loop(self):
+        """Poll for new events until interrupted"""
         while True:
             try:
-                # Query recent events from Elasticsearch
-                query = {
-                    "query": {
-                        "range": {
-                            "@timestamp": {
-                                "gte": "now-5m"
-                            }
-                        }
-                    },
-                    "sort": [{"@timestamp": "desc"}],
-                    "size": 100
-                }
+                # Pick up a newly promoted model before the next poll
+                self.refresh_model()
+                if self.retrainer is not None:
+                    self.retrainer.maybe_retrain()
                 
                 # Create index if it doesn't exist
                 if not self.es.indices.exists(index='security-events'):
@@ -139,66 +448,64 @@ class ThreatDetector:
                     time.sleep(30)
                     continue
                     
-                response = self.es.search(index='security-events', body=query)
-                hits = response['hits']['hits']
-                
-                logger.info(f"Processing {len(hits)} events...")
-                
-                threats_detected = 0
-                for hit in hits:
-                    event = hit['_source']
-                    
-                    # Run anomaly detection
-                    detection_result = self.detect_anomaly(event)
-                    
-                    if detection_result['is_anomaly']:
-                        threats_detected += 1
-                        # Store threat alert
-                        threat_alert = {
-                            '@timestamp': datetime.utcnow().isoformat(),
-                            'original_event': event,
-                            'detection': detection_result,
-                            'alert_type': 'ML_ANOMALY_DETECTED',
-                            'severity': self.calculate_severity(detection_result['anomaly_score'])
-                        }
-                        
-                        self.es.index(index='threat-alerts', document=threat_alert)
-                        logger.warning(f"Threat detected! Score: {detection_result['anomaly_score']:.2f}")
-                
-                # Group events by user for UEBA
-                user_events = {}
-                for hit in hits:
-                    event = hit['_source']
-                    username = event.get('username', 'unknown')
-                    if username not in user_events:
-                        user_events[username] = []
-                    user_events[username].append(event)
-                
-                # Analyze user behavior
-                for username, events in user_events.items():
-                    if len(events) >= 3:  # Only analyze users with sufficient data
-                        behavior_analysis = self.analyze_behavioral_patterns(events)
-                        
-                        if behavior_analysis['risk_level'] in ['HIGH', 'CRITICAL']:
-                            alert = {
-                                '@timestamp': datetime.utcnow().isoformat(),
-                                'alert_type': 'UEBA_RISK',
-                                'username': username,
-                                'analysis': behavior_analysis,
-                                'event_count': len(events)
-                            }
-                            self.es.index(index='ueba-alerts', document=alert)
-                            logger.warning(f"UEBA Risk: {username} - {behavior_analysis['risk_level']}")
-                
-                logger.info(f"Analysis complete. Threats detected: {threats_detected}")
+                events_processed, threats_detected = self.poll_once()
+                logger.info(f"Analysis complete. Events: {events_processed}, threats detected: {threats_detected}, "
+                            f"late events so far: {self.consumer.stats['late_events']}")
+                if self.drift_monitor.scores:
+                    logger.info(f"Feature drift vs model {self.drift_monitor.reference_version}: " + ', '.join(
+                        f"{name} {score:.3f}" for name, score in self.drift_monitor.scores.items()))
+                if self.score_cache is not None:
+                    logger.info(f"Score cache: {len(self.score_cache.entries)} entries, "
+                                f"hit rate {self.score_cache.hit_rate():.1%}, {self.score_cache.stats}")
                 
             except Exception as e:
                 logger.error(f"Error processing events: {str(e)}")
                 
             # Sleep before next iteration
-            time.sleep(60)
+            time.sleep(self.poll_interval)
             
-    def calculate_severity(self, score):
+    async def run_async_pipeline(self, es=None):
+        """Pipelined fetch/score/write loop on the async Elasticsearch client"""
+        # Only the async mode needs aiohttp
+        from elasticsearch import AsyncElasticsearch
+        from async_pipeline import AsyncDetectionPipeline
+        
+        es = es if es is not None else AsyncElasticsearch([self.es_url])
+        pipeline = AsyncDetectionPipeline(self, es)
+        try:
+            await pipeline.run()
+        finally:
+            pipeline.close()
+            await es.close()
+            
+    def poll_once(self):
+        """Drain everything past the checkpoint; returns (events_processed, threats_detected)"""
+        events_processed = 0
+        threats_detected = 0
+        for hits in self.consumer.poll():
+            events = [hit['_source'] for hit in hits]
+            event_ids = [hit['_id'] for hit in hits]
+            logger.info(f"Processing {len(events)} events...")
+            
+            # add() and the background flusher also flush, so count failures across the whole page
+            failed_before = self.alert_writer.stats['failed']
+            threats_detected += self.process_batch(events, event_ids)
+            
+            # Alerts and UEBA state must be durable before the checkpoint moves past their events.
+            # A re-read page is not folded into UEBA state again and overwrites its alerts by id
+            self.alert_writer.flush()
+            failed = self.alert_writer.stats['failed'] - failed_before
+            if failed:
+                raise RuntimeError(f"{failed} alerts failed to index; the page will be re-read from the last checkpoint")
+            self.user_state.flush()
+            self.consumer.commit()
+            self.committed(event_ids)
+            events_processed += len(events)
+            
+        return events_processed, threats_detected
+        
+    @staticmethod
+    def calculate_severity(score):
         """Calculate severity level based on anomaly score"""
         if score > 0.7:
             return 'CRITICAL'
@@ -209,6 +516,46 @@ class ThreatDetector:
         else:
             return 'LOW'
 
+def handle_sigterm(signum, frame):
+    """Turn docker stop into a clean shutdown so buffered alerts are flushed"""
+    raise SystemExit(0)
+
 if __name__ == '__main__':
-    detector = ThreatDetector()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='AI-driven threat detection service')
+    parser.add_argument('--async-pipeline', action='store_true',
+                        help='Overlap fetching, scoring and alert writes on the async Elasticsearch client')
+    parser.add_argument('--api-port', type=int, help='Serve the micro-batching scoring API on this port')
+    parser.add_argument('--score-cache-size', type=int, default=0,
+                        help='Memoize up to this many feature-vector scores (default: 0, disabled)')
+    parser.add_argument('--score-quantization', nargs='*', metavar='FEATURE=STEP',
+                        help='Round features to multiples of STEP before cache lookup, e.g. byte_count=1000')
+    parser.add_argument('--segment-by', help='Route events to per-segment models keyed on this field, e.g. department')
+    parser.add_argument('--segment-cache-size', type=int, default=16,
+                        help='Segment models kept loaded (default: 16)')
+    parser.add_argument('--allowed-lateness', type=float, default=300,
+                        help='Seconds an event may arrive behind the newest one and still be scored (default: 300)')
+    parser.add_argument('--seed-registry', default=SEED_REGISTRY,
+                        help=f'Registry whose current model is adopted when /models is empty (default: {SEED_REGISTRY})')
+    parser.add_argument('--drift-threshold', type=float, default=0.2,
+                        help='KS distance between live and training features that triggers a retrain (default: 0.2)')
+    parser.add_argument('--drift-window', type=int, default=50000,
+                        help='Events per drift measurement window (default: 50000)')
+    parser.add_argument('--write-seed', metavar='REGISTRY_DIR',
+                        help='Train the synthetic baseline into REGISTRY_DIR and exit (run at image build time)')
+    
+    args = parser.parse_args()
+    if args.write_seed:
+        logger.info(f"Seed model version {train_synthetic_model(ModelRegistry(args.write_seed))} "
+                    f"written to {args.write_seed}")
+        raise SystemExit(0)
+        
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    detector = ThreatDetector(async_pipeline=args.async_pipeline, api_port=args.api_port,
+                              score_cache_size=args.score_cache_size,
+                              score_quantization=parse_quantization(args.score_quantization),
+                              segment_by=args.segment_by, segment_cache_size=args.segment_cache_size,
+                              allowed_lateness=args.allowed_lateness, seed_registry=args.seed_registry,
+                              drift_threshold=args.drift_threshold, drift_window=args.drift_window)
     detector.process_events()
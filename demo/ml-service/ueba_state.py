@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Persistent UEBA State Store
+Per-user behavioral state kept in a memory-mapped open-addressing table,
+with a bounded in-memory LRU of hot users that spills back to disk
+"""
+
+import os
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from ueba_batch import factorize, event_times
+
+logger = logging.getLogger(__name__)
+
+# Hours treated as off-hours by the UEBA score (hour > 22 or hour < 6)
+OFF_HOURS = [23, 0, 1, 2, 3, 4, 5]
+
+# HyperLogLog registers per distinct-source-IP sketch. 64 registers give a
+# standard error of 1.04 / sqrt(64) = 13% on large counts; below 2.5 * 64
+# distinct IPs the estimate switches to linear counting over empty
+# registers, which gives the exact count for most users with up to 5 IPs
+# (benchmarks/bench_ueba_distinct.py)
+HLL_PRECISION = 6
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_ALPHA = 0.709
+
+# Distinct source-IP horizons in seconds; each keeps a current and a previous
+# generation, so a count covers between one and two horizons of event time
+IP_HORIZONS = [('1h', 3600), ('24h', 86400), ('30d', 30 * 86400)]
+
+USER_STATE_DTYPE = np.dtype([
+    ('key', '<u8'),                             # 64-bit username hash, 0 = empty slot
+    ('last_ts', '<f8'),                         # newest event time seen (epoch seconds)
+    ('weight', '<f4'),                          # time-decayed event count
+    ('failed_sum', '<f4'),                      # time-decayed sum of failed_logins
+    ('event_count', '<u4'),                     # lifetime events
+    ('risk_level', 'u1'),                       # last alerted level, index into RISK_LEVELS
+    ('hours', '<f4', (24,)),                    # time-decayed hour-of-day histogram
+    ('ip_hll', 'u1', (len(IP_HORIZONS), 2, HLL_REGISTERS)),  # source-IP HLLs per horizon: current, previous
+    ('ip_window', '<i8', (len(IP_HORIZONS),)),  # window number of each horizon's current generation
+    ('route', '<u4')                            # java_string_hash(username), for re-sharding
+])
+
+# Bumped whenever USER_STATE_DTYPE changes; older tables are set aside, not misread
+USER_STATE_LAYOUT = 3
+
+RISK_LEVELS = ['LOW', 'MEDIUM', 'HIGH', 'CRITICAL']
+
+
+def username_key(username):
+    """Stable non-zero 64-bit key for a username"""
+    digest = hashlib.blake2b(username.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def java_string_hash(value):
+    """Java's String.hashCode() as an unsigned 32-bit int (what painless computes)"""
+    data = value.encode('utf-16-be')
+    h = 0
+    for i in range(0, len(data), 2):
+        h = (31 * h + ((data[i] << 8) | data[i + 1])) & 0xFFFFFFFF
+    return h
+
+
+def bit_lengths(values):
+    """int.bit_length() of each uint64, exact (float64 alone would round above 2**53)"""
+    values = np.asarray(values, dtype=np.uint64)
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+def hll_positions(values):
+    """(register, rank) of each value's 64-bit hash"""
+    # pandas' vectorized SipHash with its fixed default key: stable across processes
+    import pandas as pd
+
+    hashes = pd.util.hash_array(np.asarray(values, dtype=object))
+    low_bits = 64 - HLL_PRECISION
+    registers = (hashes >> np.uint64(low_bits)).astype(np.int64)
+    # Position of the first 1-bit in the remaining bits
+    ranks = low_bits - bit_lengths(hashes & np.uint64((1 << low_bits) - 1)) + 1
+    return registers, ranks.astype(np.uint8)
+
+
+def hll_estimates(registers):
+    """Distinct-count estimates from (..., HLL_REGISTERS) register arrays"""
+    registers = np.asarray(registers)
+    raw = HLL_ALPHA * HLL_REGISTERS ** 2 / np.sum(np.exp2(-registers.astype(np.float64)), axis=-1)
+    zeros = (registers == 0).sum(axis=-1)
+    linear = HLL_REGISTERS * np.log(HLL_REGISTERS / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * HLL_REGISTERS) & (zeros > 0), linear, raw)
+
+
+def shift_generations(sketches, shift):
+    """Age (..., 2, registers) current/previous sketches forward by `shift` (...) windows"""
+    if not shift.any():
+        return sketches
+    aged = sketches.copy()
+    # Only sketches that moved are rewritten: one window on keeps current as previous
+    moved = np.nonzero(shift)
+    aged[moved + (1,)] = np.where((shift[moved] == 1)[:, None], sketches[moved + (0,)], 0)
+    aged[moved + (0,)] = 0
+    return aged
+
+
+def combine_records(stored, incoming, half_life):
+    """Merge two state records per user, e.g. a batch into stored state or one shard's user into another's
+
+    Decayed counters are brought to the newer of the two times and added,
+    lifetime counts add up, and each HLL horizon is aligned to the newer
+    window before taking register-wise maxima, so the result equals having
+    seen both event streams in one store.
+    """
+    merged = stored.copy()
+    last = stored['last_ts']
+    newest = incoming['last_ts']
+
+    # Decay stored state up to the incoming one, or discount incoming state that is older
+    stored_decay = 2.0 ** (-np.maximum(newest - last, 0.0) / half_life)
+    stored_decay[stored['event_count'] == 0] = 0.0
+    incoming_scale = 2.0 ** (-np.maximum(last - newest, 0.0) / half_life)
+
+    merged['weight'] = stored['weight'] * stored_decay + incoming['weight'] * incoming_scale
+    merged['failed_sum'] = stored['failed_sum'] * stored_decay + incoming['failed_sum'] * incoming_scale
+    merged['hours'] = stored['hours'] * stored_decay[:, None] + incoming['hours'] * incoming_scale[:, None]
+    merged['last_ts'] = np.maximum(last, newest)
+    merged['event_count'] = stored['event_count'] + incoming['event_count']
+    merged['risk_level'] = np.maximum(stored['risk_level'], incoming['risk_level'])
+
+    # Align each horizon to the newer window, then take register-wise maxima
+    target = np.maximum(stored['ip_window'], incoming['ip_window'])
+    merged['ip_hll'] = np.maximum(
+        shift_generations(stored['ip_hll'], target - stored['ip_window']),
+        shift_generations(incoming['ip_hll'], target - incoming['ip_window'])
+    )
+    merged['ip_window'] = target
+    return merged
+
+
+class UserStateStore:
+    """O(1)-per-event behavioral state for millions of users in bounded RAM
+
+    Counters decay exponentially with `half_life` seconds of event time, so
+    scores describe recent behavior without storing events. Distinct source
+    IPs are counted with HyperLogLog sketches for each of IP_HORIZONS, in
+    two rotating generations per horizon; the score uses the shortest one.
+    """
+
+    def __init__(self, path, capacity=1 << 16, hot_size=100000, half_life=3600.0):
+        self.path = path
+        self.meta_path = f"{path}.json"
+        self.hot_size = hot_size
+        self.half_life = float(half_life)
+        self.horizon_seconds = np.array([seconds for _, seconds in IP_HORIZONS], dtype=np.float64)
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        meta = None
+        if os.path.exists(self.meta_path) and os.path.exists(path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if meta.get('layout', 1) != USER_STATE_LAYOUT:
+                logger.warning(f"UEBA state {path} has an old layout, moving it aside and starting fresh")
+                os.replace(path, f"{path}.v{meta.get('layout', 1)}")
+                meta = None
+
+        if meta is not None:
+            self.capacity = meta['capacity']
+            self.occupied = meta['occupied']
+            self.table = np.memmap(path, dtype=USER_STATE_DTYPE, mode='r+', shape=(self.capacity,))
+            logger.info(f"Loaded UEBA state for {self.occupied} users from {path}")
+        else:
+            self.capacity = capacity
+            self.occupied = 0
+            self.table = self.create_table(path, capacity)
+
+        # Hot users: key -> row in self.hot, most recently used last
+        self.hot = np.zeros(hot_size, dtype=USER_STATE_DTYPE)
+        self.hot_index = OrderedDict()
+        self.free_rows = list(range(hot_size - 1, -1, -1))
+        # Hot rows changed since they were last written to the table
+        self.dirty = set()
+
+    def create_table(self, path, capacity):
+        """Allocate an empty zero-filled table file"""
+        table = np.memmap(path, dtype=USER_STATE_DTYPE, mode='w+', shape=(capacity,))
+        table.flush()
+        return table
+
+    def find_slot(self, key):
+        """Linear-probe for key; returns (slot, found)"""
+        mask = self.capacity - 1
+        slot = key & mask
+        keys = self.table['key']
+        while True:
+            current = int(keys[slot])
+            if current == key:
+                return slot, True
+            if current == 0:
+                return slot, False
+            slot = (slot + 1) & mask
+
+    def spill(self, row):
+        """Write a hot row back into the on-disk table"""
+        self.dirty.discard(row)
+        record = self.hot[row]
+        slot, found = self.find_slot(int(record['key']))
+        if not found:
+            self.occupied += 1
+        self.table[slot] = record
+        if self.occupied > 0.7 * self.capacity:
+            self.grow()
+
+    def grow(self):
+        """Double the table and reinsert every occupied slot"""
+        old_table = self.table
+        new_capacity = self.capacity * 2
+        tmp_path = f"{self.path}.grow"
+        new_table = self.create_table(tmp_path, new_capacity)
+
+        # Rehash in bounded chunks so growth never loads the whole table
+        mask = new_capacity - 1
+        for start in range(0, self.capacity, 65536):
+            chunk = np.array(old_table[start:start + 65536])
+            for record in chunk[chunk['key'] != 0]:
+                slot = int(record['key']) & mask
+                while new_table['key'][slot] != 0:
+                    slot = (slot + 1) & mask
+                new_table[slot] = record
+
+        new_table.flush()
+        del old_table
+        os.replace(tmp_path, self.path)
+        self.table = np.memmap(self.path, dtype=USER_STATE_DTYPE, mode='r+', shape=(new_capacity,))
+        self.capacity = new_capacity
+        self.write_meta()
+        logger.info(f"Grew UEBA state table to {new_capacity} slots")
+
+    def iter_records(self, chunk_rows=65536):
+        """Occupied records of the on-disk table, in bounded chunks (call flush() first)"""
+        for start in range(0, self.capacity, chunk_rows):
+            chunk = np.array(self.table[start:start + chunk_rows])
+            yield chunk[chunk['key'] != 0]
+
+    def insert_records(self, records):
+        """Write whole records straight into the table of a store that is not serving yet
+
+        A user already present (one whose events reached several shards,
+        such as 'unknown') is merged with combine_records, not overwritten.
+        """
+        for record in records:
+            slot, found = self.find_slot(int(record['key']))
+            if found:
+                record = combine_records(self.table[slot:slot + 1], record[None], self.half_life)[0]
+            else:
+                self.occupied += 1
+            self.table[slot] = record
+            if self.occupied > 0.7 * self.capacity:
+                self.grow()
+
+    def hot_row(self, username):
+        """Row in self.hot for a user, loading from disk or evicting as needed"""
+        key = username_key(username)
+        row = self.hot_index.get(key)
+        if row is not None:
+            self.hot_index.move_to_end(key)
+            return row
+
+        if self.free_rows:
+            row = self.free_rows.pop()
+        else:
+            _, row = self.hot_index.popitem(last=False)
+            if row in self.dirty:
+                self.spill(row)
+
+        slot, found = self.find_slot(key)
+        if found:
+            self.hot[row] = self.table[slot]
+        else:
+            self.hot[row] = np.zeros((), dtype=USER_STATE_DTYPE)
+            self.hot[row]['key'] = key
+            self.hot[row]['route'] = java_string_hash(username)
+
+        self.hot_index[key] = row
+        return row
+
+    def hot_rows(self, usernames):
+        """Hot rows for up to hot_size users; none of them evicts another"""
+        return np.array([self.hot_row(username) for username in usernames], dtype=np.intp)
+
+    def update(self, username, event):
+        """Fold one event into a user's state"""
+        self.update_batch([event], [username])
+
+    def update_batch(self, events, usernames=None):
+        """Fold a batch of events into per-user state, O(1) work per event
+
+        Events are reduced per user with columnar NumPy operations first, so
+        the per-user merge into stored state runs once per user, not per event.
+        Exponential decay is linear, so this equals folding events one by one,
+        and a batch of late events folded after newer ones leaves the same
+        state as folding everything in event-time order.
+        """
+        if not events:
+            return
+        if usernames is None:
+            usernames = [event.get('username', 'unknown') for event in events]
+
+        count = len(events)
+        user_codes, users = factorize(usernames)
+        n_users = len(users)
+        ts = event_times(events)
+        failed = np.fromiter((event.get('failed_logins', 0) for event in events), dtype=np.float64, count=count)
+
+        hours = np.fromiter(
+            (-1 if event.get('hour') is None else event.get('hour') for event in events),
+            dtype=np.int64,
+            count=count
+        )
+        missing = hours < 0
+        hours[missing] = (ts[missing] // 3600 % 24).astype(np.int64)
+        hours %= 24
+
+        ip_codes, ips = factorize([str(event.get('source_ip', '')) for event in events])
+        register_of, rank_of = hll_positions(ips)
+        registers = register_of[ip_codes]
+        ranks = rank_of[ip_codes]
+
+        # Newest event per user is the batch's reference time for decay
+        order = np.argsort(user_codes, kind='stable')
+        starts = np.searchsorted(user_codes[order], np.arange(n_users))
+        newest = np.maximum.reduceat(ts[order], starts)
+
+        weights = 2.0 ** (-(newest[user_codes] - ts) / self.half_life)
+        batch_weight = np.bincount(user_codes, weights=weights, minlength=n_users)
+        batch_failed = np.bincount(user_codes, weights=weights * failed, minlength=n_users)
+        batch_hours = np.bincount(user_codes * 24 + hours, weights=weights, minlength=n_users * 24).reshape(n_users, 24)
+        batch_counts = np.bincount(user_codes, minlength=n_users)
+
+        # IP sketches relative to each user's newest window per horizon; older windows are dropped
+        batch_window = (newest[:, None] // self.horizon_seconds).astype(np.int64)
+        batch_hll = np.zeros((n_users, len(IP_HORIZONS), 2, HLL_REGISTERS), dtype=np.uint8)
+        for horizon, seconds in enumerate(self.horizon_seconds):
+            generation = batch_window[user_codes, horizon] - (ts // seconds).astype(np.int64)
+            keep = generation <= 1
+            np.maximum.at(batch_hll, (user_codes[keep], horizon, generation[keep], registers[keep]), ranks[keep])
+
+        for start in range(0, n_users, self.hot_size):
+            chunk = slice(start, start + self.hot_size)
+            self.merge(
+                self.hot_rows(users[chunk]), newest[chunk], batch_weight[chunk], batch_failed[chunk],
+                batch_hours[chunk], batch_counts[chunk], batch_hll[chunk], batch_window[chunk]
+            )
+
+    def merge(self, rows, newest, weight, failed, hours, counts, hll, window):
+        """Merge per-user batch aggregates into hot rows"""
+        batch = np.zeros(len(rows), dtype=USER_STATE_DTYPE)
+        batch['last_ts'] = newest
+        batch['weight'] = weight
+        batch['failed_sum'] = failed
+        batch['hours'] = hours
+        batch['event_count'] = counts
+        batch['ip_hll'] = hll
+        batch['ip_window'] = window
+        self.hot[rows] = combine_records(self.hot[rows], batch, self.half_life)
+        self.dirty.update(rows.tolist())
+
+    def distinct_ips(self, rows):
+        """(n, len(IP_HORIZONS)) distinct source-IP estimates for hot rows, both generations per horizon"""
+        return hll_estimates(self.hot['ip_hll'][rows].max(axis=2))
+
+    def assess(self, username):
+        """UEBA analysis from stored state, same shape as analyze_behavioral_patterns"""
+        return self.assess_batch([username])[0][1]
+
+    def assess_batch(self, usernames):
+        """Score users from stored state
+
+        Returns [(username, analysis, event_count, escalated)] where escalated
+        is True when the user's level rose into HIGH or CRITICAL since the
+        last assessment.
+        """
+        results = []
+        for start in range(0, len(usernames), self.hot_size):
+            chunk = usernames[start:start + self.hot_size]
+            rows = self.hot_rows(chunk)
+            hot = self.hot
+
+            weight = hot['weight'][rows].astype(np.float64)
+            avg_failed_logins = hot['failed_sum'][rows] / np.maximum(weight, 1e-12)
+            unusual_hours = hot['hours'][rows][:, OFF_HOURS].sum(axis=1)
+            distinct_ips = self.distinct_ips(rows)
+            unique_locations = distinct_ips[:, 0]
+            scores = (avg_failed_logins * 10) + (unusual_hours * 5) + (unique_locations * 3)
+
+            sufficient = weight >= 5
+            levels = np.where(sufficient, (scores > 15).astype(np.uint8) + (scores > 30) + (scores > 50), 0)
+            escalated = (levels > hot['risk_level'][rows]) & (levels >= RISK_LEVELS.index('HIGH'))
+            self.dirty.update(rows[levels != hot['risk_level'][rows]].tolist())
+            hot['risk_level'][rows] = levels
+            event_counts = hot['event_count'][rows]
+
+            for i, username in enumerate(chunk):
+                if not sufficient[i]:
+                    analysis = {'risk_level': 'LOW', 'behavioral_score': 0}
+                else:
+                    analysis = {
+                        'risk_level': RISK_LEVELS[levels[i]],
+                        'behavioral_score': float(scores[i]),
+                        'metrics': {
+                            'avg_failed_logins': float(avg_failed_logins[i]),
+                            'unusual_hours_count': int(round(unusual_hours[i])),
+                            'unique_locations': int(round(unique_locations[i])),
+                            **{
+                                f'unique_locations_{name}': int(round(distinct_ips[i, horizon]))
+                                for horizon, (name, _) in enumerate(IP_HORIZONS)
+                            }
+                        }
+                    }
+                results.append((username, analysis, int(event_counts[i]), bool(escalated[i])))
+        return results
+
+    def write_meta(self):
+        """Persist table geometry next to the data file"""
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'capacity': self.capacity,
+                'occupied': self.occupied,
+                'half_life': self.half_life,
+                'layout': USER_STATE_LAYOUT
+            }, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def flush(self):
+        """Spill the hot rows changed since the last flush and sync the table to disk
+
+        Rows that were only read stay as they are on disk, so a flush after
+        every page costs O(users touched by the page), not O(hot_size).
+        """
+        for row in sorted(self.dirty):
+            self.spill(row)
+        self.table.flush()
+        self.write_meta()
+
+    def close(self):
+        """Flush and release the memory map"""
+        self.flush()
+        del self.table
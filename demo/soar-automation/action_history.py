@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Bounded Action History
+Keeps the most recent SOAR action results as fixed-size records in a
+ring buffer for in-memory queries, spilling older records to an
+append-only, zlib-compressed segment log that can be read back by time
+range
+"""
+
+import os
+import json
+import time
+import zlib
+import struct
+import socket
+import logging
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ACTION_RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),   # epoch seconds the action finished
+    ('source_ip', '<u4'),   # IPv4 address as an integer, 0 when absent or not IPv4
+    ('action', '<u2'),      # index into the name vocabulary
+    ('alert_type', '<u2'),  # index into the name vocabulary, 0 when absent
+    ('status', '<u2')       # index into the name vocabulary
+])
+
+# Segment frame: magic, record count, compressed length, first and last timestamp
+SEGMENT_HEADER = struct.Struct('<4sIIdd')
+SEGMENT_MAGIC = b'SAH1'
+
+# Names past this many are recorded as '' rather than growing the vocabulary forever
+MAX_NAMES = 65535
+
+
+def ip_to_int(address):
+    try:
+        return int.from_bytes(socket.inet_aton(address), 'big') if address else 0
+    except (OSError, TypeError):
+        return 0
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(int(value).to_bytes(4, 'big')) if value else None
+
+
+def epoch_seconds(value):
+    """Epoch seconds from a number or a datetime (naive datetimes are UTC, like datetime.utcnow())"""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+class ActionHistory:
+    """Fixed-capacity ring of compact action records plus a compressed spill log
+
+    A record is 18 bytes: the time, source IP and interned action, alert
+    type and status; the alert context itself is not kept (it is already
+    in soar-actions). When the ring is full its oldest `spill_size`
+    records are compressed into one segment and appended to the log, so
+    memory stays at capacity * 18 bytes however long the engine runs.
+    Segment headers carry their time span, letting read_range() skip
+    segments without decompressing them. Interned names live in a JSON
+    file next to the log, written before any segment that uses them.
+    """
+
+    def __init__(self, log_path='/var/lib/soar/action-history.log', capacity=100000, spill_size=None,
+                 compression_level=6):
+        self.log_path = log_path
+        self.vocab_path = f"{log_path}.vocab.json"
+        self.capacity = capacity
+        self.spill_size = spill_size or max(1, capacity // 8)
+        self.compression_level = compression_level
+
+        self.ring = np.zeros(capacity, dtype=ACTION_RECORD_DTYPE)
+        self.start = 0
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.names = ['']
+        self.codes = {'': 0}
+        self.saved_names = 1
+        self.segments = []
+        self.stats = {'recorded': 0, 'spilled': 0, 'segments': 0, 'log_bytes': 0}
+        self.load()
+
+    def load(self):
+        """Restore the vocabulary and index the log, cutting off a segment torn by a crash"""
+        if os.path.exists(self.vocab_path):
+            with open(self.vocab_path) as f:
+                self.names = json.load(f)
+            self.codes = {name: code for code, name in enumerate(self.names)}
+            self.saved_names = len(self.names)
+        if not os.path.exists(self.log_path):
+            return
+
+        size = os.path.getsize(self.log_path)
+        offset = 0
+        with open(self.log_path, 'rb') as f:
+            while offset + SEGMENT_HEADER.size <= size:
+                magic, count, length, first, last = SEGMENT_HEADER.unpack(f.read(SEGMENT_HEADER.size))
+                if magic != SEGMENT_MAGIC or offset + SEGMENT_HEADER.size + length > size:
+                    break
+                self.segments.append((offset, count, length, first, last))
+                offset += SEGMENT_HEADER.size + length
+                f.seek(offset)
+        if offset < size:
+            logger.warning(f"Truncating {size - offset} bytes of incomplete segment from {self.log_path}")
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(offset)
+        self.stats['segments'] = len(self.segments)
+        self.stats['log_bytes'] = offset
+
+    def code(self, name):
+        name = name or ''
+        code = self.codes.get(name)
+        if code is None:
+            if len(self.names) >= MAX_NAMES:
+                return 0
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def record(self, action_result, timestamp=None):
+        """Add one execute_action result, stamped now unless `timestamp` (epoch seconds) is given"""
+        context = action_result.get('context') or {}
+        with self.lock:
+            if self.size == self.capacity:
+                self.spill(self.spill_size)
+            self.ring[(self.start + self.size) % self.capacity] = (
+                time.time() if timestamp is None else timestamp,
+                ip_to_int(context.get('source_ip')),
+                self.code(action_result.get('action')),
+                self.code(context.get('alert_type')),
+                self.code(action_result.get('status'))
+            )
+            self.size += 1
+            self.stats['recorded'] += 1
+
+    def ordered(self):
+        """Ring positions oldest first"""
+        return (self.start + np.arange(self.size)) % self.capacity
+
+    def spill(self, count):
+        """Move the oldest `count` records from the ring to a new log segment; caller holds the lock"""
+        count = min(count, self.size)
+        if not count:
+            return
+        records = self.ring[self.ordered()[:count]]
+        if len(self.names) > self.saved_names:
+            self.save_names()
+
+        payload = zlib.compress(records.tobytes(), self.compression_level)
+        header = SEGMENT_HEADER.pack(SEGMENT_MAGIC, count, len(payload), float(records['timestamp'].min()),
+                                     float(records['timestamp'].max()))
+        os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+        with open(self.log_path, 'ab') as f:
+            offset = f.tell()
+            f.write(header + payload)
+        self.segments.append((offset, count, len(payload), *SEGMENT_HEADER.unpack(header)[3:]))
+
+        self.start = (self.start + count) % self.capacity
+        self.size -= count
+        self.stats['spilled'] += count
+        self.stats['segments'] += 1
+        self.stats['log_bytes'] += len(header) + len(payload)
+
+    def save_names(self):
+        # Write-then-rename so a crash never leaves a truncated vocabulary
+        tmp_path = f"{self.vocab_path}.tmp"
+        os.makedirs(os.path.dirname(self.vocab_path) or '.', exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.names, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.vocab_path)
+        self.saved_names = len(self.names)
+
+    def describe(self, records):
+        """Records as dicts, in the order given"""
+        names = np.array(self.names, dtype=object)
+        timestamps = np.datetime_as_string((records['timestamp'] * 1e6).astype('datetime64[us]'))
+        # Few distinct addresses per read, so format each once
+        addresses, inverse = np.unique(records['source_ip'], return_inverse=True)
+        addresses = np.array([int_to_ip(address) for address in addresses], dtype=object)[inverse]
+        return [{
+            'timestamp': timestamp,
+            'action': action,
+            'status': status,
+            'alert_type': alert_type or None,
+            'source_ip': address
+        } for timestamp, action, status, alert_type, address in zip(
+            timestamps.tolist(), names[records['action']].tolist(), names[records['status']].tolist(),
+            names[records['alert_type']].tolist(), addresses.tolist())]
+
+    def matching(self, records, source_ip=None, action=None):
+        mask = np.ones(len(records), dtype=bool)
+        if source_ip is not None:
+            mask &= records['source_ip'] == ip_to_int(source_ip)
+        if action is not None:
+            mask &= records['action'] == self.codes.get(action, -1)
+        return records[mask]
+
+    def recent(self, limit=20, source_ip=None, action=None):
+        """Newest in-memory records first, optionally for one source IP and/or action"""
+        with self.lock:
+            records = self.ring[self.ordered()[::-1]]
+        return self.describe(self.matching(records, source_ip, action)[:limit])
+
+    def read_range(self, start, end, source_ip=None, action=None):
+        """Records with start <= timestamp < end from the log and the ring, oldest first"""
+        start, end = epoch_seconds(start), epoch_seconds(end)
+        with self.lock:
+            segments = [segment for segment in self.segments if segment[4] >= start and segment[3] < end]
+            live = self.ring[self.ordered()]
+
+        parts = []
+        if segments:
+            with open(self.log_path, 'rb') as f:
+                for offset, count, length, _, _ in segments:
+                    f.seek(offset + SEGMENT_HEADER.size)
+                    parts.append(np.frombuffer(zlib.decompress(f.read(length)), dtype=ACTION_RECORD_DTYPE))
+        parts.append(live)
+
+        records = np.concatenate(parts)
+        records = records[(records['timestamp'] >= start) & (records['timestamp'] < end)]
+        # Concurrent actions finish out of order, so order by time rather than by position
+        records = records[np.argsort(records['timestamp'], kind='stable')]
+        return self.describe(self.matching(records, source_ip, action))
+
+    def __len__(self):
+        return self.size
+
+    def nbytes(self):
+        """Memory held by the ring"""
+        return self.ring.nbytes
+
+    def close(self):
+        """Spill everything still in memory so the log holds the full history"""
+        with self.lock:
+            self.spill(self.size)
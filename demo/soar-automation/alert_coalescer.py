@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Alert Coalescer
+Groups matched alerts by playbook plus a per-playbook key (source IP,
+username or hostname) so one playbook run answers every alert for the
+same key within a time window
+"""
+
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEVERITY_ORDER = ['LOW', 'MEDIUM', 'HIGH', 'CRITICAL']
+
+# Other identifying fields summarized across a group's alerts
+SUMMARY_FIELDS = ['source_ip', 'username', 'hostname']
+
+# Cap on alert ids and distinct values copied into the aggregated context
+MAX_LISTED = 20
+
+
+def aggregate_context(alerts, members, group_id):
+    """One playbook context for a group: its last alert plus what the whole group adds up to"""
+    context = dict(alerts[-1])
+    timestamps = [alert['@timestamp'] for alert in alerts if alert.get('@timestamp') is not None]
+    severities = [alert.get('severity') for alert in alerts if alert.get('severity') in SEVERITY_ORDER]
+    context.update({
+        'coalesce_group': group_id,
+        'coalesced_alerts': len(alerts),
+        'coalesced_alert_ids': [f"{index}/{alert_id}" for index, alert_id in members[:MAX_LISTED]],
+        'coalesced_values': {
+            field: sorted({str(alert[field]) for alert in alerts if alert.get(field) is not None})[:MAX_LISTED]
+            for field in SUMMARY_FIELDS
+        }
+    })
+    if severities:
+        context['severity'] = max(severities, key=SEVERITY_ORDER.index)
+    try:
+        context['first_seen'], context['last_seen'] = min(timestamps), max(timestamps)
+    except (TypeError, ValueError):
+        # Mixed or missing timestamp types: leave the span out rather than guess
+        pass
+    return context
+
+
+class AlertCoalescer:
+    """Suppresses repeat playbook runs for the same (playbook, key) within `window` seconds
+
+    The first alerts for a key open a window and run the playbook once
+    with an aggregated context; alerts for that key arriving before the
+    window closes, in the same poll or later ones, are marked processed
+    against the same group without running anything. Alerts missing
+    every key field are never coalesced. Windows live in memory, so a
+    restart can cost one extra run per active key.
+    """
+
+    def __init__(self, window=300.0, key_fields=None, default_key=('source_ip',)):
+        self.window = window
+        # playbook name -> alert fields that identify "the same incident"
+        self.key_fields = dict(key_fields or {})
+        self.default_key = tuple(default_key)
+        self.windows = {}
+        self.stats = {'alerts': 0, 'runs': 0, 'coalesced': 0, 'suppressed': 0}
+
+    def key(self, playbook_name, alert):
+        fields = self.key_fields.get(playbook_name, self.default_key)
+        values = tuple(alert.get(field) for field in fields)
+        if all(value is None for value in values):
+            return None
+        return (playbook_name,) + values
+
+    def expire(self, now):
+        for key in [key for key, (opened, _) in self.windows.items() if now - opened >= self.window]:
+            del self.windows[key]
+
+    def release(self, group_id):
+        """Close a group's window after its run failed, so the retried alerts run again instead of being suppressed"""
+        for key in [key for key, (_, window_group) in self.windows.items() if window_group == group_id]:
+            del self.windows[key]
+
+    def group(self, matched, now=None):
+        """Split one poll's (index, alert_id, playbook_name, alert) tuples into runs and suppressed groups
+
+        Returns (runs, suppressed): runs are (playbook_name, context,
+        members, group_id) to execute, suppressed are (playbook_name,
+        members, group_id) whose key already ran within the window.
+        members are (index, alert_id) pairs; group_id is None for an
+        alert run on its own.
+        """
+        now = time.time() if now is None else now
+        self.expire(now)
+        self.stats['alerts'] += len(matched)
+
+        groups = {}
+        runs = []
+        for index, alert_id, playbook_name, alert in matched:
+            key = self.key(playbook_name, alert) if self.window > 0 else None
+            if key is None:
+                runs.append((playbook_name, alert, [(index, alert_id)], None))
+                continue
+            groups.setdefault(key, []).append((index, alert_id, alert))
+
+        suppressed = []
+        for key, entries in groups.items():
+            playbook_name = key[0]
+            members = [(index, alert_id) for index, alert_id, _ in entries]
+            if key in self.windows:
+                suppressed.append((playbook_name, members, self.windows[key][1]))
+                self.stats['suppressed'] += len(members)
+                continue
+
+            group_id = uuid.uuid4().hex[:16]
+            self.windows[key] = (now, group_id)
+            alerts = [alert for _, _, alert in entries]
+            runs.append((playbook_name, aggregate_context(alerts, members, group_id), members, group_id))
+            self.stats['coalesced'] += len(members) - 1
+
+        self.stats['runs'] += len(runs)
+        if suppressed or len(runs) < len(matched):
+            logger.info(f"Coalesced {len(matched)} alerts into {len(runs)} playbook runs "
+                        f"({sum(len(members) for _, members, _ in suppressed)} suppressed by open windows)")
+        return runs, suppressed
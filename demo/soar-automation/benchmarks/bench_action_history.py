@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Action History Benchmark
+Records millions of SOAR action results into the bounded ring + spill
+log and compares resident memory with the old list of full result dicts
+(measured on a sample and extrapolated), then times "last N actions for
+this IP" and time-range reads back from the compressed log
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from action_history import ACTION_RECORD_DTYPE, ActionHistory
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+ACTIONS = ['block_source_ip', 'notify_soc_team', 'reset_user_password', 'enable_mfa', 'create_incident_ticket',
+           'isolate_endpoint', 'kill_malicious_process', 'collect_forensic_artifacts', 'scan_network_for_spread']
+ALERT_TYPES = ['brute_force', 'malware', 'data_exfiltration', 'port_scan', 'privilege_escalation']
+
+
+def action_result(rng, ips):
+    """An execute_action result shaped like the engine's, alert context included"""
+    return {
+        'action': rng.choice(ACTIONS),
+        'timestamp': '2026-01-01T00:00:00.000000',
+        'status': 'SUCCESS',
+        'context': {
+            '@timestamp': '2026-01-01T00:00:00.000000',
+            'alert_type': rng.choice(ALERT_TYPES),
+            'source_ip': rng.choice(ips),
+            'destination_ip': rng.choice(ips),
+            'username': f'user{rng.randint(1, 5000)}',
+            'hostname': f'host-{rng.randint(1, 2000)}',
+            'severity': 'HIGH',
+            'anomaly_score': rng.random(),
+            'threat_score': rng.random(),
+            'mitre_technique': 'T1110',
+            'description': 'Anomalous authentication activity detected by the ML model',
+            'soar_processed': False
+        },
+        'details': {'blocked_ip': rng.choice(ips), 'method': 'firewall_rule', 'status': 'blocked'}
+    }
+
+
+def ip_pool(rng, count):
+    return [f'10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}' for _ in range(count)]
+
+
+def unbounded_bytes_per_action(sample, seed):
+    """Memory per action of the old `action_history` list, measured on a sample"""
+    rng = random.Random(seed)
+    ips = ip_pool(rng, 5000)
+    tracemalloc.start()
+    history = [action_result(rng, ips) for _ in range(sample)]
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del history
+    return used / sample
+
+
+def resident_bytes():
+    """Current RSS of this process (Linux)"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def run(actions, capacity, sample, span_days, seed):
+    per_action = unbounded_bytes_per_action(sample, seed)
+    logger.info(f"Unbounded list: {per_action:,.0f} bytes per action (measured on {sample:,}) -> "
+                f"{per_action * actions / 2 ** 30:,.1f} GB for {actions:,} actions")
+
+    rng = random.Random(seed)
+    ips = ip_pool(rng, 5000)
+    templates = [action_result(rng, ips) for _ in range(10000)]
+    start = time.time() - span_days * DAY
+    step = span_days * DAY / actions
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        history = ActionHistory(os.path.join(work_dir, 'action-history.log'), capacity=capacity)
+        resident = [resident_bytes()]
+        started = time.perf_counter()
+        for number in range(actions):
+            history.record(templates[number % len(templates)], timestamp=start + number * step)
+            if (number + 1) % (actions // 4) == 0:
+                resident.append(resident_bytes())
+        seconds = time.perf_counter() - started
+
+        growth = ' -> '.join(f"{(rss - resident[0]) / 2 ** 20:+.1f}" for rss in resident[1:])
+        logger.info(f"Bounded history: {actions:,} actions in {seconds:.1f}s ({actions / seconds:,.0f}/s) | ring "
+                    f"{history.nbytes() / 2 ** 20:.1f} MB ({capacity:,} x {ACTION_RECORD_DTYPE.itemsize} B) | RSS growth "
+                    f"at each quarter {growth} MB | log {history.stats['log_bytes'] / 2 ** 20:.1f} MB on disk in "
+                    f"{history.stats['segments']} segments ({history.stats['log_bytes'] / history.stats['spilled']:.2f} "
+                    f"B/action)")
+
+        target = templates[0]['context']['source_ip']
+        started = time.perf_counter()
+        recent = history.recent(limit=20, source_ip=target)
+        logger.info(f"recent(limit=20, source_ip={target}) over {len(history):,} in-memory records: "
+                    f"{len(recent)} results in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        for hours in (1, 24):
+            window_start = start + span_days * DAY / 3
+            started = time.perf_counter()
+            records = history.read_range(window_start, window_start + hours * 3600)
+            logger.info(f"read_range over {hours:>2}h from the spill log: {len(records):,} records in "
+                        f"{(time.perf_counter() - started) * 1000:.1f} ms")
+
+        history.close()
+        reopened = ActionHistory(os.path.join(work_dir, 'action-history.log'), capacity=capacity)
+        started = time.perf_counter()
+        records = reopened.read_range(start + span_days * DAY - 3600, start + span_days * DAY)
+        logger.info(f"After close and reopen: last hour has {len(records):,} records, read in "
+                    f"{(time.perf_counter() - started) * 1000:.1f} ms (newest {records[-1]['action']} "
+                    f"from {records[-1]['source_ip']})")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SOAR bounded action history benchmark')
+    parser.add_argument('--actions', type=int, default=10000000, help='Actions recorded (default: 10000000)')
+    parser.add_argument('--capacity', type=int, default=100000, help='Ring capacity (default: 100000)')
+    parser.add_argument('--sample', type=int, default=100000,
+                        help='Actions held in the unbounded list to measure its per-action cost (default: 100000)')
+    parser.add_argument('--span-days', type=float, default=30, help='Days the actions are spread over (default: 30)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    args = parser.parse_args()
+    run(args.actions, args.capacity, args.sample, args.span_days, args.seed)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Alert Coalescing Benchmark
+Drains an alert storm (most alerts from a handful of attacking IPs,
+hosts and users) through the SOAR poll loop with and without a
+coalescing window, counting playbook runs and actions executed, and
+checking that every alert ends up marked processed
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', '..', 'ml-service', 'benchmarks'))
+
+from inmemory_es import InMemoryElasticsearch
+from soar_engine import SOAREngine
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+INDEX = 'threat-alerts'
+
+
+def storm(count, attackers, hot_share, seed):
+    """Alerts where `attackers` sources produce `hot_share` of the volume; the rest are scattered"""
+    rng = random.Random(seed)
+    now = datetime.utcnow().isoformat()
+    hot = [(f'203.0.113.{i + 1}', f'victim{i}', f'host-{i}') for i in range(attackers)]
+    alerts = []
+    for _ in range(count):
+        if rng.random() < hot_share:
+            source_ip, username, hostname = rng.choice(hot)
+        else:
+            source_ip = f'10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'
+            username, hostname = f'user{rng.randint(1, 500)}', f'host-{rng.randint(100, 600)}'
+        alerts.append({
+            '@timestamp': now,
+            'alert_type': rng.choice(['brute_force', 'brute_force', 'brute_force', 'port_scan', 'malware']),
+            'source_ip': source_ip,
+            'username': username,
+            'hostname': hostname,
+            'severity': rng.choice(['MEDIUM', 'HIGH', 'CRITICAL']),
+            'soar_processed': False
+        })
+    return alerts
+
+
+def drain(alerts, window, work_dir):
+    """Poll until no unprocessed alert is left; returns (playbook runs, actions, polls, seconds, unprocessed)"""
+    es = InMemoryElasticsearch()
+    es.load(INDEX, alerts)
+    soar = SOAREngine(es=es, simulated_latency=0.0, coalesce_window=window,
+                      journal_path=os.path.join(work_dir, f'processed-{window}.journal'),
+                      spool_path=os.path.join(work_dir, f'records-{window}.spool'),
+                      history_path=os.path.join(work_dir, f'history-{window}.log'))
+
+    polls = 0
+    started = time.perf_counter()
+    while any(not doc['soar_processed'] for doc in es.data[INDEX].documents.values()) and polls < 10000:
+        soar.poll_once()
+        polls += 1
+    seconds = time.perf_counter() - started
+    soar.close()
+
+    unprocessed = sum(1 for doc in es.data[INDEX].documents.values() if not doc['soar_processed'])
+    return soar.executor.stats['playbooks'], soar.executor.stats['actions'], polls, seconds, unprocessed
+
+
+def run(count, attackers, hot_share, windows, seed):
+    for name in ('soar_engine', 'playbook_executor', 'processed_marker', 'record_writer', 'alert_coalescer',
+                 'action_history'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    alerts = storm(count, attackers, hot_share, seed)
+    with tempfile.TemporaryDirectory() as work_dir:
+        baseline = None
+        for window in windows:
+            runs, actions, polls, seconds, unprocessed = drain([dict(alert) for alert in alerts], window, work_dir)
+            baseline = baseline or actions
+            logger.info(f"{count:,} alerts, {hot_share:.0%} from {attackers} attackers, window {window:>5.0f}s | "
+                        f"{runs:>5,} playbook runs, {actions:>6,} actions ({baseline / actions:6.1f}x fewer) | {polls} polls in {seconds:.2f}s | "
+                        f"unprocessed left {unprocessed}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SOAR alert coalescing benchmark')
+    parser.add_argument('--count', type=int, default=2000, help='Alerts in the storm (default: 2000)')
+    parser.add_argument('--attackers', type=int, default=3, help='Sources producing most of the alerts (default: 3)')
+    parser.add_argument('--hot-share', type=float, default=0.9,
+                        help='Share of alerts coming from the attackers (default: 0.9)')
+    parser.add_argument('--windows', type=float, nargs='+', default=[0, 300],
+                        help='Coalescing windows to compare, 0 = off (default: 0 300)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    args = parser.parse_args()
+    run(args.count, args.attackers, args.hot_share, args.windows, args.seed)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Playbook Executor Benchmark
+Times each built-in playbook as the old priority-ordered chain and as a
+dependency graph, pushes a burst of alerts through the engine one at a
+time and under several concurrency caps, and checks that a hung action
+times out and skips only its dependents
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', '..', 'ml-service', 'benchmarks'))
+
+from inmemory_es import InMemoryElasticsearch
+from soar_engine import SOAREngine
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ALERT_TYPES = ['brute_force', 'malware', 'data_exfiltration', 'port_scan', 'privilege_escalation']
+
+
+def chained(engine):
+    """Drop every depends_on so each playbook falls back to the sequential priority chain"""
+    for playbook in engine.playbooks.values():
+        playbook['actions'] = [{key: value for key, value in action.items() if key != 'depends_on'}
+                               for action in playbook['actions']]
+
+
+def engine(latency, playbooks=4, actions=16, timeout=30.0, chain=False):
+    # Journal, spool and history files go to a scratch directory rather than /var/lib/soar
+    state_dir = tempfile.mkdtemp(prefix='soar-bench-')
+    soar = SOAREngine(es=InMemoryElasticsearch(), max_concurrent_playbooks=playbooks,
+                      max_concurrent_actions=actions, action_timeout=timeout, simulated_latency=latency,
+                      journal_path=os.path.join(state_dir, 'processed.journal'),
+                      spool_path=os.path.join(state_dir, 'records.spool'),
+                      history_path=os.path.join(state_dir, 'action-history.log'))
+    soar.state_dir = state_dir
+    if chain:
+        chained(soar)
+    return soar
+
+
+def finish(soar):
+    soar.close()
+    shutil.rmtree(soar.state_dir, ignore_errors=True)
+
+
+def alert(alert_type, rng):
+    return {
+        'alert_type': alert_type,
+        'source_ip': f'10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}',
+        'username': f'user{rng.randint(1, 500)}',
+        'hostname': f'host-{rng.randint(1, 200)}',
+        'severity': 'HIGH'
+    }
+
+
+def per_playbook(latency, seed):
+    """Wall time of each playbook, chained vs. as a graph"""
+    rng = random.Random(seed)
+    sequential, concurrent = engine(latency, chain=True), engine(latency)
+    for name, playbook in concurrent.playbooks.items():
+        context = alert(ALERT_TYPES[0], rng)
+        timings = []
+        for soar in (sequential, concurrent):
+            started = time.perf_counter()
+            soar.execute_playbook(name, context)
+            timings.append(time.perf_counter() - started)
+        logger.info(f"{playbook['name']:<32} {len(playbook['actions'])} actions | chained {timings[0]:6.2f}s | "
+                    f"graph {timings[1]:6.2f}s | {timings[0] / timings[1]:4.1f}x")
+    finish(sequential)
+    finish(concurrent)
+
+
+def burst(soar, alerts, concurrent):
+    """Seconds to finish every alert, serially or through the playbook pool"""
+    started = time.perf_counter()
+    if concurrent:
+        futures = [soar.executor.submit(soar.execute_playbook, soar.match_alert_to_playbook(a), a) for a in alerts]
+        for future in futures:
+            future.result()
+    else:
+        for a in alerts:
+            soar.execute_playbook(soar.match_alert_to_playbook(a), a)
+    return time.perf_counter() - started
+
+
+def throughput(latency, count, caps, seed):
+    """A burst of alerts: the old serial loop vs. concurrent playbooks under each (playbooks, actions) cap"""
+    rng = random.Random(seed)
+    alerts = [alert(rng.choice(ALERT_TYPES), rng) for _ in range(count)]
+
+    soar = engine(latency, chain=True)
+    baseline = burst(soar, alerts, concurrent=False)
+    finish(soar)
+    logger.info(f"{count} alerts, chained actions, one alert at a time | {baseline:6.2f}s | "
+                f"{count / baseline:6.1f} alerts/s")
+
+    for playbooks, actions in caps:
+        soar = engine(latency, playbooks=playbooks, actions=actions)
+        seconds = burst(soar, alerts, concurrent=True)
+        finish(soar)
+        logger.info(f"{count} alerts, graph, {playbooks:>2} playbooks / {actions:>2} actions at once | "
+                    f"{seconds:6.2f}s | {count / seconds:6.1f} alerts/s | {baseline / seconds:4.1f}x")
+
+
+def hung_action(latency, timeout):
+    """One action never returns in time: it times out and only its dependents are skipped"""
+    soar = engine(latency, timeout=timeout)
+    execute_action = soar.execute_action
+
+    def slow(action, context):
+        if action['action'] == 'isolate_endpoint':
+            time.sleep(timeout * 4)
+        return execute_action(action, context)
+
+    soar.executor.run_action = slow
+    started = time.perf_counter()
+    log = soar.execute_playbook('malware_detection_response', alert('malware', random.Random(0)))
+    seconds = time.perf_counter() - started
+    statuses = ', '.join(f"{result['action']}={result['status']}" for result in log['actions_executed'])
+    logger.info(f"Hung isolate_endpoint with a {timeout}s timeout: playbook done in {seconds:.2f}s | {statuses}")
+    finish(soar)
+
+
+def run(latency, alerts, caps, timeout, seed):
+    logging.getLogger('soar_engine').setLevel(logging.WARNING)
+    per_playbook(latency, seed)
+    throughput(latency, alerts, caps, seed)
+    logging.getLogger('playbook_executor').setLevel(logging.CRITICAL)
+    hung_action(latency, timeout)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SOAR playbook executor benchmark')
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='Simulated seconds per action (default: 0.2; the engine default is 1)')
+    parser.add_argument('--alerts', type=int, default=40, help='Alerts in the throughput burst (default: 40)')
+    parser.add_argument('--caps', type=str, nargs='+', default=['1:16', '4:16', '8:32'],
+                        help='playbooks:actions concurrency caps to compare (default: 1:16 4:16 8:32)')
+    parser.add_argument('--timeout', type=float, default=0.5, help='Action timeout in the hung-action check (default: 0.5)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    args = parser.parse_args()
+    run(args.latency, args.alerts, [tuple(int(n) for n in cap.split(':')) for cap in args.caps], args.timeout,
+        args.seed)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Processed-Marker Benchmark
+Marks an alert storm processed with one update per alert and with the
+journaled _bulk marker, against an in-memory Elasticsearch with simulated
+round-trip latency, then checks per-item failure handling, replay after a
+crash between journaling and flushing, and update_by_query acknowledgement
+"""
+
+import os
+import sys
+import time
+import logging
+import tempfile
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', '..', 'ml-service', 'benchmarks'))
+
+from inmemory_es import InMemoryElasticsearch
+from processed_marker import ProcessedMarker, marked_doc
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+INDEX = 'threat-alerts'
+
+
+def storm(count, latency):
+    """An in-memory ES holding `count` unprocessed alerts; returns (es, alert ids)"""
+    es = InMemoryElasticsearch(latency=latency)
+    now = datetime.utcnow().isoformat()
+    es.load(INDEX, [{'@timestamp': now, 'alert_type': 'brute_force', 'soar_processed': False} for _ in range(count)])
+    return es, list(es.data[INDEX].documents)
+
+
+def unprocessed(es):
+    return sum(1 for source in es.data[INDEX].documents.values() if not source['soar_processed'])
+
+
+def per_alert(count, latency):
+    es, ids = storm(count, latency)
+    started = time.perf_counter()
+    for alert_id in ids:
+        es.update(index=INDEX, id=alert_id, body={'doc': marked_doc('brute_force_response')})
+    return time.perf_counter() - started, sum(es.requests.values()), unprocessed(es)
+
+
+def bulk(count, latency, work_dir):
+    es, ids = storm(count, latency)
+    marker = ProcessedMarker(es, journal_path=os.path.join(work_dir, f'storm-{count}.journal'))
+    started = time.perf_counter()
+    for alert_id in ids:
+        marker.record(INDEX, alert_id, 'brute_force_response')
+    marker.flush()
+    return time.perf_counter() - started, sum(es.requests.values()), unprocessed(es)
+
+
+def throughput(counts, latency, work_dir):
+    for count in counts:
+        single_seconds, single_requests, single_left = per_alert(count, latency)
+        bulk_seconds, bulk_requests, bulk_left = bulk(count, latency, work_dir)
+        logger.info(f"{count:>6,} alerts at {latency * 1000:.0f} ms/request | per-alert update {single_seconds:7.3f}s "
+                    f"in {single_requests:>6,} requests | journaled _bulk {bulk_seconds:7.3f}s in {bulk_requests} "
+                    f"request(s) | {single_seconds / bulk_seconds:5.1f}x | unprocessed left {single_left}/{bulk_left}")
+
+
+def item_failures(work_dir):
+    """One item throttled once, one alert deleted before the flush"""
+    es, ids = storm(10, 0.0)
+    marker = ProcessedMarker(es, journal_path=os.path.join(work_dir, 'failures.journal'), retry_backoff=0.01)
+    for alert_id in ids:
+        marker.record(INDEX, alert_id, 'brute_force_response')
+    del es.data[INDEX].documents[ids[-1]]
+
+    bulk_call = es.bulk
+    throttled = {ids[0]}
+
+    def flaky_bulk(operations=None, **kwargs):
+        response = bulk_call(operations=operations, **kwargs)
+        for operation, item in zip(operations[::2], response['items']):
+            if operation['update']['_id'] in throttled:
+                throttled.discard(operation['update']['_id'])
+                es.data[INDEX].documents[operation['update']['_id']]['soar_processed'] = False
+                item['update'] = {'status': 429, 'error': {'type': 'es_rejected_execution_exception'}}
+                response['errors'] = True
+        return response
+
+    es.bulk = flaky_bulk
+    left = marker.flush()
+    logger.info(f"Per-item failures: {marker.stats} | pending after flush {left} | unprocessed {unprocessed(es)} "
+                f"(the deleted alert is gone)")
+
+
+def crash_replay(count, work_dir):
+    """Playbooks ran and were journaled, then the engine died before the flush"""
+    es, ids = storm(count, 0.0)
+    journal_path = os.path.join(work_dir, 'crash.journal')
+    crashed = ProcessedMarker(es, journal_path=journal_path)
+    for alert_id in ids:
+        crashed.record(INDEX, alert_id, 'brute_force_response')
+    # A torn final line, as a crash in the middle of an append leaves behind
+    with open(journal_path, 'a') as f:
+        f.write('{"index": "threat-alerts", "id": ')
+    del crashed
+
+    logging.disable(logging.WARNING)
+    restarted = ProcessedMarker(es, journal_path=journal_path)
+    logging.disable(logging.NOTSET)
+    skipped = sum(restarted.is_pending(INDEX, alert_id) for alert_id in ids)
+    before = unprocessed(es)
+    restarted.flush()
+    logger.info(f"Crash before flush: {before} alerts still unprocessed in ES, {skipped} skipped by the next poll "
+                f"instead of re-executed, {unprocessed(es)} unprocessed after the replayed flush "
+                f"({os.path.getsize(journal_path)} bytes of journal left)")
+
+
+def acknowledge(count, latency, work_dir):
+    es, _ = storm(count, latency)
+    marker = ProcessedMarker(es, journal_path=os.path.join(work_dir, 'acknowledge.journal'))
+    started = time.perf_counter()
+    updated = marker.acknowledge(INDEX)
+    logger.info(f"update_by_query acknowledged {updated:,} alerts in {time.perf_counter() - started:.3f}s, "
+                f"{sum(es.requests.values())} request | unprocessed left {unprocessed(es)}")
+
+
+def run(counts, latency):
+    logging.getLogger('processed_marker').setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as work_dir:
+        throughput(counts, latency, work_dir)
+        item_failures(work_dir)
+        crash_replay(max(counts), work_dir)
+        acknowledge(max(counts), latency, work_dir)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SOAR processed-alert marking benchmark')
+    parser.add_argument('--counts', type=int, nargs='+', default=[20, 200, 2000],
+                        help='Alerts marked per poll cycle (default: 20 200 2000)')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='Simulated seconds per Elasticsearch request (default: 0.002)')
+
+    args = parser.parse_args()
+    run(args.counts, args.latency)
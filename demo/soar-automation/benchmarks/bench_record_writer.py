@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Record Writer Benchmark
+Compares the caller-side cost of indexing SOAR records one request at a
+time with handing them to the buffered writer, then runs a burst through
+an Elasticsearch outage and through a slow cluster under each overflow
+policy, checking that every record not deliberately dropped is indexed
+exactly once
+"""
+
+import os
+import sys
+import time
+import logging
+import tempfile
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', '..', 'ml-service', 'benchmarks'))
+
+from inmemory_es import InMemoryElasticsearch
+from record_writer import OVERFLOW_POLICIES, BufferedRecordWriter
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def record(number):
+    return {'action': 'block_source_ip', 'sequence': number, 'status': 'SUCCESS',
+            'context': {'source_ip': '10.0.0.1', 'alert_type': 'brute_force'}}
+
+
+def indexed(es):
+    """(documents in soar-actions, distinct sequence numbers among them)"""
+    documents = es.data.get('soar-actions')
+    if documents is None:
+        return 0, 0
+    return len(documents.documents), len({doc['sequence'] for doc in documents.documents.values()})
+
+
+class OutageElasticsearch(InMemoryElasticsearch):
+    """Refuses every request between `down_at` and `up_at` (seconds after creation)"""
+
+    def __init__(self, down_at, up_at, latency=0.0):
+        super().__init__(latency=latency)
+        self.created = time.monotonic()
+        self.down_at = down_at
+        self.up_at = up_at
+
+    def bulk(self, operations=None, body=None, **kwargs):
+        if self.down_at <= time.monotonic() - self.created < self.up_at:
+            self.round_trip()
+            raise ConnectionError('Connection refused')
+        return super().bulk(operations=operations, body=body, **kwargs)
+
+
+def caller_latency(count, latency, work_dir):
+    """What the response path pays per record: a synchronous index call vs add()"""
+    es = InMemoryElasticsearch(latency=latency)
+    timings = []
+    for number in range(count):
+        started = time.perf_counter()
+        es.index(index='soar-actions', document=record(number))
+        timings.append(time.perf_counter() - started)
+    sync = np.array(timings) * 1000
+
+    es = InMemoryElasticsearch(latency=latency)
+    writer = BufferedRecordWriter(es, spool_path=os.path.join(work_dir, 'latency.spool'), flush_interval=0.1)
+    timings = []
+    for number in range(count):
+        started = time.perf_counter()
+        writer.add('soar-actions', record(number))
+        timings.append(time.perf_counter() - started)
+        # Spread the records out as actions would, instead of one tight burst
+        time.sleep(0.0005)
+    buffered = np.array(timings) * 1000
+    writer.close()
+
+    logger.info(f"{count:,} records at {latency * 1000:.0f} ms/request | es.index p50 {np.median(sync):.3f} ms "
+                f"p99 {np.percentile(sync, 99):.3f} ms ({count:,} requests) | add() p50 {np.median(buffered):.3f} ms "
+                f"p99 {np.percentile(buffered, 99):.3f} ms ({es.requests['bulk']} bulk requests) | indexed {indexed(es)[0]:,}")
+
+
+def outage(count, down_for, work_dir):
+    """Elasticsearch refuses writes for `down_for` seconds in the middle of a steady stream"""
+    es = OutageElasticsearch(down_at=0.2, up_at=0.2 + down_for, latency=0.002)
+    writer = BufferedRecordWriter(es, spool_path=os.path.join(work_dir, 'outage.spool'), max_docs=200,
+                                  flush_interval=0.1, max_backoff=0.5)
+    started = time.monotonic()
+    for number in range(count):
+        writer.add('soar-actions', record(number))
+        time.sleep((0.6 + down_for) / count)
+    # Give the last backoff time to expire before shutting down
+    while writer.spool.pending() and time.monotonic() - started < 10 + down_for:
+        time.sleep(0.1)
+    writer.close()
+    documents, distinct = indexed(es)
+    logger.info(f"{down_for:.1f}s outage, {count:,} records | spooled {writer.stats['spooled']:,}, replayed "
+                f"{writer.stats['replayed']:,} | indexed {documents:,} documents, {distinct:,} distinct, "
+                f"lost {count - distinct:,} | spool left: {writer.spool.pending()}")
+
+
+def overflow(count, queue_size, latency, work_dir):
+    """A burst into a slow cluster with a small buffer, under each policy"""
+    for policy in OVERFLOW_POLICIES:
+        es = InMemoryElasticsearch(latency=latency)
+        writer = BufferedRecordWriter(es, spool_path=os.path.join(work_dir, f'{policy}.spool'), max_docs=100,
+                                      flush_interval=0.05, max_queue=queue_size, overflow=policy)
+        timings = []
+        for number in range(count):
+            started = time.perf_counter()
+            writer.add('soar-actions', record(number))
+            timings.append(time.perf_counter() - started)
+        writer.close()
+        documents, distinct = indexed(es)
+        logger.info(f"overflow={policy:<11} queue {queue_size:,}, {count:,} burst records | max add() "
+                    f"{max(timings) * 1000:6.3f} ms | dropped {writer.stats['dropped']:,}, spooled on overflow "
+                    f"{writer.stats['overflow_spooled']:,} | indexed {documents:,} ({distinct:,} distinct)")
+
+
+def run(count, latency, down_for, queue_size):
+    logging.getLogger('record_writer').setLevel(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as work_dir:
+        caller_latency(count, latency, work_dir)
+        outage(count, down_for, work_dir)
+        overflow(count, queue_size, latency * 10, work_dir)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SOAR buffered record writer benchmark')
+    parser.add_argument('--count', type=int, default=2000, help='Records per scenario (default: 2000)')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Simulated seconds per Elasticsearch request (default: 0.005)')
+    parser.add_argument('--down-for', type=float, default=1.0, help='Seconds of Elasticsearch outage (default: 1)')
+    parser.add_argument('--queue-size', type=int, default=200,
+                        help='Buffer size in the overflow comparison (default: 200)')
+
+    args = parser.parse_args()
+    run(args.count, args.latency, args.down_for, args.queue_size)
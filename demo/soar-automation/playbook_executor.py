@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Playbook Executor
+Runs each playbook's actions as a dependency graph, starting every action
+whose prerequisites have succeeded at once on a shared, bounded thread
+pool with per-action timeouts, and runs whole playbooks side by side
+under a global cap
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+# How often a playbook re-checks timeouts while some of its actions still wait for a worker
+QUEUED_POLL_SECONDS = 0.05
+
+
+def build_graph(actions):
+    """Map each action name to the action names it waits for
+
+    Actions declare prerequisites with 'depends_on'. A playbook in which no
+    action declares any keeps the original behaviour: every action waits
+    for the one before it in priority order. Raises ValueError for
+    duplicate names, unknown dependencies and cycles.
+    """
+    ordered = sorted(actions, key=lambda action: action['priority'])
+    names = [action['action'] for action in ordered]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate action names in playbook: {names}")
+
+    if not any('depends_on' in action for action in ordered):
+        return {name: names[i - 1:i] for i, name in enumerate(names)}
+
+    graph = {action['action']: list(dict.fromkeys(action.get('depends_on', []))) for action in ordered}
+    for name, dependencies in graph.items():
+        unknown = [dependency for dependency in dependencies if dependency not in graph]
+        if unknown:
+            raise ValueError(f"Action {name} depends on unknown action(s) {unknown}")
+
+    # Kahn's algorithm: whatever is never released sits on a cycle
+    waiting = {name: len(dependencies) for name, dependencies in graph.items()}
+    dependents = dependents_of(graph)
+    ready = [name for name, count in waiting.items() if count == 0]
+    while ready:
+        for dependent in dependents[ready.pop()]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+    cycle = [name for name, count in waiting.items() if count]
+    if cycle:
+        raise ValueError(f"Dependency cycle among actions {cycle}")
+    return graph
+
+
+def dependents_of(graph):
+    """Invert a dependency graph: name -> actions waiting for it"""
+    dependents = {name: [] for name in graph}
+    for name, dependencies in graph.items():
+        for dependency in dependencies:
+            dependents[dependency].append(name)
+    return dependents
+
+
+class PlaybookExecutor:
+    """Concurrent playbook runner with global caps
+
+    Each in-flight playbook holds one thread of a pool sized
+    max_concurrent_playbooks and walks its graph from there; the actions
+    themselves run on a shared pool of max_concurrent_actions threads, so
+    the number of actions in flight is capped however many playbooks are
+    running. An action's timeout counts from the moment it starts on a
+    worker. Threads cannot be interrupted: an action that overruns is
+    reported as TIMEOUT and its dependents are skipped, but it keeps its
+    worker until it returns, and whatever it returns is discarded.
+    Results are handed to record_result on the playbook thread as each
+    action settles, so a late return is never recorded after its TIMEOUT.
+    """
+
+    def __init__(self, run_action, max_concurrent_playbooks=4, max_concurrent_actions=16, action_timeout=30.0,
+                 record_result=None):
+        self.run_action = run_action
+        self.record_result = record_result
+        self.action_timeout = action_timeout
+        self.playbook_pool = ThreadPoolExecutor(max_workers=max_concurrent_playbooks, thread_name_prefix='soar-playbook')
+        self.action_pool = ThreadPoolExecutor(max_workers=max_concurrent_actions, thread_name_prefix='soar-action')
+        self.lock = threading.Lock()
+        self.stats = {'playbooks': 0, 'actions': 0, 'failed': 0, 'timed_out': 0, 'skipped': 0}
+
+    def submit(self, function, *args):
+        """Run function (normally a whole playbook execution) on the playbook pool; returns its Future"""
+        return self.playbook_pool.submit(function, *args)
+
+    def timeout_for(self, action):
+        return action.get('timeout', self.action_timeout)
+
+    def timed(self, action, context, started):
+        """Action-pool entry point: record the start, run the action, stamp its duration"""
+        began = time.monotonic()
+        started[action['action']] = began
+        result = self.run_action(action, context)
+        result['duration_seconds'] = round(time.monotonic() - began, 3)
+        return result
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def run(self, actions, context):
+        """Run one playbook's actions to completion in the calling thread
+
+        Returns one result per action in priority order; actions that did
+        not run carry status SKIPPED and the dependency that stopped them.
+        """
+        graph = build_graph(actions)
+        by_name = {action['action']: action for action in actions}
+        dependents = dependents_of(graph)
+        waiting = {name: len(dependencies) for name, dependencies in graph.items()}
+        started = {}
+        results = {}
+        running = {}
+
+        def launch(name):
+            running[self.action_pool.submit(self.timed, by_name[name], context, started)] = name
+
+        def settle(name, result):
+            results[name] = result
+            if self.record_result is not None and result['status'] != 'SKIPPED':
+                self.record_result(result)
+            succeeded = result['status'] not in ('FAILED', 'TIMEOUT', 'SKIPPED')
+            for dependent in dependents[name]:
+                if dependent in results:
+                    continue
+                if not succeeded:
+                    self.count('skipped')
+                    settle(dependent, {
+                        'action': dependent,
+                        'status': 'SKIPPED',
+                        'reason': f"dependency {name} {result['status']}"
+                    })
+                    continue
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    launch(dependent)
+
+        for name, count in waiting.items():
+            if count == 0:
+                launch(name)
+
+        while running:
+            now = time.monotonic()
+            deadlines = [started[name] + self.timeout_for(by_name[name])
+                         for name in running.values() if name in started]
+            timeout = max(0.0, min(deadlines) - now) if deadlines else None
+            # A queued action's deadline is unknown until it starts, so check back for it
+            if len(deadlines) < len(running):
+                timeout = QUEUED_POLL_SECONDS if timeout is None else min(timeout, QUEUED_POLL_SECONDS)
+
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                self.count('actions')
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Error executing action {name}: {str(e)}")
+                    self.count('failed')
+                    result = {'action': name, 'timestamp': datetime.utcnow().isoformat(), 'status': 'FAILED',
+                              'context': context, 'error': str(e)}
+                settle(name, result)
+
+            now = time.monotonic()
+            for future, name in list(running.items()):
+                limit = self.timeout_for(by_name[name])
+                if name in started and now - started[name] >= limit:
+                    del running[future]
+                    logger.error(f"Action {name} timed out after {limit}s; its result will be discarded")
+                    self.count('timed_out')
+                    settle(name, {'action': name, 'timestamp': datetime.utcnow().isoformat(), 'status': 'TIMEOUT',
+                                  'context': context, 'error': f"exceeded {limit}s timeout"})
+
+        self.count('playbooks')
+        return [results[action['action']] for action in sorted(actions, key=lambda action: action['priority'])]
+
+    def close(self):
+        """Let running playbooks finish; abandon actions still stuck past their timeout"""
+        self.playbook_pool.shutdown(wait=True)
+        self.action_pool.shutdown(wait=False)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Processed-Alert Marker
+Journals every alert whose playbook has finished and sets soar_processed
+on the whole poll cycle's alerts with one _bulk request, plus an
+update_by_query path to acknowledge alerts in bulk without running
+playbooks
+"""
+
+import os
+import json
+import time
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Applies params.doc to each matching alert, the update_by_query counterpart of a partial-doc update
+ACKNOWLEDGE_SCRIPT = 'ctx._source.putAll(params.doc)'
+
+
+def retryable_status(status):
+    """Bulk item statuses worth retrying: back-pressure (429) and any server-side failure (5xx)"""
+    return status == 429 or status >= 500
+
+
+def marked_doc(playbook_name, details=None):
+    doc = {
+        'soar_processed': True,
+        'playbook_executed': playbook_name,
+        'execution_time': datetime.utcnow().isoformat()
+    }
+    doc.update(details or {})
+    return doc
+
+
+class ProcessedMarker:
+    """Crash-safe, batched soar_processed updates
+
+    record() appends the update to a local journal and fsyncs it before
+    anything is sent, and flush() sends every journaled update as one
+    _bulk request, then rewrites the journal with whatever is still
+    unsent. After a crash the journal is replayed, so an alert whose
+    playbook already ran is marked on the next flush rather than
+    executed again; updates are partial docs, so replaying one that
+    already reached Elasticsearch is harmless. The poll loop checks
+    is_pending() to skip alerts that are executed but not yet marked.
+    Only the polling thread calls these methods.
+    """
+
+    def __init__(self, es, journal_path='/var/lib/soar/processed.journal', max_retries=3, retry_backoff=0.5):
+        self.es = es
+        self.journal_path = journal_path
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.pending = {}
+        self.stats = {'marked': 0, 'missing': 0, 'failed': 0, 'retried': 0, 'bulk_requests': 0, 'acknowledged': 0}
+        self.load()
+
+    def load(self):
+        """Replay updates journaled before a restart"""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn final line from a crash mid-append: that update was never acknowledged to anyone
+                    logger.warning(f"Ignoring unreadable line in {self.journal_path}")
+                    continue
+                self.pending[(entry['index'], entry['id'])] = entry['doc']
+        if self.pending:
+            logger.info(f"Replaying {len(self.pending)} processed-alert updates from {self.journal_path}")
+
+    def record(self, index, alert_id, playbook_name, details=None):
+        """Durably note that an alert's playbook has run; sent on the next flush()"""
+        self.record_many([(index, alert_id)], playbook_name, details)
+
+    def record_many(self, members, playbook_name, details=None):
+        """record() for a group of (index, alert_id) alerts handled by one run, with a single fsync"""
+        doc = marked_doc(playbook_name, details)
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        with open(self.journal_path, 'a') as f:
+            for index, alert_id in members:
+                f.write(json.dumps({'index': index, 'id': alert_id, 'doc': doc}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        for index, alert_id in members:
+            self.pending[(index, alert_id)] = doc
+
+    def is_pending(self, index, alert_id):
+        return (index, alert_id) in self.pending
+
+    def flush(self):
+        """Send every pending update in one _bulk request; returns the number still pending"""
+        if not self.pending:
+            return 0
+
+        entries = list(self.pending.items())
+        for attempt in range(self.max_retries + 1):
+            entries = self.send(entries, final_attempt=attempt == self.max_retries)
+            if not entries:
+                break
+            self.stats['retried'] += len(entries)
+            logger.warning(f"Retrying {len(entries)} processed-alert updates (attempt {attempt + 1}/{self.max_retries})")
+            time.sleep(self.retry_backoff * (2 ** attempt))
+
+        self.compact()
+        return len(self.pending)
+
+    def send(self, entries, final_attempt=False):
+        """Issue one _bulk request and return the entries that should be retried
+
+        Updates still failing after the last attempt stay pending, and
+        journaled, for the next poll cycle. Alerts deleted in the
+        meantime (404) and updates Elasticsearch rejects outright are
+        dropped; a rejected alert stays unprocessed and is picked up again.
+        """
+        operations = []
+        for (index, alert_id), doc in entries:
+            operations.append({'update': {'_index': index, '_id': alert_id}})
+            operations.append({'doc': doc})
+
+        self.stats['bulk_requests'] += 1
+        try:
+            response = self.es.bulk(operations=operations)
+        except Exception as e:
+            logger.error(f"Bulk update for {len(entries)} processed alerts failed: {str(e)}")
+            return [] if final_attempt else entries
+
+        retry = []
+        for entry, item in zip(entries, response['items']):
+            (index, alert_id), _ = entry
+            result = item.get('update', {})
+            status = result.get('status', 0)
+            if status < 300:
+                self.stats['marked'] += 1
+                del self.pending[(index, alert_id)]
+            elif status == 404:
+                self.stats['missing'] += 1
+                del self.pending[(index, alert_id)]
+                logger.warning(f"Alert {alert_id} in {index} no longer exists; not marking it processed")
+            elif retryable_status(status):
+                if not final_attempt:
+                    retry.append(entry)
+            else:
+                self.stats['failed'] += 1
+                del self.pending[(index, alert_id)]
+                logger.error(f"Failed to mark alert {alert_id} in {index} processed: {status} {result.get('error')}")
+        return retry
+
+    def compact(self):
+        """Atomically rewrite the journal with the updates still pending"""
+        # Write-then-rename so a crash leaves either the old journal or the new one
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for (index, alert_id), doc in self.pending.items():
+                f.write(json.dumps({'index': index, 'id': alert_id, 'doc': doc}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def acknowledge(self, index, before='now', reason='bulk_acknowledged'):
+        """Mark every unprocessed alert in `index` up to `before` processed, without running playbooks
+
+        Runs server-side as one update_by_query. Only alerts still
+        unprocessed match, so after a crash or a partial failure the same
+        call can simply be repeated. Returns the number of alerts updated.
+        """
+        query = {
+            'bool': {
+                'filter': [
+                    {'term': {'soar_processed': False}},
+                    {'range': {'@timestamp': {'lte': before}}}
+                ]
+            }
+        }
+        script = {
+            'source': ACKNOWLEDGE_SCRIPT,
+            'lang': 'painless',
+            'params': {'doc': {
+                'soar_processed': True,
+                'soar_acknowledged': reason,
+                'execution_time': datetime.utcnow().isoformat()
+            }}
+        }
+        response = self.es.update_by_query(index=index, query=query, script=script, conflicts='proceed', refresh=True)
+
+        updated = response.get('updated', 0)
+        self.stats['acknowledged'] += updated
+        if response.get('failures') or response.get('version_conflicts'):
+            logger.warning(f"Acknowledging alerts in {index}: {len(response.get('failures', []))} failures, "
+                           f"{response.get('version_conflicts', 0)} version conflicts; rerun to finish")
+        logger.info(f"Acknowledged {updated} unprocessed alerts in {index} up to {before} ({reason})")
+        return updated
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Buffered Record Writer
+Takes soar-actions and playbook-executions documents off the response
+path: callers enqueue into a bounded in-memory buffer that a background
+thread flushes through _bulk by size or interval, and records that
+Elasticsearch cannot take right now go to a local spool file that is
+replayed once it recovers
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+
+from processed_marker import retryable_status
+
+logger = logging.getLogger(__name__)
+
+# What add() does when the buffer is full
+OVERFLOW_POLICIES = ('spool', 'drop_oldest', 'drop_newest')
+
+
+class Spool:
+    """Append-only JSON-lines file of records waiting for Elasticsearch
+
+    Replay first renames the file aside, so new records keep appending to
+    a fresh spool while the old one is sent; a replay file left by a crash
+    is picked up again on the next take().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.replay_path = f"{path}.replay"
+        self.lock = threading.Lock()
+
+    def append(self, entries, sync=True):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as f:
+                for index, doc_id, document in entries:
+                    f.write(json.dumps({'index': index, 'id': doc_id, 'doc': document}, default=str) + '\n')
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+
+    def pending(self):
+        return os.path.exists(self.replay_path) or os.path.exists(self.path)
+
+    def take(self):
+        """Records to replay: the unfinished replay file, else the current spool"""
+        with self.lock:
+            if not os.path.exists(self.replay_path) and os.path.exists(self.path):
+                os.replace(self.path, self.replay_path)
+        if not os.path.exists(self.replay_path):
+            return []
+
+        entries = []
+        with open(self.replay_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn final line from a crash mid-append
+                    logger.warning(f"Ignoring unreadable line in {self.replay_path}")
+                    continue
+                entries.append((entry['index'], entry['id'], entry['doc']))
+        return entries
+
+    def finish(self, remaining):
+        """Drop the replay file, or atomically shrink it to the records still unsent"""
+        if not remaining:
+            os.remove(self.replay_path)
+            return
+        tmp_path = f"{self.replay_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for index, doc_id, document in remaining:
+                f.write(json.dumps({'index': index, 'id': doc_id, 'doc': document}, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.replay_path)
+
+
+class BufferedRecordWriter:
+    """Non-blocking _bulk writer with a bounded buffer and a durable spool
+
+    add() only appends to a deque under a lock. The flusher thread sends
+    up to max_docs records per request, as soon as that many are waiting
+    or every flush_interval seconds. Records from a failed request, and
+    items rejected with a retryable status, are appended to the spool and
+    replayed with exponential backoff until Elasticsearch takes them.
+    Every record gets its _id when queued, so a record sent twice (a crash
+    mid-replay, a timed-out request that actually landed) is overwritten
+    rather than duplicated.
+
+    When the buffer already holds max_queue records, `overflow` decides:
+    'spool' writes the new record straight to the spool file (unsynced,
+    so it survives a process crash but not a power loss), 'drop_oldest'
+    evicts the oldest buffered record, 'drop_newest' discards the new one.
+    Records still buffered in memory are lost if the process dies.
+    """
+
+    def __init__(self, es, spool_path='/var/lib/soar/records.spool', max_docs=500, flush_interval=2.0,
+                 max_queue=10000, overflow='spool', max_backoff=60.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, got {overflow!r}")
+        self.es = es
+        self.spool = Spool(spool_path)
+        self.max_docs = max_docs
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.max_backoff = max_backoff
+
+        self.buffer = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.backoff = 0.0
+        self.next_replay = 0.0
+        self.stats = {'queued': 0, 'indexed': 0, 'failed': 0, 'dropped': 0, 'overflow_spooled': 0, 'spooled': 0,
+                      'replayed': 0, 'bulk_requests': 0}
+
+        if self.spool.pending():
+            logger.info(f"Found spooled records in {spool_path}; they will be replayed")
+        self.flusher = threading.Thread(target=self.run_flusher, name='soar-record-flusher', daemon=True)
+        self.flusher.start()
+
+    def add(self, index, document):
+        """Queue a document for indexing; never waits on Elasticsearch"""
+        # Shallow copy: callers may keep updating their dict after handing it over
+        entry = (index, uuid.uuid4().hex, dict(document))
+        with self.condition:
+            self.stats['queued'] += 1
+            full = len(self.buffer) >= self.max_queue
+            if full and self.overflow == 'spool':
+                self.stats['overflow_spooled'] += 1
+            elif full:
+                self.stats['dropped'] += 1
+                if self.overflow == 'drop_newest':
+                    return False
+                self.buffer.popleft()
+            if not full or self.overflow == 'drop_oldest':
+                self.buffer.append(entry)
+                if len(self.buffer) >= self.max_docs:
+                    self.condition.notify()
+
+        if full and self.overflow == 'spool':
+            self.spool.append([entry], sync=False)
+        return True
+
+    def run_flusher(self):
+        """Send full batches at once, partial ones every flush_interval, until close()"""
+        while True:
+            with self.condition:
+                if not self.closed and len(self.buffer) < self.max_docs:
+                    self.condition.wait(self.flush_interval)
+                batch = [self.buffer.popleft() for _ in range(min(len(self.buffer), self.max_docs))]
+                finished = self.closed and not self.buffer
+
+            try:
+                if batch:
+                    self.send_or_spool(batch)
+                self.replay_spool(force=finished)
+            except Exception as e:
+                logger.error(f"Record flush failed: {str(e)}")
+            if finished:
+                return
+
+    def send(self, entries):
+        """Issue one _bulk request and return the entries worth retrying"""
+        operations = []
+        for index, doc_id, document in entries:
+            operations.append({'index': {'_index': index, '_id': doc_id}})
+            operations.append(document)
+
+        self.stats['bulk_requests'] += 1
+        try:
+            response = self.es.bulk(operations=operations)
+        except Exception as e:
+            logger.error(f"Bulk request for {len(entries)} SOAR records failed: {str(e)}")
+            return entries
+
+        if not response.get('errors'):
+            self.stats['indexed'] += len(entries)
+            return []
+
+        retry = []
+        for entry, item in zip(entries, response['items']):
+            result = item.get('index', {})
+            status = result.get('status', 0)
+            if status < 300:
+                self.stats['indexed'] += 1
+            elif retryable_status(status):
+                retry.append(entry)
+            else:
+                self.stats['failed'] += 1
+                logger.error(f"Failed to index SOAR record into {entry[0]}: {status} {result.get('error')}")
+        return retry
+
+    def send_or_spool(self, batch):
+        retry = self.send(batch)
+        if retry:
+            self.spool.append(retry)
+            self.stats['spooled'] += len(retry)
+            self.schedule_replay(failed=True)
+
+    def schedule_replay(self, failed):
+        """Exponential backoff between replays while Elasticsearch keeps failing"""
+        self.backoff = min(max(self.backoff * 2, self.flush_interval), self.max_backoff) if failed else 0.0
+        self.next_replay = time.monotonic() + self.backoff
+
+    def replay_spool(self, force=False):
+        """Resend spooled records once the backoff has passed; returns the number still spooled"""
+        if not self.spool.pending() or (not force and time.monotonic() < self.next_replay):
+            return 0
+
+        entries = self.spool.take()
+        remaining = []
+        for start in range(0, len(entries), self.max_docs):
+            chunk = entries[start:start + self.max_docs]
+            retry = self.send(chunk)
+            self.stats['replayed'] += len(chunk) - len(retry)
+            remaining += retry
+            if retry:
+                # Still failing: keep the rest for the next attempt instead of hammering the cluster
+                remaining += entries[start + self.max_docs:]
+                break
+
+        self.spool.finish(remaining)
+        self.schedule_replay(failed=bool(remaining))
+        if remaining:
+            logger.warning(f"{len(remaining)} SOAR records remain spooled; next replay in {self.backoff:.0f}s")
+        elif entries:
+            logger.info(f"Replayed {len(entries)} spooled SOAR records")
+        return len(remaining)
+
+    def close(self):
+        """Flush what is buffered and try the spool once more; anything unsent stays spooled"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.flusher.join()
+
+        with self.condition:
+            leftover = list(self.buffer)
+            self.buffer.clear()
+        if leftover:
+            self.spool.append(leftover)
+            self.stats['spooled'] += len(leftover)
+        logger.info(f"Record writer closed: {self.stats}")
@@ -1,24 +1,72 @@
 #!/usr/bin/env python3
 """
 SOAR Automation Engine
-Implements automated incident response playbooks and orchestration
+Implements automated incident response playbooks and orchestration,
+running independent playbook actions and separate alerts concurrently
 """
 
 import json
 import time
 import logging
 from datetime import datetime
+from concurrent.futures import as_completed
 from elasticsearch import Elasticsearch
 import requests
 
+from action_history import ActionHistory
+from alert_coalescer import AlertCoalescer
+from playbook_executor import PlaybookExecutor, build_graph
+from processed_marker import ProcessedMarker
+from record_writer import OVERFLOW_POLICIES, BufferedRecordWriter
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+ALERT_INDICES = ['threat-alerts', 'ueba-alerts', 'attack-chains']
+
 class SOAREngine:
-    def __init__(self):
-        self.es = Elasticsearch(['http://elasticsearch:9200'])
+    def __init__(self, es=None, max_concurrent_playbooks=4, max_concurrent_actions=16, action_timeout=30.0,
+                 simulated_latency=1.0, journal_path='/var/lib/soar/processed.journal',
+                 spool_path='/var/lib/soar/records.spool', write_batch_size=500, write_interval=2.0,
+                 write_queue_size=10000, write_overflow='spool', history_capacity=100000,
+                 history_path='/var/lib/soar/action-history.log', coalesce_window=300.0, coalesce_on=None):
+        self.es = es or Elasticsearch(['http://elasticsearch:9200'])
         self.playbooks = self.load_playbooks()
-        self.action_history = []
+        # Fail at startup, not mid-incident, on a malformed dependency graph
+        for name, playbook in self.playbooks.items():
+            try:
+                build_graph(playbook['actions'])
+            except ValueError as e:
+                raise ValueError(f"Playbook '{name}': {e}") from e
+        # Recent actions in a fixed-size ring; older ones spill to a compressed log on disk
+        self.action_history = ActionHistory(history_path, capacity=history_capacity)
+        # Stand-in for the time a real integration call takes
+        self.simulated_latency = simulated_latency
+        self.executor = PlaybookExecutor(
+            self.execute_action,
+            max_concurrent_playbooks=max_concurrent_playbooks,
+            max_concurrent_actions=max_concurrent_actions,
+            action_timeout=action_timeout,
+            record_result=self.record_action
+        )
+        # soar-actions / playbook-executions records are written in the background, never inline
+        self.writer = BufferedRecordWriter(
+            self.es,
+            spool_path=spool_path,
+            max_docs=write_batch_size,
+            flush_interval=write_interval,
+            max_queue=write_queue_size,
+            overflow=write_overflow
+        )
+        # Alerts for the same playbook and key within coalesce_window share one run;
+        # coalesce_on (alert fields) overrides every playbook's own key
+        self.coalescer = AlertCoalescer(
+            window=coalesce_window,
+            key_fields={name: coalesce_on or playbook.get('coalesce_on', ['source_ip'])
+                        for name, playbook in self.playbooks.items()}
+        )
+        # soar_processed updates go out as one _bulk per poll cycle, journaled until sent
+        self.marker = ProcessedMarker(self.es, journal_path=journal_path)
         
     def load_playbooks(self):
         """Load automated incident response playbooks"""
@@ -27,60 +75,65 @@ class SOAREngine:
                 'name': 'Brute Force Attack Response',
                 'trigger': 'failed_login_threshold_exceeded',
                 'actions': [
-                    {'action': 'block_source_ip', 'priority': 1},
-                    {'action': 'notify_soc_team', 'priority': 2},
-                    {'action': 'reset_user_password', 'priority': 3},
-                    {'action': 'enable_mfa', 'priority': 4},
-                    {'action': 'create_incident_ticket', 'priority': 5}
+                    {'action': 'block_source_ip', 'priority': 1, 'depends_on': []},
+                    {'action': 'notify_soc_team', 'priority': 2, 'depends_on': []},
+                    {'action': 'reset_user_password', 'priority': 3, 'depends_on': []},
+                    {'action': 'enable_mfa', 'priority': 4, 'depends_on': ['reset_user_password']},
+                    {'action': 'create_incident_ticket', 'priority': 5, 'depends_on': []}
                 ],
-                'severity': 'HIGH'
+                'severity': 'HIGH',
+                'coalesce_on': ['source_ip']
             },
             'malware_detection_response': {
                 'name': 'Malware Detection Response',
                 'trigger': 'malware_detected',
                 'actions': [
-                    {'action': 'isolate_endpoint', 'priority': 1},
-                    {'action': 'kill_malicious_process', 'priority': 2},
-                    {'action': 'collect_forensic_artifacts', 'priority': 3},
-                    {'action': 'scan_network_for_spread', 'priority': 4},
-                    {'action': 'notify_incident_response_team', 'priority': 5}
+                    {'action': 'isolate_endpoint', 'priority': 1, 'depends_on': []},
+                    {'action': 'kill_malicious_process', 'priority': 2, 'depends_on': ['isolate_endpoint']},
+                    {'action': 'collect_forensic_artifacts', 'priority': 3, 'depends_on': ['kill_malicious_process']},
+                    {'action': 'scan_network_for_spread', 'priority': 4, 'depends_on': []},
+                    {'action': 'notify_incident_response_team', 'priority': 5, 'depends_on': []}
                 ],
-                'severity': 'CRITICAL'
+                'severity': 'CRITICAL',
+                'coalesce_on': ['hostname']
             },
             'data_exfiltration_response': {
                 'name': 'Data Exfiltration Response',
                 'trigger': 'unusual_data_transfer',
                 'actions': [
-                    {'action': 'block_outbound_connection', 'priority': 1},
-                    {'action': 'suspend_user_account', 'priority': 2},
-                    {'action': 'analyze_transferred_data', 'priority': 3},
-                    {'action': 'notify_security_leadership', 'priority': 4},
-                    {'action': 'initiate_forensic_investigation', 'priority': 5}
+                    {'action': 'block_outbound_connection', 'priority': 1, 'depends_on': []},
+                    {'action': 'suspend_user_account', 'priority': 2, 'depends_on': []},
+                    {'action': 'analyze_transferred_data', 'priority': 3, 'depends_on': ['block_outbound_connection']},
+                    {'action': 'notify_security_leadership', 'priority': 4, 'depends_on': []},
+                    {'action': 'initiate_forensic_investigation', 'priority': 5, 'depends_on': ['analyze_transferred_data']}
                 ],
-                'severity': 'CRITICAL'
+                'severity': 'CRITICAL',
+                'coalesce_on': ['username']
             },
             'port_scan_response': {
                 'name': 'Port Scan Detection Response',
                 'trigger': 'port_scan_detected',
                 'actions': [
-                    {'action': 'log_scanning_activity', 'priority': 1},
-                    {'action': 'rate_limit_source', 'priority': 2},
-                    {'action': 'add_to_watchlist', 'priority': 3},
-                    {'action': 'alert_network_team', 'priority': 4}
+                    {'action': 'log_scanning_activity', 'priority': 1, 'depends_on': []},
+                    {'action': 'rate_limit_source', 'priority': 2, 'depends_on': []},
+                    {'action': 'add_to_watchlist', 'priority': 3, 'depends_on': ['log_scanning_activity']},
+                    {'action': 'alert_network_team', 'priority': 4, 'depends_on': []}
                 ],
-                'severity': 'MEDIUM'
+                'severity': 'MEDIUM',
+                'coalesce_on': ['source_ip']
             },
             'privilege_escalation_response': {
                 'name': 'Privilege Escalation Response',
                 'trigger': 'unauthorized_privilege_elevation',
                 'actions': [
-                    {'action': 'revoke_elevated_privileges', 'priority': 1},
-                    {'action': 'suspend_account', 'priority': 2},
-                    {'action': 'audit_access_logs', 'priority': 3},
-                    {'action': 'check_lateral_movement', 'priority': 4},
-                    {'action': 'escalate_to_incident_response', 'priority': 5}
+                    {'action': 'revoke_elevated_privileges', 'priority': 1, 'depends_on': []},
+                    {'action': 'suspend_account', 'priority': 2, 'depends_on': []},
+                    {'action': 'audit_access_logs', 'priority': 3, 'depends_on': []},
+                    {'action': 'check_lateral_movement', 'priority': 4, 'depends_on': ['audit_access_logs']},
+                    {'action': 'escalate_to_incident_response', 'priority': 5, 'depends_on': []}
                 ],
-                'severity': 'HIGH'
+                'severity': 'HIGH',
+                'coalesce_on': ['username']
             }
         }
         
@@ -91,9 +144,12 @@ class SOAREngine:
         logger.info(f"Executing action: {action_name}")
         
         # Simulate action execution
+        started_at = datetime.utcnow().isoformat()
+        time.sleep(self.simulated_latency)
         action_result = {
             'action': action_name,
             'timestamp': datetime.utcnow().isoformat(),
+            'started_at': started_at,
             'status': 'SUCCESS',
             'context': alert_context
         }
@@ -126,12 +182,13 @@ class SOAREngine:
         else:
             action_result['details'] = f"Action {action_name} simulated"
             
-        # Store action in history
-        self.action_history.append(action_result)
-        self.es.index(index='soar-actions', document=action_result)
-        
         return action_result
         
+    def record_action(self, action_result):
+        """Store a settled action in history; called by the executor, never by a timed-out worker"""
+        self.action_history.record(action_result)
+        self.writer.add('soar-actions', action_result)
+        
     def block_source_ip(self, ip_address):
         """Block a source IP address"""
         return {
@@ -201,35 +258,23 @@ class SOAREngine:
         playbook = self.playbooks[playbook_name]
         logger.info(f"Executing playbook: {playbook['name']}")
         
+        started = time.monotonic()
         execution_log = {
             'playbook_name': playbook['name'],
             'start_time': datetime.utcnow().isoformat(),
-            'alert_context': alert_context,
-            'actions_executed': []
+            'alert_context': alert_context
         }
         
-        # Execute actions in priority order
-        sorted_actions = sorted(playbook['actions'], key=lambda x: x['priority'])
-        
-        for action in sorted_actions:
-            try:
-                result = self.execute_action(action, alert_context)
-                execution_log['actions_executed'].append(result)
-                time.sleep(1)  # Simulate action execution time
-                
-            except Exception as e:
-                logger.error(f"Error executing action {action['action']}: {str(e)}")
-                execution_log['actions_executed'].append({
-                    'action': action['action'],
-                    'status': 'FAILED',
-                    'error': str(e)
-                })
+        # Independent actions run concurrently; each waits only for its depends_on
+        execution_log['actions_executed'] = self.executor.run(playbook['actions'], alert_context)
                 
         execution_log['end_time'] = datetime.utcnow().isoformat()
+        execution_log['duration_seconds'] = round(time.monotonic() - started, 3)
         execution_log['status'] = 'COMPLETED'
+        logger.info(f"Playbook {playbook['name']} completed in {execution_log['duration_seconds']:.1f}s")
         
         # Store playbook execution
-        self.es.index(index='playbook-executions', document=execution_log)
+        self.writer.add('playbook-executions', execution_log)
         
         return execution_log
         
@@ -256,77 +301,163 @@ class SOAREngine:
                 
         return None
         
-    def process_alerts(self):
-        """Main alert processing loop"""
-        logger.info("Starting SOAR automation engine...")
+    def poll_once(self):
+        """One poll cycle: fetch unprocessed alerts, coalesce, run playbooks, mark everything handled"""
+        # Alerts whose playbooks ran before a failed flush or a restart
+        self.marker.flush()
         
-        while True:
-            try:
-                # Query for new alerts
-                query = {
-                    "query": {
-                        "bool": {
-                            "must": [
-                                {"range": {"@timestamp": {"gte": "now-2m"}}},
-                                {"term": {"soar_processed": False}}
-                            ]
-                        }
-                    },
-                    "size": 20
+        # Query for new alerts
+        query = {
+            "query": {
+                "bool": {
+                    "must": [
+                        {"range": {"@timestamp": {"gte": "now-2m"}}},
+                        {"term": {"soar_processed": False}}
+                    ]
                 }
+            },
+            "size": 20
+        }
+        
+        # Check multiple alert indices
+        matched = []
+        for index in ALERT_INDICES:
+            if not self.es.indices.exists(index=index):
+                continue
+                
+            try:
+                response = self.es.search(index=index, body=query)
+                hits = response['hits']['hits']
                 
-                # Check multiple alert indices
-                for index in ['threat-alerts', 'ueba-alerts', 'attack-chains']:
-                    if not self.es.indices.exists(index=index):
+                logger.info(f"Processing {len(hits)} alerts from {index}")
+                
+                for hit in hits:
+                    alert = hit['_source']
+                    alert_id = hit['_id']
+                    
+                    if self.marker.is_pending(index, alert_id):
+                        # Playbook already ran; only the soar_processed update is outstanding
                         continue
                         
-                    try:
-                        response = self.es.search(index=index, body=query)
-                        hits = response['hits']['hits']
+                    # Match alert to playbook
+                    playbook_name = self.match_alert_to_playbook(alert)
+                    
+                    if playbook_name:
+                        matched.append((index, alert_id, playbook_name, alert))
                         
-                        logger.info(f"Processing {len(hits)} alerts from {index}")
+                    else:
+                        logger.info(f"No playbook match for alert type: {alert.get('alert_type')}")
                         
-                        for hit in hits:
-                            alert = hit['_source']
-                            alert_id = hit['_id']
-                            
-                            # Match alert to playbook
-                            playbook_name = self.match_alert_to_playbook(alert)
-                            
-                            if playbook_name:
-                                logger.info(f"Matched alert to playbook: {playbook_name}")
-                                
-                                # Execute playbook
-                                execution_result = self.execute_playbook(
-                                    playbook_name,
-                                    alert
-                                )
-                                
-                                # Mark alert as processed
-                                self.es.update(
-                                    index=index,
-                                    id=alert_id,
-                                    body={
-                                        "doc": {
-                                            "soar_processed": True,
-                                            "playbook_executed": playbook_name,
-                                            "execution_time": datetime.utcnow().isoformat()
-                                        }
-                                    }
-                                )
-                                
-                            else:
-                                logger.info(f"No playbook match for alert type: {alert.get('alert_type')}")
-                                
-                    except Exception as e:
-                        logger.error(f"Error processing alerts from {index}: {str(e)}")
+            except Exception as e:
+                logger.error(f"Error processing alerts from {index}: {str(e)}")
+                
+        # One run per (playbook, key) window; repeats inside an open window only get marked
+        runs, suppressed = self.coalescer.group(matched)
+        for playbook_name, members, group_id in suppressed:
+            self.marker.record_many(members, playbook_name, {'coalesce_group': group_id, 'soar_suppressed': True})
+            
+        # Execute playbooks alongside each other, up to the concurrency cap
+        pending = {}
+        for playbook_name, context, members, group_id in runs:
+            logger.info(f"Running playbook {playbook_name} for {len(members)} alert(s)")
+            future = self.executor.submit(self.execute_playbook, playbook_name, context)
+            pending[future] = (playbook_name, members, group_id)
+            
+        # Journal each group as its playbook finishes, then mark the whole cycle in one request
+        for future in as_completed(pending):
+            playbook_name, members, group_id = pending[future]
+            try:
+                future.result()
+                self.marker.record_many(members, playbook_name, {'coalesce_group': group_id} if group_id else None)
+            except Exception as e:
+                if group_id:
+                    self.coalescer.release(group_id)
+                logger.error(f"Error running {playbook_name} for {len(members)} alert(s) "
+                             f"(first {members[0][1]} from {members[0][0]}): {str(e)}")
+                
+        if pending or suppressed:
+            unsent = self.marker.flush()
+            logger.info(f"Marked alerts processed: {self.marker.stats} | coalescing: {self.coalescer.stats}"
+                        + (f", {unsent} left for the next cycle" if unsent else ""))
                         
+    def process_alerts(self):
+        """Main alert processing loop"""
+        logger.info("Starting SOAR automation engine...")
+        
+        while True:
+            try:
+                self.poll_once()
+                
             except Exception as e:
                 logger.error(f"Error in SOAR processing loop: {str(e)}")
                 
             # Check for alerts every 30 seconds
             time.sleep(30)
 
+    def close(self):
+        self.executor.close()
+        self.writer.close()
+        self.action_history.close()
+
 if __name__ == '__main__':
-    soar = SOAREngine()
-    soar.process_alerts()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SOAR automation engine')
+    parser.add_argument('--max-concurrent-playbooks', type=int, default=4,
+                        help='Playbook executions running at once (default: 4)')
+    parser.add_argument('--max-concurrent-actions', type=int, default=16,
+                        help='Actions running at once across all playbooks (default: 16)')
+    parser.add_argument('--action-timeout', type=float, default=30.0,
+                        help='Seconds an action may run before its dependents are skipped (default: 30)')
+    parser.add_argument('--simulated-latency', type=float, default=1.0,
+                        help='Seconds each simulated action takes (default: 1)')
+    parser.add_argument('--spool', type=str, default='/var/lib/soar/records.spool',
+                        help='Local spool for action/execution records Elasticsearch could not take yet')
+    parser.add_argument('--write-batch-size', type=int, default=500,
+                        help='Records per _bulk request to soar-actions/playbook-executions (default: 500)')
+    parser.add_argument('--write-interval', type=float, default=2.0,
+                        help='Seconds before a partial batch of records is flushed (default: 2)')
+    parser.add_argument('--write-queue-size', type=int, default=10000,
+                        help='Records buffered in memory before the overflow policy applies (default: 10000)')
+    parser.add_argument('--write-overflow', type=str, default='spool', choices=OVERFLOW_POLICIES,
+                        help='What to do with records when the buffer is full (default: spool)')
+    parser.add_argument('--history-capacity', type=int, default=100000,
+                        help='Action records kept in memory before older ones spill to disk (default: 100000)')
+    parser.add_argument('--history-log', type=str, default='/var/lib/soar/action-history.log',
+                        help='Compressed on-disk log of older action records')
+    parser.add_argument('--coalesce-window', type=float, default=300.0,
+                        help='Seconds during which repeat alerts for the same playbook and key share one run; 0 disables (default: 300)')
+    parser.add_argument('--coalesce-on', type=str, nargs='+',
+                        help="Alert fields to coalesce on for every playbook, overriding each playbook's coalesce_on")
+    parser.add_argument('--journal', type=str, default='/var/lib/soar/processed.journal',
+                        help='Local journal of processed-alert updates not yet sent to Elasticsearch')
+    parser.add_argument('--acknowledge', type=str, nargs='+', choices=ALERT_INDICES,
+                        help='Mark every unprocessed alert in these indices processed without running playbooks, then exit')
+    parser.add_argument('--acknowledge-before', type=str, default='now',
+                        help='Only acknowledge alerts up to this time, e.g. now-1h (default: now)')
+
+    args = parser.parse_args()
+    soar = SOAREngine(
+        max_concurrent_playbooks=args.max_concurrent_playbooks,
+        max_concurrent_actions=args.max_concurrent_actions,
+        action_timeout=args.action_timeout,
+        simulated_latency=args.simulated_latency,
+        journal_path=args.journal,
+        spool_path=args.spool,
+        write_batch_size=args.write_batch_size,
+        write_interval=args.write_interval,
+        write_queue_size=args.write_queue_size,
+        write_overflow=args.write_overflow,
+        history_capacity=args.history_capacity,
+        history_path=args.history_log,
+        coalesce_window=args.coalesce_window,
+        coalesce_on=args.coalesce_on
+    )
+    try:
+        if args.acknowledge:
+            for index in args.acknowledge:
+                soar.marker.acknowledge(index, before=args.acknowledge_before)
+        else:
+            soar.process_alerts()
+    finally:
+        soar.close()